@@ -73,6 +73,7 @@ class Evaluator(AgentBase):
                 res = self.model(
                     prompt,
                     max_retries=20,
+                    method="reply",
                 )
                 res = res.text.strip("'")
                 # print(res)
@@ -8,6 +8,7 @@ from core.exceptions import ResponseParsingError
 from core.base_agent import AgentBase
 from core.message import Msg
 from core.parser import MarkdownJsonDictParser
+from core.pii import parse_pii_results
 
 from util.prompt_loader import *
 from util.data_loader import SafeDict
@@ -16,6 +17,11 @@ from util.parsing import parsing_function_response
 import litellm
 
 
+REASON_OVERFLOW_HINT = (
+    "The response is too long. Merge similar attributes or discard irrelevant/low-confidence attributes for next check."
+)
+
+
 class Profiler(AgentBase):
     """An agent class that used to plan, analysis, reason for profiling attack.
 
@@ -50,6 +56,7 @@ class Profiler(AgentBase):
         )
 
         self.count_token = count_token
+        self.target_attributes = target_attributes
         self.model.max_retries = 20
 
         if not sys_prompt.endswith("\n"):
@@ -75,7 +82,7 @@ class Profiler(AgentBase):
         self.reason_prompt = PROFILER_REASON_PROMPT.format_map(map_attr)
 
         # Put sys prompt into memory
-        self.memory.add(Msg("system", self.sys_prompt, role="system"))
+        self.memory.add(Msg("system", self.sys_prompt, role="system"), pin="system")
 
         self.think_parser = MarkdownJsonDictParser(
             content_hint={
@@ -84,6 +91,8 @@ class Profiler(AgentBase):
                 "instruction": "the command for next action",
             },
             required_keys=["think", "action", "instruction"],
+            schema={"action": {"type": "string", "enum": ["reason", "retrieval", "search", "finish"]}},
+            name="profiler_think",
         )
 
         self.reason_parser = MarkdownJsonDictParser(
@@ -101,217 +110,211 @@ class Profiler(AgentBase):
                 ),
             },
             required_keys=["results"],
+            schema={"results": PII_RESULTS_SCHEMA},
+            name="profiler_reason",
         )
 
     def reply(self, x: dict = None) -> dict:
         raise NotImplementedError
 
     def think(self, x: dict = None, reset=False) -> dict:
-        if reset:
-            # clear all previous memory
-            self.memory.clear()
-            # Put sys prompt into memory
-            self.memory.add(Msg("system", self.sys_prompt, role="system"))
-
-        # store the inferred PIIs
-        self.memory.add(x)
-        # we only store the last ouput of this iteration reasoning
-        start_mem_idx = self.memory.size()
+        start_mem_idx = self._begin_think(x, reset)
         # The agent will keep parsing the response until it is parsed successfully
         while True:
-            self.speak(f" [PROFILER] THINK ".center(70, "#"))
-
-            # Prepare hint to remind model what the response format is
-            # Won't be recorded in memory to save tokens
-            hint_msg = Msg(
-                "system",
-                self.think_parser.format_instruction,
-                role="system",
-            )
-
-            # Prepare prompt for the model
-            prompt = self.model.format(
-                self.memory.get_memory(), Msg("system", self.think_prompt, role="system"), hint_msg
-            )
+            prompt = self._prepare_prompt(" [PROFILER] THINK ", self.think_prompt, self.think_parser)
 
             # Generate and parse the response
             try:
-                if self.count_token:
-                    n_tokens = litellm.token_counter(model=self.model.model, messages=prompt)
-                    self.speak(f" Count input token {n_tokens} ".center(70, "#"))
                 res = self.model(
                     prompt,
                     parse_func=self.think_parser.parse,
+                    response_format=self.think_parser.response_format,
                     max_retries=1,
+                    method="think",
+                    prompt_tokens=self._prompt_tokens,
                 )
-
-                end_mem_idx = self.memory.size()
-                if end_mem_idx != start_mem_idx:
-                    # delete the memory from the last iteration (wrong parsing)
-                    delete_idx = list(range(start_mem_idx, end_mem_idx))
-                    self.memory.delete(delete_idx)
-
-                # Record the response in memory
-                msg_response = Msg(self.name, res.text, "assistant")
-                self.memory.add(msg_response)
-
-                # Print out the response
-                self.speak(msg_response)
-                # Break the loop if the response is parsed successfully
-                return res
+                return self._record_response(res, start_mem_idx)
             except ResponseParsingError as e:
-                # Print out raw response from models for developers to debug
-                response_msg = Msg(self.name, e.raw_response, "assistant")
-                self.speak(response_msg)
-
-                if "context_length_exceeded" in e.raw_response:
-                    print(f"tackling context_length_exceeded error: {e.raw_response}")
-                    error_msg = Msg(
-                        "system",
-                        "The response is too long. Only provide necessary information.",
-                        "system",
-                    )
-                    # clear the memory
-                    delete_idx = list(range(2, self.memory.size()))
-                    self.memory.delete(delete_idx)
-                    self.memory.add([error_msg])
-
-                # Re-correct by model itself
-                error_msg = Msg("system", str(e), "system")
-                self.speak(error_msg)
+                self._handle_parsing_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e, "The response is too long. Only provide necessary information.")
 
-                self.memory.add([response_msg, error_msg])
+    async def athink(self, x: dict = None, reset=False) -> dict:
+        """Async counterpart of `think`."""
+        start_mem_idx = self._begin_think(x, reset)
+        while True:
+            prompt = self._prepare_prompt(" [PROFILER] THINK ", self.think_prompt, self.think_parser)
+            try:
+                res = await self.model.acall(
+                    prompt,
+                    parse_func=self.think_parser.parse,
+                    response_format=self.think_parser.response_format,
+                    max_retries=1,
+                    method="think",
+                    prompt_tokens=self._prompt_tokens,
+                )
+                return self._record_response(res, start_mem_idx)
+            except ResponseParsingError as e:
+                self._handle_parsing_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e, "The response is too long. Only provide necessary information.")
 
     def reason(self, x: dict = None) -> dict:
-        # change role to reason
-        self.memory.add(x)
-        # we only store the last ouput of this iteration reasoning
-        start_mem_idx = self.memory.size()
+        start_mem_idx = self._begin_reason(x)
         # The agent will keep parsing the response until it is parsed successfully
         while True:
-            self.speak(f" [PROFILER] REASON ".center(70, "#"))
-
-            # Prepare hint to remind model what the response format is
-            # Won't be recorded in memory to save tokens
-            hint_msg = Msg(
-                "system",
-                self.reason_parser.format_instruction,
-                role="system",
-            )
-
-            # Prepare prompt for the model
-            prompt = self.model.format(
-                self.memory.get_memory(), Msg("system", self.reason_prompt, role="system"), hint_msg
-            )
+            prompt = self._prepare_prompt(" [PROFILER] REASON ", self.reason_prompt, self.reason_parser)
 
             # Generate and parse the response
             try:
-                if self.count_token:
-                    n_tokens = litellm.token_counter(model=self.model.model, messages=prompt)
-                    self.speak(f" Count input token {n_tokens} ".center(70, "#"))
                 res = self.model(
                     prompt,
-                    parse_func=self.reason_parser.parse,
+                    parse_func=self._parse_results,
+                    response_format=self.reason_parser.response_format,
                     max_retries=1,
+                    method="reason",
+                    prompt_tokens=self._prompt_tokens,
                 )
+                return self._record_response(res, start_mem_idx)
+            except ResponseParsingError as e:
+                self._handle_parsing_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e, REASON_OVERFLOW_HINT)
 
-                end_mem_idx = self.memory.size()
-                if end_mem_idx != start_mem_idx:
-                    # delete the memory from the last iteration (wrong parsing)
-                    delete_idx = list(range(start_mem_idx, end_mem_idx))
-                    self.memory.delete(delete_idx)
+    async def areason(self, x: dict = None) -> dict:
+        """Async counterpart of `reason`."""
+        start_mem_idx = self._begin_reason(x)
+        while True:
+            prompt = self._prepare_prompt(" [PROFILER] REASON ", self.reason_prompt, self.reason_parser)
+            try:
+                res = await self.model.acall(
+                    prompt,
+                    parse_func=self._parse_results,
+                    response_format=self.reason_parser.response_format,
+                    max_retries=1,
+                    method="reason",
+                    prompt_tokens=self._prompt_tokens,
+                )
+                return self._record_response(res, start_mem_idx)
+            except ResponseParsingError as e:
+                self._handle_parsing_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e, REASON_OVERFLOW_HINT)
 
-                # Record the response in memory
-                msg_response = Msg(self.name, res.text, "assistant")
-                self.memory.add(msg_response)
+    def naive_infer(self, missing_pii: list, user_history: str) -> dict:
+        naive_prompt = self._begin_naive_infer(missing_pii, user_history)
+        while True:
+            prompt = self._prepare_prompt(" [PROFILER] NAIVE REASON ", naive_prompt, self.reason_parser)
 
+            # Generate and parse the response
+            try:
+                res = self.model(
+                    prompt,
+                    parse_func=self._parse_results,
+                    response_format=self.reason_parser.response_format,
+                    max_retries=1,
+                    method="naive_infer",
+                    prompt_tokens=self._prompt_tokens,
+                )
                 # Print out the response
-                self.speak(msg_response)
+                self.speak(Msg(self.name, res.text, "assistant"))
                 # Break the loop if the response is parsed successfully
                 return res
             except ResponseParsingError as e:
-                # Print out raw response from models for developers to debug
-                response_msg = Msg(self.name, e.raw_response, "assistant")
-                self.speak(response_msg)
-
-                if "context_length_exceeded" in e.raw_response:
-                    print(f"tackling context_length_exceeded error: {e.raw_response}")
-                    error_msg = Msg(
-                        "system",
-                        "The response is too long. Merge similar attributes or discard irrelevant/low-confidence attributes for next check.",
-                        "system",
-                    )
-                    # clear the memory
-                    delete_idx = list(range(2, self.memory.size()))
-                    self.memory.delete(delete_idx)
-                    self.memory.add([error_msg])
+                self._handle_parsing_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e, "The response is too long. Only provide necessary information.")
+
+    async def anaive_infer(self, missing_pii: list, user_history: str) -> dict:
+        """Async counterpart of `naive_infer`."""
+        naive_prompt = self._begin_naive_infer(missing_pii, user_history)
+        while True:
+            prompt = self._prepare_prompt(" [PROFILER] NAIVE REASON ", naive_prompt, self.reason_parser)
+            try:
+                res = await self.model.acall(
+                    prompt,
+                    parse_func=self._parse_results,
+                    response_format=self.reason_parser.response_format,
+                    max_retries=1,
+                    method="naive_infer",
+                    prompt_tokens=self._prompt_tokens,
+                )
+                self.speak(Msg(self.name, res.text, "assistant"))
+                return res
+            except ResponseParsingError as e:
+                self._handle_parsing_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e, "The response is too long. Only provide necessary information.")
 
-                # Re-correct by model itself
-                error_msg = Msg("system", str(e), "system")
-                self.speak(error_msg)
+    def _parse_results(self, text: str) -> dict:
+        """Parse a reason response, validating its results into `PIIRecord`s of the target attributes."""
+        parsed = self.reason_parser.parse(text)
+        parsed["results"] = parse_pii_results(parsed["results"], self.target_attributes, raw_response=text)
+        return parsed
 
-                self.memory.add([response_msg, error_msg])
+    def _begin_think(self, x: dict, reset: bool) -> int:
+        if reset:
+            # clear all previous memory
+            self.memory.clear()
+            # Put sys prompt into memory
+            self.memory.add(Msg("system", self.sys_prompt, role="system"), pin="system")
 
-    def naive_infer(self, missing_pii: list, user_history: str) -> dict:
+        # store the inferred PIIs; the latest ones are never evicted from memory
+        self.memory.add(x, pin="piis" if reset else None)
+        # we only store the last ouput of this iteration reasoning
+        return self.memory.mark()
+
+    def _begin_reason(self, x: dict) -> int:
+        # change role to reason
+        self.memory.add(x)
+        # we only store the last ouput of this iteration reasoning
+        return self.memory.mark()
+
+    def _begin_naive_infer(self, missing_pii: list, user_history: str) -> str:
         self.memory.clear()
         # Put sys prompt into memory
         map_attr = SafeDict(
             attributes=", ".join(missing_pii),
             user_histories="\n".join(user_history),
         )
+        return PROFILER_NAIVE_PROMPT.format_map(map_attr)
 
-        naive_prompt = PROFILER_NAIVE_PROMPT.format_map(map_attr)
+    def _prepare_prompt(self, banner: str, role_prompt: str, parser: MarkdownJsonDictParser) -> list:
+        self.speak(banner.center(70, "#"))
 
         # Prepare hint to remind model what the response format is
         # Won't be recorded in memory to save tokens
-        hint_msg = Msg(
-            "system",
-            self.reason_parser.format_instruction,
-            role="system",
-        )
+        hint_msg = self._instruction(parser.format_instruction)
 
-        while True:
-            # Prepare prompt for the model
-            prompt = self.model.format(self.memory.get_memory(), Msg("system", naive_prompt, role="system"), hint_msg)
+        # Prepare prompt for the model
+        role_msg = self._instruction(role_prompt)
+        prompt = self._format_prompt(role_msg, hint_msg)
 
-            self.speak(f" [PROFILER] NAIVE REASON ".center(70, "#"))
-            # Generate and parse the response
-            try:
-                if self.count_token:
-                    n_tokens = litellm.token_counter(model=self.model.model, messages=prompt)
-                    self.speak(f" Count input token {n_tokens} ".center(70, "#"))
-                res = self.model(
-                    prompt,
-                    parse_func=self.reason_parser.parse,
-                    max_retries=1,
-                )
+        if self.count_token:
+            n_tokens = self._prompt_tokens
+            self.speak(f" Count input token {n_tokens} ".center(70, "#"))
+        return prompt
 
-                # Record the response in memory
-                msg_response = Msg(self.name, res.text, "assistant")
+    def _record_response(self, res: Any, start_mem_idx: int) -> Any:
+        # delete the memory from the last iteration (wrong parsing)
+        self.memory.delete_since(start_mem_idx)
 
-                # Print out the response
-                self.speak(msg_response)
-                # Break the loop if the response is parsed successfully
-                return res
-            except ResponseParsingError as e:
-                # Print out raw response from models for developers to debug
-                response_msg = Msg(self.name, e.raw_response, "assistant")
-                self.speak(response_msg)
-
-                if "context_length_exceeded" in e.raw_response:
-                    print(f"tackling context_length_exceeded error: {e.raw_response}")
-                    error_msg = Msg(
-                        "system",
-                        "The response is too long. Only provide necessary information.",
-                        "system",
-                    )
-                    # clear the memory
-                    delete_idx = list(range(2, self.memory.size()))
-                    self.memory.delete(delete_idx)
-                    self.memory.add([error_msg])
+        # Record the response in memory
+        msg_response = Msg(self.name, res.text, "assistant")
+        self.memory.add(msg_response)
+
+        # Print out the response
+        self.speak(msg_response)
+        # Break the loop if the response is parsed successfully
+        return res
+
+    def _handle_parsing_error(self, e: ResponseParsingError) -> None:
+        # Print out raw response from models for developers to debug
+        response_msg = Msg(self.name, e.raw_response, "assistant")
+        self.speak(response_msg)
 
-                # Re-correct by model itself
-                error_msg = Msg("system", str(e), "system")
-                self.speak(error_msg)
+        # Re-correct by model itself
+        error_msg = Msg("system", str(e), "system")
+        self.speak(error_msg)
 
-                self.memory.add([response_msg, error_msg])
+        self.memory.add([response_msg, error_msg])
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from typing import Any
+from typing import Any, List, Optional
 
 from loguru import logger
 import json
@@ -8,10 +8,9 @@ from core.exceptions import ResponseParsingError, FunctionCallError
 from core.base_agent import AgentBase
 from core.message import Msg
 from core.parser import MarkdownJsonDictParser
-from core.toolkit import ServiceToolkit
+from core.toolkit import ServiceExecStatus, ServiceResponse, ServiceToolkit
 
 from util.prompt_loader import RETRIEVER_PROMPT
-from util.parsing import parsing_function_response
 
 import litellm
 
@@ -67,12 +66,14 @@ class Retriever(AgentBase):
         if not sys_prompt.endswith("\n"):
             sys_prompt = sys_prompt + "\n"
 
+        # With native tool calling the tools are described by their schemas, not in the prompt
+        self._tools_in_prompt = not self.model.native_tools
         self.sys_prompt = "\n".join(
             [
                 # The brief intro of the role and target
                 sys_prompt.format(name=self.name),
                 # The instruction prompt for tools
-                self.service_toolkit.tools_instruction,
+                self.service_toolkit.tools_instruction if self._tools_in_prompt else "",
                 # The detailed instruction prompt for the agent
                 RETRIEVER_PROMPT,
             ],
@@ -88,92 +89,199 @@ class Retriever(AgentBase):
         )
 
     def reply(self, x: dict = None) -> dict:
-        # clear the memory
-        self.memory.clear()
-        # Put sys prompt into memory
-        self.memory.add(Msg("system", self.sys_prompt, role="system"))
-        # add the instruction
-        self.memory.add(x)
+        self._begin(x)
 
         # The agent will keep parsing the response until it is parsed successfully
         for i in range(self.max_iters):
-            self.speak(f" [RETRIEVER] Iter {i+1} STEP 1: PARSING ".center(70, "#"))
-
-            # Prepare hint to remind model what the response format is
-            # Won't be recorded in memory to save tokens
-            hint_msg = Msg(
-                "system",
-                self.parser.format_instruction,
-                role="system",
-            )
-
-            # Prepare prompt for the model
-            prompt = self.model.format(self.memory.get_memory(), hint_msg)
+            prompt = self._prepare_prompt(i)
 
             # Generate and parse the response
             try:
-                if self.count_token:
-                    n_tokens = litellm.token_counter(model=self.model.model, messages=prompt)
-                    self.speak(f" Count input token {n_tokens} ".center(70, "#"))
                 res = self.model(
                     prompt,
                     parse_func=self.parser.parse,
                     max_retries=1,
+                    method="reply",
+                    prompt_tokens=self._prompt_tokens,
+                    tools=self._tool_schemas(),
                 )
+                self._record_response(res)
+            except ResponseParsingError as e:
+                self._handle_parsing_error(e)
+                # Skip acting step to re-correct the response
+                continue
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e)
+                continue
 
-                # Record the response in memory
-                msg_response = Msg(self.name, res.text, "assistant")
-                self.memory.add(msg_response)
+            # Step 2: Acting
+            res_msg = self._act(res)
+            if res_msg is not None:
+                return res_msg
 
-                # Print out the response
-                self.speak(
-                    Msg(self.name, res.text, "assistant"),
-                )
+        return self._give_up()
 
+    async def areply(self, x: dict = None) -> dict:
+        """Async counterpart of `reply`.
+
+        The tool calls of one response run concurrently; blocking tools run
+        in worker threads to keep the event loop free for other agents.
+        """
+        self._begin(x)
+        for i in range(self.max_iters):
+            prompt = self._prepare_prompt(i)
+            try:
+                res = await self.model.acall(
+                    prompt,
+                    parse_func=self.parser.parse,
+                    max_retries=1,
+                    method="reply",
+                    prompt_tokens=self._prompt_tokens,
+                    tools=self._tool_schemas(),
+                )
+                self._record_response(res)
             except ResponseParsingError as e:
-                # Print out raw response from models for developers to debug
-                response_msg = Msg(self.name, e.raw_response, "assistant")
-                self.speak(response_msg)
+                self._handle_parsing_error(e)
+                continue
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e)
+                continue
 
-                # Re-correct by model itself
-                error_msg = Msg("system", str(e), "system")
-                self.speak(error_msg)
+            res_msg = await self._aact(res)
+            if res_msg is not None:
+                return res_msg
 
-                self.memory.add([response_msg, error_msg])
+        return self._give_up()
 
-                # Skip acting step to re-correct the response
-                continue
+    def _begin(self, x: dict) -> None:
+        # clear the memory
+        self.memory.clear()
+        # Put sys prompt into memory
+        self.memory.add(Msg("system", self.sys_prompt, role="system"), pin="system")
+        # add the instruction
+        self.memory.add(x)
 
-            # Step 2: Acting
-            self.speak(f" [RETRIEVER] STEP 2: ACTING ".center(70, "#"))
+    def _prepare_prompt(self, i: int) -> list:
+        self.speak(f" [RETRIEVER] Iter {i+1} STEP 1: PARSING ".center(70, "#"))
+
+        # Prepare hint to remind model what the response format is
+        # Won't be recorded in memory to save tokens
+        if self.model.native_tools:
+            instructions = []
+        elif self._tools_in_prompt:
+            instructions = [self._instruction(self.parser.format_instruction)]
+        else:
+            # The provider rejected native tool calls after the system prompt was built
+            instructions = [
+                self._instruction(self.service_toolkit.tools_instruction),
+                self._instruction(self.parser.format_instruction),
+            ]
+
+        # Prepare prompt for the model
+        prompt = self._format_prompt(*instructions)
+
+        if self.count_token:
+            n_tokens = self._prompt_tokens
+            self.speak(f" Count input token {n_tokens} ".center(70, "#"))
+        return prompt
+
+    def _tool_schemas(self) -> Optional[List[dict]]:
+        return self.service_toolkit.json_schemas if self.model.native_tools else None
+
+    def _record_response(self, res: Any) -> None:
+        if res.tool_calls:
+            # Native tool calls are kept in the text-mode format, so memory stays plain messages
+            calls = [{"name": c["name"], "arguments": c["arguments"]} for c in res.tool_calls]
+            res.parsed = {"thought": res.text, "function": calls}
+            text = json.dumps(res.parsed, ensure_ascii=False)
+        else:
+            text = res.text
+
+        # Record the response in memory
+        msg_response = Msg(self.name, text, "assistant")
+        self.memory.add(msg_response)
+
+        # Print out the response
+        self.speak(msg_response)
+
+    def _handle_parsing_error(self, e: ResponseParsingError) -> None:
+        # Print out raw response from models for developers to debug
+        response_msg = Msg(self.name, e.raw_response, "assistant")
+        self.speak(response_msg)
+
+        # Re-correct by model itself
+        error_msg = Msg("system", str(e), "system")
+        self.speak(error_msg)
+
+        self.memory.add([response_msg, error_msg])
+
+    def _act(self, res: Any) -> Optional[Msg]:
+        """Execute the parsed function calls; return None if the model should retry."""
+        self.speak(f" [RETRIEVER] STEP 2: ACTING ".center(70, "#"))
+
+        # Parse, check and execute the tool functions in service toolkit
+        try:
+            response_results = self.service_toolkit.parse_and_call_func(
+                res.parsed["function"],
+            )
+            ans = self._collect_results(response_results)
+        except Exception as e:
+            return self._handle_function_error(e)
 
-            # Parse, check and execute the tool functions in service toolkit
-            try:
-                response_results = self.service_toolkit.parse_and_call_func(
-                    res.parsed["function"],
-                )
-                # parsing the results
-                status, results = parsing_function_response(response_results)
-                if status == "fail":
-                    raise FunctionCallError(
-                        "The function calling failed. Need re-parsing the response.",
-                    )
-
-                ans = {"results": results}
-
-            except Exception as e:
-                # Catch the function calling error that can be handled by
-                # the model
-                error_msg = Msg("system", str(e), "system")
-                self.speak(error_msg)
-                self.memory.add(error_msg)
+        return self._respond(ans)
 
-                continue
+    async def _aact(self, res: Any) -> Optional[Msg]:
+        """Async counterpart of `_act`; blocking tools run in worker threads."""
+        self.speak(f" [RETRIEVER] STEP 2: ACTING ".center(70, "#"))
 
-            res_msg = Msg(self.name, ans, "assistant")
-            self.speak(res_msg)
-            return res_msg
+        try:
+            response_results = await self.service_toolkit.aparse_and_call_func(
+                res.parsed["function"],
+            )
+            ans = self._collect_results(response_results)
+        except Exception as e:
+            return self._handle_function_error(e)
+
+        return self._respond(ans)
+
+    def _collect_results(self, responses: List[ServiceResponse]) -> dict:
+        """Render the results of all calls once; fail only if no call succeeded."""
+        succeeded = [r for r in responses if r.status == ServiceExecStatus.SUCCESS]
+        failed = [r for r in responses if r.status != ServiceExecStatus.SUCCESS]
+        if not succeeded:
+            errors = "; ".join(f"{r.name or 'function'}: {r.content}" for r in failed)
+            raise FunctionCallError(
+                f"The function calling failed ({errors}). Need re-parsing the response.",
+            )
+        for r in failed:
+            self.speak(Msg("system", f"Function {r.name} failed: {r.content}", "system"))
+
+        if len(succeeded) == 1:
+            results = self._render_content(succeeded[0].content)
+        else:
+            results = "\n\n".join(f"[{r.name}]\n{self._render_content(r.content)}" for r in succeeded)
+        ans = {"results": results}
+        if failed:
+            ans["failed"] = [f"{r.name}: {r.content}" for r in failed]
+        return ans
+
+    @staticmethod
+    def _render_content(content: Any) -> str:
+        return content.strip() if isinstance(content, str) else str(content)
+
+    def _handle_function_error(self, e: Exception) -> None:
+        # Catch the function calling error that can be handled by
+        # the model
+        error_msg = Msg("system", str(e), "system")
+        self.speak(error_msg)
+        self.memory.add(error_msg)
+
+    def _respond(self, ans: dict) -> Msg:
+        res_msg = Msg(self.name, ans, "assistant")
+        self.speak(res_msg)
+        return res_msg
 
+    def _give_up(self) -> Msg:
         # Exceed the maximum iterations
         ans = {
             "status": "fail",
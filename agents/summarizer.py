@@ -8,13 +8,20 @@ from core.exceptions import ResponseParsingError
 from core.base_agent import AgentBase
 from core.message import Msg
 from core.parser import MarkdownJsonDictParser
+from core.pii import parse_pii_results
 
-from util.prompt_loader import SUMMARIZER_CHECK_PROMPT, SUMMARIZER_SUMMARY_PROMPT, attr_converter
+from util.prompt_loader import SUMMARIZER_CHECK_PROMPT, SUMMARIZER_SUMMARY_PROMPT, PII_RESULTS_SCHEMA, attr_converter
 from util.data_loader import SafeDict
 
 import litellm
 
 
+CHECK_OVERFLOW_HINT = (
+    "The attributes information is too long. Merge similar attributes or discard irrelevant/low-confidence "
+    "attributes for next check. You also do not need to provide the thought."
+)
+
+
 class Summarizer(AgentBase):
     """An agent class that used to summarize, reflect the inferred personal information.
 
@@ -49,6 +56,7 @@ class Summarizer(AgentBase):
         )
 
         self.count_token = count_token
+        self.target_attributes = target_attributes
         self.model.max_retries = 20
 
         if not sys_prompt.endswith("\n"):
@@ -87,6 +95,8 @@ class Summarizer(AgentBase):
                 ),
             },
             required_keys=["results"],
+            schema={"results": PII_RESULTS_SCHEMA},
+            name="summarizer_check",
         )
 
         self.summary_parser = MarkdownJsonDictParser(
@@ -95,134 +105,160 @@ class Summarizer(AgentBase):
                 "summary": "the natual language summary of the inferred information",
             },
             required_keys=["summary"],
+            schema={},
+            name="summarizer_summary",
         )
 
     def reply(self, x: dict = None) -> dict:
         raise NotImplementedError
 
     def check(self, x: dict = None) -> dict:
-        # clear the memory
-        self.memory.clear()
-        # add check system prompt
-        self.memory.add(Msg("system", self.check_prompt, role="system"))
-        # add current input
-        self.memory.add(x)
-
+        self._begin(self.check_prompt, x)
         # The agent will keep parsing the response until it is parsed successfully
         while True:
-            self.speak(f" [SUMMARIZER] CHECK ".center(70, "#"))
-
-            # Prepare hint to remind model what the response format is
-            # Won't be recorded in memory to save tokens
-            hint_msg = Msg(
-                "system",
-                self.check_parser.format_instruction,
-                role="system",
-            )
-
-            # Prepare prompt for the model
-            prompt = self.model.format(self.memory.get_memory(), hint_msg)
+            prompt = self._prepare_prompt(" [SUMMARIZER] CHECK ", self.check_parser)
 
             # Generate and parse the response
             try:
-                if self.count_token:
-                    n_tokens = litellm.token_counter(model=self.model.model, messages=prompt)
-                    self.speak(f" Count input token {n_tokens} ".center(70, "#"))
-                # print(prompt)
                 res = self.model(
                     prompt,
-                    parse_func=self.check_parser.parse,
+                    parse_func=self._parse_check,
+                    response_format=self.check_parser.response_format,
                     max_retries=1,
+                    method="check",
+                    prompt_tokens=self._prompt_tokens,
                 )
+                return self._validate_check(res)
+            except ResponseParsingError as e:
+                self._handle_check_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e, CHECK_OVERFLOW_HINT)
 
-                if type(res.parsed["results"]) != list:
-                    _type = type(res.parsed["results"])
-                    raise ResponseParsingError(
-                        f"The results should be a list of dict, not {_type}.",
-                        res.text,
-                    )
-
-                # do not store the response in memory
-                msg_response = Msg(self.name, res.text, "assistant")
-                # Print out the response
-                self.speak(msg_response)
-
-                # Break the loop if the response is parsed successfully
-                return res
+    async def acheck(self, x: dict = None) -> dict:
+        """Async counterpart of `check`."""
+        self._begin(self.check_prompt, x)
+        while True:
+            prompt = self._prepare_prompt(" [SUMMARIZER] CHECK ", self.check_parser)
+            try:
+                res = await self.model.acall(
+                    prompt,
+                    parse_func=self._parse_check,
+                    response_format=self.check_parser.response_format,
+                    max_retries=1,
+                    method="check",
+                    prompt_tokens=self._prompt_tokens,
+                )
+                return self._validate_check(res)
             except ResponseParsingError as e:
-                # Print out raw response from models for developers to debug
-                response_msg = Msg(self.name, e.raw_response, "assistant")
-                self.speak(response_msg)
-
-                if "context_length_exceeded" in e.raw_response:
-                    print(f"tackling context_length_exceeded error: {e.raw_response}")
-                    error_msg = Msg(
-                        "system",
-                        "The attributes information is too long. Merge similar attributes or discard irrelevant/low-confidence attributes for next check. You also do not need to provide the thought.",
-                        "system",
-                    )
-                    # clear the memory
-                    delete_idx = list(range(2, self.memory.size()))
-                    self.memory.delete(delete_idx)
-                    self.memory.add([error_msg])
-
-                else:
-                    # normal parsing error
-                    # Re-correct by model itself
-                    error_msg = Msg("system", str(e), "system")
-                    self.speak(error_msg)
-
-                    self.memory.add([response_msg, error_msg])
+                self._handle_check_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e, CHECK_OVERFLOW_HINT)
 
     def summary(self, x: dict = None) -> dict:
-        # clear the memory
-        self.memory.clear()
-        # add check system prompt
-        self.memory.add(Msg("system", self.summary_prompt, role="system"))
-        # add current input
-        self.memory.add(x)
-
+        self._begin(self.summary_prompt, x)
         # The agent will keep parsing the response until it is parsed successfully
         while True:
-            self.speak(f" [SUMMARIZER] SUMMARY ".center(70, "#"))
-
-            # Prepare hint to remind model what the response format is
-            # Won't be recorded in memory to save tokens
-            hint_msg = Msg(
-                "system",
-                self.summary_parser.format_instruction,
-                role="system",
-            )
-
-            # Prepare prompt for the model
-            prompt = self.model.format(
-                self.memory.get_memory(), Msg("system", self.summary_prompt, role="system"), hint_msg
-            )
+            prompt = self._prepare_prompt(" [SUMMARIZER] SUMMARY ", self.summary_parser, self.summary_prompt)
 
             # Generate and parse the response
             try:
-                if self.count_token:
-                    n_tokens = litellm.token_counter(model=self.model.model, messages=prompt)
-                    self.speak(f" Count input token {n_tokens} ".center(70, "#"))
                 res = self.model(
                     prompt,
                     parse_func=self.summary_parser.parse,
+                    response_format=self.summary_parser.response_format,
                     max_retries=1,
+                    method="summary",
+                    prompt_tokens=self._prompt_tokens,
                 )
 
                 # do not store the response in memory
-                msg_response = Msg(self.name, res.text, "assistant")
-                self.speak(msg_response)
+                self.speak(Msg(self.name, res.text, "assistant"))
 
                 # Break the loop if the response is parsed successfully
                 return res
             except ResponseParsingError as e:
-                # Print out raw response from models for developers to debug
-                response_msg = Msg(self.name, e.raw_response, "assistant")
-                self.speak(response_msg)
+                self._handle_summary_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e)
+
+    async def asummary(self, x: dict = None) -> dict:
+        """Async counterpart of `summary`."""
+        self._begin(self.summary_prompt, x)
+        while True:
+            prompt = self._prepare_prompt(" [SUMMARIZER] SUMMARY ", self.summary_parser, self.summary_prompt)
+            try:
+                res = await self.model.acall(
+                    prompt,
+                    parse_func=self.summary_parser.parse,
+                    response_format=self.summary_parser.response_format,
+                    max_retries=1,
+                    method="summary",
+                    prompt_tokens=self._prompt_tokens,
+                )
+                self.speak(Msg(self.name, res.text, "assistant"))
+                return res
+            except ResponseParsingError as e:
+                self._handle_summary_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e)
+
+    def _begin(self, sys_prompt: str, x: dict) -> None:
+        # clear the memory
+        self.memory.clear()
+        # add check system prompt
+        self.memory.add(Msg("system", sys_prompt, role="system"), pin="system")
+        # add current input
+        self.memory.add(x)
+
+    def _prepare_prompt(self, banner: str, parser: MarkdownJsonDictParser, role_prompt: str = None) -> list:
+        self.speak(banner.center(70, "#"))
+
+        # Prepare hint to remind model what the response format is
+        # Won't be recorded in memory to save tokens
+        hint_msg = self._instruction(parser.format_instruction)
+
+        # Prepare prompt for the model
+        instructions = [hint_msg] if role_prompt is None else [self._instruction(role_prompt), hint_msg]
+        prompt = self._format_prompt(*instructions)
+
+        if self.count_token:
+            n_tokens = self._prompt_tokens
+            self.speak(f" Count input token {n_tokens} ".center(70, "#"))
+        return prompt
+
+    def _parse_check(self, text: str) -> dict:
+        """Parse a check response, validating its results into `PIIRecord`s of the target attributes."""
+        parsed = self.check_parser.parse(text)
+        parsed["results"] = parse_pii_results(parsed["results"], self.target_attributes, raw_response=text)
+        return parsed
+
+    def _validate_check(self, res: Any) -> Any:
+        # do not store the response in memory
+        msg_response = Msg(self.name, res.text, "assistant")
+        # Print out the response
+        self.speak(msg_response)
+
+        # Break the loop if the response is parsed successfully
+        return res
+
+    def _handle_check_error(self, e: ResponseParsingError) -> None:
+        # Print out raw response from models for developers to debug
+        response_msg = Msg(self.name, e.raw_response, "assistant")
+        self.speak(response_msg)
+
+        # Re-correct by model itself
+        error_msg = Msg("system", str(e), "system")
+        self.speak(error_msg)
+
+        self.memory.add([response_msg, error_msg])
+
+    def _handle_summary_error(self, e: ResponseParsingError) -> None:
+        # Print out raw response from models for developers to debug
+        response_msg = Msg(self.name, e.raw_response, "assistant")
+        self.speak(response_msg)
 
-                # Re-correct by model itself
-                error_msg = Msg("system", str(e), "system")
-                self.speak(error_msg)
+        # Re-correct by model itself
+        error_msg = Msg("system", str(e), "system")
+        self.speak(error_msg)
 
-                self.memory.add([response_msg, error_msg])
+        self.memory.add([response_msg, error_msg])
@@ -7,6 +7,8 @@ from core.base_agent import AgentBase
 from core.message import Msg
 from core.parser import MarkdownJsonDictParser
 
+import litellm
+
 
 class Tagger(AgentBase):
     """An agent that tags personal attributes from text."""
@@ -33,37 +35,25 @@ class Tagger(AgentBase):
                 "result": "attribute name, separated by comma",
             },
             required_keys=["think", "result"],
+            schema={},
+            name="tagger",
         )
 
     def reply(self, x: Msg = None) -> Any:
-        # clear all previous memory
-        self.memory.clear()
-        # Put sys prompt into memory
-        self.memory.add(Msg("system", self.sys_prompt, role="system"))
-
-        # store the input message
-        self.memory.add(x)
-        self.speak(x)
+        self._begin(x)
 
         # Keep parsing until success
         while True:
-            self.speak(f" [Tagger] tagging ".center(70, "#"))
-
-            # Prepare hint (not recorded in memory)
-            hint_msg = Msg(
-                "system",
-                self.parser.format_instruction,
-                role="system",
-            )
-
-            # Prepare prompt
-            prompt = self.model.format(self.memory.get_memory(), hint_msg)
+            prompt = self._prepare_prompt()
 
             try:
                 res = self.model(
                     prompt,
                     parse_func=self.parser.parse,
+                    response_format=self.parser.response_format,
                     max_retries=20,
+                    method="reply",
+                    prompt_tokens=self._prompt_tokens,
                 )
 
                 msg_response = Msg(self.name, res.text, "assistant")
@@ -71,21 +61,55 @@ class Tagger(AgentBase):
                 return res
 
             except ResponseParsingError as e:
-                response_msg = Msg(self.name, e.raw_response, "assistant")
-                self.speak(response_msg)
-
-                if "context_length_exceeded" in e.raw_response:
-                    logger.warning(f"Context length exceeded: {e.raw_response}")
-                    error_msg = Msg(
-                        "system",
-                        "The response is too long. Only provide necessary information.",
-                        "system",
-                    )
-                    delete_idx = list(range(2, self.memory.size()))
-                    self.memory.delete(delete_idx)
-                    self.memory.add([error_msg])
-
-                # Re-correct by model itself
-                error_msg = Msg("system", str(e), "system")
-                self.speak(error_msg)
-                self.memory.add([response_msg, error_msg])
+                self._handle_parsing_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e, "The response is too long. Only provide necessary information.")
+
+    async def areply(self, x: Msg = None) -> Any:
+        """Async counterpart of `reply`."""
+        self._begin(x)
+        while True:
+            prompt = self._prepare_prompt()
+            try:
+                res = await self.model.acall(
+                    prompt,
+                    parse_func=self.parser.parse,
+                    response_format=self.parser.response_format,
+                    max_retries=20,
+                    method="reply",
+                    prompt_tokens=self._prompt_tokens,
+                )
+                self.speak(Msg(self.name, res.text, "assistant"))
+                return res
+            except ResponseParsingError as e:
+                self._handle_parsing_error(e)
+            except litellm.ContextWindowExceededError as e:
+                self._handle_context_overflow(e, "The response is too long. Only provide necessary information.")
+
+    def _begin(self, x: Msg) -> None:
+        # clear all previous memory
+        self.memory.clear()
+        # Put sys prompt into memory
+        self.memory.add(Msg("system", self.sys_prompt, role="system"), pin="system")
+
+        # store the input message
+        self.memory.add(x)
+        self.speak(x)
+
+    def _prepare_prompt(self) -> list:
+        self.speak(f" [Tagger] tagging ".center(70, "#"))
+
+        # Prepare hint (not recorded in memory)
+        hint_msg = self._instruction(self.parser.format_instruction)
+
+        # Prepare prompt
+        return self._format_prompt(hint_msg)
+
+    def _handle_parsing_error(self, e: ResponseParsingError) -> None:
+        response_msg = Msg(self.name, e.raw_response, "assistant")
+        self.speak(response_msg)
+
+        # Re-correct by model itself
+        error_msg = Msg("system", str(e), "system")
+        self.speak(error_msg)
+        self.memory.add([response_msg, error_msg])
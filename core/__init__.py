@@ -1,7 +1,11 @@
 from core.message import Msg, ModelResponse
+from core.pii import PIIRecord
 from core.memory import Memory
 from core.parser import MarkdownJsonDictParser
 from core.toolkit import ServiceToolkit, ServiceResponse, ServiceExecStatus
+from core.cache import ResponseCache
+from core.ratelimit import RateLimiter
+from core.mock import MockBackend
 from core.base_agent import AgentBase, LLMClient
-from core.exceptions import ResponseParsingError, FunctionCallError
+from core.exceptions import ResponseParsingError, FunctionCallError, FixtureNotFoundError
 from core.embedding import LiteLLMEmbedding
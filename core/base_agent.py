@@ -1,21 +1,92 @@
-from typing import Any, Callable, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+import asyncio
 import time
+from contextlib import contextmanager
 
 import litellm
 from loguru import logger
 
-from core.exceptions import ResponseParsingError
+from core.cache import ResponseCache
+from core.exceptions import FixtureNotFoundError, ResponseParsingError
+from core.json_repair import repair_json
 from core.memory import Memory
+from core.mock import MockBackend
+from core.ratelimit import RateLimiter
+from core.telemetry import CallRecord, TelemetrySink
 from core.message import ModelResponse, Msg
+from core.parser import JsonBlockDetector
+
+
+def rate_limit_wait(
+    error: Exception, rl_attempt: int, max_attempts: int, limiter: Optional[RateLimiter] = None
+) -> float:
+    """Return the backoff for a rate-limit error, re-raising once retries run out.
+
+    The provider's Retry-After hint is honored when present, otherwise the
+    backoff grows exponentially from one second. With a limiter the pause is
+    applied to the shared bucket, so every worker holds off and the next
+    admission does the waiting.
+    """
+    if rl_attempt >= max_attempts - 1:
+        raise error
+    is_rate_limit = isinstance(error, litellm.RateLimitError)
+    label = "Rate limit" if is_rate_limit else "Service unavailable"
+    wait = retry_after(error)
+    if wait is None:
+        wait = min(2 ** rl_attempt, 120)
+    logger.warning(f"{label} (attempt {rl_attempt + 1}), waiting {wait}s")
+    if is_rate_limit and limiter is not None:
+        limiter.penalize(wait)
+        return 0.0
+    return wait
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
 
 
 class LLMClient:
     """Thin wrapper around litellm.completion() replacing AgentScope model wrappers."""
 
-    def __init__(self, model: str, max_retries: int = 20, **model_kwargs: Any) -> None:
+    max_rate_limit_retries = 10
+    # Providers that need explicit cache_control markers; OpenAI caches long prefixes automatically
+    cache_control_providers = ("anthropic", "gemini", "vertex_ai", "bedrock")
+    # Completion tokens reserved from the TPM budget when `max_tokens` is not set
+    expected_output_tokens = 512
+
+    def __init__(
+        self,
+        model: str,
+        max_retries: int = 20,
+        cache: Optional[ResponseCache] = None,
+        limiter: Optional[RateLimiter] = None,
+        stream: bool = False,
+        prompt_caching: bool = False,
+        structured_output: bool = False,
+        native_tools: bool = False,
+        context_window: Optional[int] = None,
+        telemetry: Optional[TelemetrySink] = None,
+        backend: Optional[MockBackend] = None,
+        agent: str = "",
+        **model_kwargs: Any,
+    ) -> None:
         self.model = model
+        self.telemetry = telemetry
+        self.backend = backend
+        self.agent = agent
         self.max_retries = max_retries
+        self.cache = cache
+        self.limiter = limiter
+        self.stream = stream
+        self.prompt_caching = prompt_caching
+        self.structured_output = structured_output and self._supports_response_schema()
+        self.native_tools = native_tools and self._supports_function_calling()
+        self.context_window = context_window or self._model_context_window()
         self.model_kwargs = model_kwargs
 
     def __call__(
@@ -23,6 +94,10 @@ class LLMClient:
         messages: List[dict],
         parse_func: Optional[Callable[[str], dict]] = None,
         max_retries: Optional[int] = None,
+        method: str = "",
+        response_format: Optional[dict] = None,
+        tools: Optional[List[dict]] = None,
+        prompt_tokens: Optional[int] = None,
     ) -> ModelResponse:
         """Call the LLM and optionally parse the response.
 
@@ -30,6 +105,18 @@ class LLMClient:
             messages: OpenAI-format message list.
             parse_func: Optional function to parse the response text.
             max_retries: Override instance max_retries for this call.
+            method: Name of the calling agent method, recorded in telemetry.
+            response_format: JSON schema response format, e.g. from
+                `MarkdownJsonDictParser.response_format`. Only sent when
+                structured output is enabled and the model supports it.
+            tools: OpenAI-style tool schemas, e.g. from
+                `ServiceToolkit.json_schemas`. Only sent when native tools
+                are enabled and the model supports function calling; the
+                calls are returned in `ModelResponse.tool_calls` and
+                `parse_func` then only runs on plain-text replies.
+            prompt_tokens: Input tokens of `messages` if the caller already
+                knows them, e.g. from the running total of its `Memory`;
+                they are only counted here otherwise.
 
         Returns:
             ModelResponse with text and optional parsed dict.
@@ -37,28 +124,55 @@ class LLMClient:
         Raises:
             ResponseParsingError: If parse_func fails after retries.
         """
+        with self._track(method) as call:
+            request_kwargs = self._request_kwargs(response_format, tools, call)
+            if self.cache is None:
+                return call.finish(self._complete(messages, parse_func, max_retries, call, request_kwargs, prompt_tokens))
+
+            key = self.cache.key(self.model, messages, **self.model_kwargs, **request_kwargs)
+            res = self._cached(key, parse_func)
+            if res is not None:
+                return call.finish(res)
+            # Identical requests in flight are sent once; the others reuse the stored text
+            with self.cache.flight(key) as text:
+                res = self._from_cache(key, text, parse_func)
+                if res is None:
+                    res = self._complete(messages, parse_func, max_retries, call, request_kwargs, prompt_tokens)
+                    self._store(key, res)
+            return call.finish(res)
+
+    def _complete(
+        self,
+        messages: List[dict],
+        parse_func: Optional[Callable[[str], dict]],
+        max_retries: Optional[int],
+        call: "_CallTracker",
+        request_kwargs: dict,
+        prompt_tokens: Optional[int] = None,
+    ) -> ModelResponse:
         retries = max_retries if max_retries is not None else self.max_retries
-        max_rate_limit_retries = 10
+        # Estimated once: every attempt sends the same prompt
+        estimate = self._estimate_tokens(messages, prompt_tokens)
 
         for attempt in range(retries):
             # Inner loop: retry only rate-limit / quota errors with backoff
-            for rl_attempt in range(max_rate_limit_retries):
+            for rl_attempt in range(self.max_rate_limit_retries):
+                # Wait for the shared budget before sending rather than after a 429
+                if self.limiter is not None:
+                    self.limiter.acquire(estimate)
                 try:
-                    response = litellm.completion(
-                        model=self.model,
-                        messages=messages,
-                        **self.model_kwargs,
-                    )
+                    response, timing = self._send(messages, **request_kwargs)
+                    self._settle(estimate, response)
                     break  # success, exit rate-limit retry loop
                 except (litellm.RateLimitError, litellm.ServiceUnavailableError) as e:
-                    label = "Rate limit" if isinstance(e, litellm.RateLimitError) else "Service unavailable"
-                    if rl_attempt < max_rate_limit_retries - 1:
-                        wait = max(20, min(2 ** rl_attempt, 120))
-                        logger.warning(f"{label} (attempt {rl_attempt + 1}), waiting {wait}s")
-                        time.sleep(wait)
-                        continue
-                    raise
+                    call.record.rate_limit_retries += 1
+                    time.sleep(self._rate_limit_wait(e, rl_attempt))
                 except Exception as e:
+                    if self._drop_unsupported(e, request_kwargs, call):
+                        continue
+                    # Sending the same request again cannot help
+                    if isinstance(e, (FixtureNotFoundError, litellm.ContextWindowExceededError)):
+                        raise
                     # Non-rate-limit error: let outer loop handle retries
                     if attempt == retries - 1:
                         raise
@@ -69,31 +183,351 @@ class LLMClient:
                 continue
 
             try:
-                text = response.choices[0].message.content or ""
-            except (AttributeError, UnboundLocalError):
+                return self._parse_response(response, parse_func, **timing)
+            except (AttributeError, UnboundLocalError, ResponseParsingError) as e:
+                if isinstance(e, ResponseParsingError):
+                    call.record.parse_failures += 1
                 if attempt == retries - 1:
                     raise
                 continue
 
-            parsed = None
-            if parse_func is not None:
+        # Should not reach here, but just in case
+        raise RuntimeError("Exhausted retries without success or exception")
+
+    async def acall(
+        self,
+        messages: List[dict],
+        parse_func: Optional[Callable[[str], dict]] = None,
+        max_retries: Optional[int] = None,
+        method: str = "",
+        response_format: Optional[dict] = None,
+        tools: Optional[List[dict]] = None,
+        prompt_tokens: Optional[int] = None,
+    ) -> ModelResponse:
+        """Async counterpart of `__call__` built on litellm.acompletion().
+
+        Retry and parsing semantics are identical to the sync call, but
+        rate-limit backoff awaits instead of blocking, so many calls can be
+        in flight on one event loop.
+        """
+        with self._track(method) as call:
+            request_kwargs = self._request_kwargs(response_format, tools, call)
+            if self.cache is None:
+                return call.finish(await self._acomplete(messages, parse_func, max_retries, call, request_kwargs, prompt_tokens))
+
+            key = self.cache.key(self.model, messages, **self.model_kwargs, **request_kwargs)
+            # SQLite lookups may wait on other workers' locks, so they run off the event loop
+            res = await asyncio.to_thread(self._cached, key, parse_func)
+            if res is not None:
+                return call.finish(res)
+            async with self.cache.aflight(key) as text:
+                res = await asyncio.to_thread(self._from_cache, key, text, parse_func)
+                if res is None:
+                    res = await self._acomplete(messages, parse_func, max_retries, call, request_kwargs, prompt_tokens)
+                    await asyncio.to_thread(self._store, key, res)
+            return call.finish(res)
+
+    async def _acomplete(
+        self,
+        messages: List[dict],
+        parse_func: Optional[Callable[[str], dict]],
+        max_retries: Optional[int],
+        call: "_CallTracker",
+        request_kwargs: dict,
+        prompt_tokens: Optional[int] = None,
+    ) -> ModelResponse:
+        retries = max_retries if max_retries is not None else self.max_retries
+        # Estimated once: every attempt sends the same prompt
+        estimate = self._estimate_tokens(messages, prompt_tokens)
+
+        for attempt in range(retries):
+            for rl_attempt in range(self.max_rate_limit_retries):
+                if self.limiter is not None:
+                    await self.limiter.aacquire(estimate)
                 try:
-                    parsed = parse_func(text)
-                except ResponseParsingError:
+                    response, timing = await self._asend(messages, **request_kwargs)
+                    await asyncio.to_thread(self._settle, estimate, response)
+                    break
+                except (litellm.RateLimitError, litellm.ServiceUnavailableError) as e:
+                    call.record.rate_limit_retries += 1
+                    await asyncio.sleep(await asyncio.to_thread(self._rate_limit_wait, e, rl_attempt))
+                except Exception as e:
+                    if self._drop_unsupported(e, request_kwargs, call):
+                        continue
+                    # Sending the same request again cannot help
+                    if isinstance(e, (FixtureNotFoundError, litellm.ContextWindowExceededError)):
+                        raise
                     if attempt == retries - 1:
                         raise
-                    continue
+                    logger.warning(f"LLM call attempt {attempt + 1} failed: {e}")
+                    break
+            else:
+                continue
 
-            return ModelResponse(text=text, parsed=parsed)
+            try:
+                return self._parse_response(response, parse_func, **timing)
+            except (AttributeError, UnboundLocalError, ResponseParsingError) as e:
+                if isinstance(e, ResponseParsingError):
+                    call.record.parse_failures += 1
+                if attempt == retries - 1:
+                    raise
+                continue
 
-        # Should not reach here, but just in case
         raise RuntimeError("Exhausted retries without success or exception")
 
-    def format(self, *args: Union[Msg, List[Msg], dict]) -> List[dict]:
+    @contextmanager
+    def _track(self, method: str):
+        """Measure one call and emit its `CallRecord` to the telemetry sink."""
+        call = _CallTracker(CallRecord(agent=self.agent, method=method, model=self.model))
+        started = time.perf_counter()
+        try:
+            yield call
+        except BaseException as e:
+            call.record.error = type(e).__name__
+            raise
+        finally:
+            call.record.latency = time.perf_counter() - started
+            if self.telemetry is not None:
+                self.telemetry.emit(call.record)
+
+    def _model_context_window(self) -> Optional[int]:
+        try:
+            return litellm.get_model_info(self.model).get("max_input_tokens")
+        except Exception:
+            # Models unknown to litellm
+            return None
+
+    def prompt_budget(self) -> Optional[int]:
+        """Tokens available for the prompt after reserving the completion, or None if unknown."""
+        if self.context_window is None:
+            return None
+        return self.context_window - self.model_kwargs.get("max_tokens", self.expected_output_tokens)
+
+    def _supports_response_schema(self) -> bool:
+        try:
+            return litellm.supports_response_schema(model=self.model)
+        except Exception:
+            return False
+
+    def _supports_function_calling(self) -> bool:
+        try:
+            return litellm.supports_function_calling(model=self.model)
+        except Exception:
+            return False
+
+    def _request_kwargs(
+        self, response_format: Optional[dict], tools: Optional[List[dict]], call: "_CallTracker"
+    ) -> dict:
+        """Per-call request options; schemas and tools are only sent to models that support them."""
+        kwargs = {}
+        if response_format is not None and self.structured_output:
+            call.record.structured_output = True
+            kwargs["response_format"] = response_format
+        if tools and self.native_tools:
+            call.record.native_tools = True
+            kwargs["tools"] = tools
+        return kwargs
+
+    def _drop_response_format(self, error: Exception, request_kwargs: dict, call: "_CallTracker") -> bool:
+        """Fall back to prompt-only formatting if the provider rejects the schema.
+
+        Returns True if the request should be sent again without it.
+        """
+        if "response_format" not in request_kwargs or not isinstance(error, litellm.BadRequestError):
+            return False
+        if not any(word in str(error).lower() for word in ("response_format", "schema")):
+            return False
+        logger.warning(f"{self.model} rejected the response schema, falling back to markdown parsing: {error}")
+        request_kwargs.pop("response_format")
+        self.structured_output = False
+        call.record.structured_output = False
+        return True
+
+    def _drop_tools(self, error: Exception, request_kwargs: dict, call: "_CallTracker") -> bool:
+        """Fall back to text-mode tool calls if the provider rejects the tool schemas.
+
+        Returns True if the request should be sent again without them.
+        """
+        if "tools" not in request_kwargs or not isinstance(error, litellm.BadRequestError):
+            return False
+        if not any(word in str(error).lower() for word in ("tool", "function")):
+            return False
+        logger.warning(f"{self.model} rejected the tool schemas, falling back to text-mode tool calls: {error}")
+        request_kwargs.pop("tools")
+        self.native_tools = False
+        call.record.native_tools = False
+        return True
+
+    def _drop_unsupported(self, error: Exception, request_kwargs: dict, call: "_CallTracker") -> bool:
+        return self._drop_response_format(error, request_kwargs, call) or self._drop_tools(error, request_kwargs, call)
+
+    def _store(self, key: str, res: ModelResponse) -> None:
+        # The cache holds response text only; tool calls are not replayable from it
+        if not res.tool_calls:
+            self.cache.put(key, self.model, res.text)
+
+    def _send(self, messages: List[dict], **request_kwargs: Any) -> Tuple[Any, dict]:
+        """Send one completion request; returns the response and stream timings.
+
+        In streaming mode the generation is cancelled as soon as the first JSON
+        block has closed, since the parsers never look past it.
+        """
+        completion = self.backend.completion if self.backend is not None else litellm.completion
+        # Tool calls carry no JSON block to stop at, so they are never streamed
+        if not self.stream or "tools" in request_kwargs:
+            return completion(model=self.model, messages=messages, **self.model_kwargs, **request_kwargs), {}
+
+        started = time.perf_counter()
+        stream = completion(
+            model=self.model, messages=messages, stream=True, **self.model_kwargs, **request_kwargs
+        )
+        detector, chunks, timing = JsonBlockDetector(), [], {}
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                if self._on_chunk(chunk, detector, timing, started):
+                    break
+        finally:
+            completion_stream = getattr(stream, "completion_stream", None)
+            if callable(getattr(completion_stream, "close", None)):
+                completion_stream.close()
+        return litellm.stream_chunk_builder(chunks, messages=messages), timing
+
+    async def _asend(self, messages: List[dict], **request_kwargs: Any) -> Tuple[Any, dict]:
+        """Async counterpart of `_send`."""
+        acompletion = self.backend.acompletion if self.backend is not None else litellm.acompletion
+        if not self.stream or "tools" in request_kwargs:
+            response = await acompletion(model=self.model, messages=messages, **self.model_kwargs, **request_kwargs)
+            return response, {}
+
+        started = time.perf_counter()
+        stream = await acompletion(
+            model=self.model, messages=messages, stream=True, **self.model_kwargs, **request_kwargs
+        )
+        detector, chunks, timing = JsonBlockDetector(), [], {}
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                if self._on_chunk(chunk, detector, timing, started):
+                    break
+        finally:
+            if callable(getattr(stream, "aclose", None)):
+                await stream.aclose()
+        return litellm.stream_chunk_builder(chunks, messages=messages), timing
+
+    @staticmethod
+    def _on_chunk(chunk: Any, detector: JsonBlockDetector, timing: dict, started: float) -> bool:
+        """Record stream timings; return True once the first JSON block is complete."""
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if not delta:
+            return False
+        now = time.perf_counter()
+        timing.setdefault("ttft", now - started)
+        if detector.feed(delta):
+            timing["time_to_parse"] = now - started
+            logger.debug(f"JSON block closed after {timing['time_to_parse']:.2f}s (first token {timing['ttft']:.2f}s)")
+            return True
+        return False
+
+    def _estimate_tokens(self, messages: List[dict], prompt_tokens: Optional[int] = None) -> int:
+        """Estimate prompt + completion tokens of a request for the TPM budget."""
+        if self.limiter is None or not self.limiter.tpm:
+            return 0
+        if prompt_tokens is None:
+            prompt_tokens = litellm.token_counter(model=self.model, messages=messages)
+        return prompt_tokens + self.model_kwargs.get("max_tokens", self.expected_output_tokens)
+
+    def _settle(self, estimate: int, response: Any) -> None:
+        """Report the real token usage of an admitted request to the limiter."""
+        usage = getattr(response, "usage", None)
+        if self.limiter is not None and usage is not None:
+            self.limiter.settle(estimate, usage.total_tokens or 0)
+
+    def _rate_limit_wait(self, error: Exception, rl_attempt: int) -> float:
+        return rate_limit_wait(error, rl_attempt, self.max_rate_limit_retries, self.limiter)
+
+    def _cached(self, key: str, parse_func: Optional[Callable[[str], dict]]) -> Optional[ModelResponse]:
+        return self._from_cache(key, self.cache.get(key), parse_func)
+
+    def _from_cache(
+        self,
+        key: str,
+        text: Optional[str],
+        parse_func: Optional[Callable[[str], dict]],
+    ) -> Optional[ModelResponse]:
+        """Rebuild a response from cached text; unparseable entries are dropped."""
+        if text is None:
+            return None
+        try:
+            parsed = parse_func(text) if parse_func is not None else None
+        except ResponseParsingError:
+            self.cache.delete(key)
+            return None
+        return ModelResponse(text=text, parsed=parsed, cached=True)
+
+    @staticmethod
+    def _parse_response(
+        response: Any,
+        parse_func: Optional[Callable[[str], dict]],
+        **timing: float,
+    ) -> ModelResponse:
+        """Extract the text and tool calls of a completion and run the optional parser on the text."""
+        message = response.choices[0].message
+        text = message.content or ""
+        tool_calls = LLMClient._tool_calls(message, text)
+        parsed = parse_func(text) if parse_func is not None and not tool_calls else None
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or getattr(usage, "cache_read_input_tokens", None) or 0)
+        if cached_tokens:
+            logger.debug(f"Prompt cache hit: {cached_tokens}/{usage.prompt_tokens} input tokens")
+        try:
+            cost = litellm.completion_cost(completion_response=response)
+        except Exception:
+            # Models without pricing information
+            cost = 0.0
+        return ModelResponse(
+            text=text,
+            parsed=parsed,
+            cost=cost,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            cached_tokens=cached_tokens,
+            tool_calls=tool_calls,
+            **timing,
+        )
+
+    @staticmethod
+    def _tool_calls(message: Any, text: str) -> Optional[List[dict]]:
+        """Return the native tool calls of a message as `{"id", "name", "arguments"}` dicts.
+
+        Raises:
+            ResponseParsingError: If the arguments of a call are not a JSON object.
+        """
+        calls = []
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            raw = tool_call.function.arguments or "{}"
+            try:
+                arguments = repair_json(raw).value
+            except ValueError:
+                arguments = None
+            if not isinstance(arguments, dict):
+                raise ResponseParsingError(
+                    f"The arguments of the tool call '{tool_call.function.name}' are not a JSON object: {raw}",
+                    raw_response=text,
+                )
+            calls.append({"id": tool_call.id, "name": tool_call.function.name, "arguments": arguments})
+        return calls or None
+
+    def format(self, *args: Union[Msg, List[Msg], dict], cache_breakpoint: Optional[int] = None) -> List[dict]:
         """Flatten Msg objects into an OpenAI-compatible message list.
 
         For Gemini models, ensures the last non-system message has role 'user'
         (Gemini requires conversations to end with a user turn).
+
+        If `cache_breakpoint` is given, the first `cache_breakpoint` messages are
+        a static prefix: the last of them is marked with a provider cache-control
+        annotation where litellm supports one.
         """
         messages = []
         for arg in args:
@@ -108,6 +542,11 @@ class LLMClient:
             elif isinstance(arg, dict):
                 messages.append(arg)
 
+        if cache_breakpoint and self._uses_cache_control():
+            idx = min(cache_breakpoint, len(messages)) - 1
+            block = {"type": "text", "text": messages[idx]["content"], "cache_control": {"type": "ephemeral"}}
+            messages[idx] = {**messages[idx], "content": [block]}
+
         # Gemini requires the last message to have role "user"
         if "gemini" in self.model.lower() and messages:
             if messages[-1]["role"] != "user":
@@ -115,10 +554,35 @@ class LLMClient:
 
         return messages
 
+    def _uses_cache_control(self) -> bool:
+        try:
+            provider = litellm.get_llm_provider(self.model)[1]
+        except Exception:
+            return False
+        return provider in self.cache_control_providers and litellm.utils.supports_prompt_caching(self.model)
+
+
+class _CallTracker:
+    """Collects the telemetry of one LLMClient call while it runs."""
+
+    def __init__(self, record: CallRecord) -> None:
+        self.record = record
+
+    def finish(self, res: ModelResponse) -> ModelResponse:
+        self.record.prompt_tokens = res.prompt_tokens
+        self.record.completion_tokens = res.completion_tokens
+        self.record.cached_tokens = res.cached_tokens
+        self.record.cost = res.cost
+        self.record.cache_hit = res.cached
+        return res
+
 
 class AgentBase:
     """Lightweight agent base class replacing AgentScope's AgentBase."""
 
+    # Share of the memory dropped when the provider still reports a context overflow
+    overflow_shrink = 0.25
+
     def __init__(
         self,
         name: str,
@@ -128,8 +592,70 @@ class AgentBase:
     ) -> None:
         self.name = name
         self.sys_prompt = sys_prompt
-        self.model = LLMClient(model=model, **model_kwargs)
-        self.memory = Memory()
+        self.model = LLMClient(model=model, agent=name, **model_kwargs)
+        self.memory = Memory(model=model)
+        # Per-call instruction messages, built once so their serialization and token counts are reused
+        self._instructions: Dict[str, Msg] = {}
+        # Input tokens of the last prompt built by `_format_prompt`
+        self._prompt_tokens: Optional[int] = None
+        # Memory size the next prompt is fitted into after the provider reported an overflow
+        self._overflow_budget: Optional[int] = None
+
+    def _format_prompt(self, *instructions: Msg) -> List[dict]:
+        """Build the prompt from the memory followed by per-call instructions.
+
+        The memory is first fitted into the model's context window, leaving
+        room for the instructions and the completion.
+
+        With `prompt_caching` enabled on the client, the leading system prompt and
+        the instructions (role prompt, format hint) are moved in front of the
+        changing conversation, so consecutive calls share a cacheable prefix.
+        """
+        budget = self.model.prompt_budget()
+        if budget is not None:
+            budget -= self.memory.count_tokens(instructions)
+        if self._overflow_budget is not None:
+            # Applied to one prompt only, so repeated overflows do not shrink the window for good
+            budget = self._overflow_budget if budget is None else min(budget, self._overflow_budget)
+            self._overflow_budget = None
+        if budget is not None and not self.memory.fit(budget):
+            logger.warning(f"[{self.name}] prompt exceeds the context window even after compacting the memory")
+        # Passed to the client as `prompt_tokens`, so the rate limiter never re-tokenizes the prompt
+        self._prompt_tokens = self._count_prompt_tokens(*instructions)
+
+        memory = self.memory.to_dicts()
+        if not self.model.prompt_caching:
+            return self.model.format(memory, *instructions)
+        n_sys = 1 if memory and memory[0]["role"] == "system" else 0
+        static = memory[:n_sys] + list(instructions)
+        return self.model.format(static, memory[n_sys:], cache_breakpoint=len(static))
+
+    def _instruction(self, content: str) -> Msg:
+        """Return the system message of a per-call instruction, e.g. a role prompt or format hint."""
+        msg = self._instructions.get(content)
+        if msg is None:
+            msg = self._instructions[content] = Msg("system", content, role="system")
+        return msg
+
+    def _count_prompt_tokens(self, *instructions: Msg) -> int:
+        """Count the input tokens of the memory plus instructions without re-tokenizing the memory."""
+        return self.memory.total_tokens() + self.memory.count_tokens(instructions)
+
+    def _handle_context_overflow(self, e: Exception, hint: Optional[str] = None) -> None:
+        """Shrink the memory after the provider rejected the prompt as too long.
+
+        Raises the error again if nothing in the memory can be dropped.
+        """
+        total = self.memory.total_tokens()
+        self.memory.fit(int(total * (1 - self.overflow_shrink)))
+        if self.memory.total_tokens() >= total:
+            raise e
+        logger.warning(f"[{self.name}] context window exceeded, memory shrunk from {total} to {self.memory.total_tokens()} tokens")
+        # The next prompt may not grow back past the shrunk memory, e.g. by the hint below; the
+        # window itself is kept, since the overflow may have come from the completion
+        self._overflow_budget = self.memory.total_tokens()
+        if hint is not None and not any(msg.content == hint for msg in self.memory.get_memory()):
+            self.memory.add(Msg("system", hint, "system"))
 
     def speak(self, msg: Any) -> None:
         """Print a message (replaces AgentScope's speak)."""
@@ -147,3 +673,7 @@ class AgentBase:
     def reply(self, x: Any = None) -> Any:
         """Override in subclass."""
         raise NotImplementedError
+
+    async def areply(self, x: Any = None) -> Any:
+        """Async counterpart of `reply`. Override in subclass."""
+        raise NotImplementedError
@@ -0,0 +1,290 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+
+# Request options that do not change the completion and must not leak into keys
+_IGNORED_KWARGS = {"api_key", "timeout", "metadata", "num_retries"}
+
+
+class ResponseCache:
+    """Persistent, content-addressed cache of LLM completions backed by SQLite.
+
+    Entries are keyed by model, normalized message list and sampling kwargs.
+    The database runs in WAL mode so several worker processes can share one
+    file. Identical requests that are in flight at the same time are coalesced:
+    threads and tasks of one process wait on a per-key lock, and other
+    processes wait on a lease row until the owner stores the response.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: Optional[int] = None,
+        max_age: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        lease_timeout: float = 300.0,
+        evict_every: int = 100,
+    ) -> None:
+        """
+        Args:
+            path: SQLite database file.
+            max_entries: Keep at most this many entries (least recently used go first).
+            max_age: Drop entries older than this many seconds.
+            max_bytes: Keep the total size of stored responses below this bound.
+            lease_timeout: Seconds after which a lease of a crashed process is ignored.
+            evict_every: Run eviction after this many insertions.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.lease_timeout = lease_timeout
+        self.evict_every = evict_every
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._owner = uuid.uuid4().hex
+        self._local = threading.local()
+        self._guard = threading.Lock()
+        self._thread_locks: Dict[str, List[Any]] = {}
+        self._async_locks: Dict[str, List[Any]] = {}
+        self._puts = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, text TEXT, size INTEGER, created REAL, accessed REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+        self.evict()
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional["ResponseCache"]:
+        """Build the cache from a model config, or return None if `cache_path` is unset."""
+        if not config.get("cache_path"):
+            return None
+        max_age_days = config.get("cache_max_age_days")
+        return cls(
+            config["cache_path"],
+            max_entries=config.get("cache_max_entries"),
+            max_age=max_age_days * 86400 if max_age_days else None,
+            max_bytes=config.get("cache_max_bytes"),
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(model: str, messages: List[dict], **kwargs: Any) -> str:
+        """Return the content address of a request."""
+        normalized = [
+            {k: (v.strip() if isinstance(v, str) else v) for k, v in sorted(msg.items())}
+            for msg in messages
+        ]
+        options = {k: v for k, v in kwargs.items() if k not in _IGNORED_KWARGS}
+        payload = json.dumps(
+            {"model": model, "messages": normalized, "kwargs": options},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response text, counting a hit or a miss."""
+        text = self._lookup(key)
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return text
+
+    def _lookup(self, key: str) -> Optional[str]:
+        conn = self._conn()
+        row = conn.execute("SELECT text, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.max_age is not None and now - row[1] > self.max_age:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key: str, model: str, text: str) -> None:
+        """Store a response."""
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO responses (key, model, text, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, text, len(text.encode("utf-8")), now, now),
+        )
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def delete(self, key: str) -> None:
+        """Remove a single entry."""
+        self._conn().execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def evict(self) -> int:
+        """Apply the age, entry and size bounds. Returns the number of removed entries."""
+        conn = self._conn()
+        removed = 0
+        if self.max_age is not None:
+            removed += conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)).rowcount
+        if self.max_entries is not None:
+            removed += conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        if self.max_bytes is not None:
+            # Keep the most recently used entries whose cumulative size fits the bound
+            removed += conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS total FROM responses) "
+                "WHERE total > ?)",
+                (self.max_bytes,),
+            ).rowcount
+        conn.execute("DELETE FROM leases WHERE expires < ?", (time.time(),))
+        if removed:
+            logger.debug(f"Response cache evicted {removed} entries")
+        return removed
+
+    def stats(self) -> dict:
+        """Return hit/miss counters of this process and the size of the store."""
+        entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    # ------------------------------------------------------------------
+    # Single-flight coalescing
+    # ------------------------------------------------------------------
+    def _try_lease(self, key: str) -> bool:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("DELETE FROM leases WHERE key = ? AND expires < ?", (key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO leases (key, owner, expires) VALUES (?, ?, ?)",
+            (key, self._owner, now + self.lease_timeout),
+        )
+        return cursor.rowcount == 1
+
+    def _coalesced_lookup(self, key: str) -> Optional[str]:
+        text = self._lookup(key)
+        if text is not None:
+            self.coalesced += 1
+        return text
+
+    def _release_lease(self, key: str) -> None:
+        self._conn().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self._owner))
+
+    def _acquire_ref(self, table: Dict[str, List[Any]], key: str, factory: Any) -> Any:
+        with self._guard:
+            entry = table.setdefault(key, [factory(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _release_ref(self, table: Dict[str, List[Any]], key: str) -> None:
+        with self._guard:
+            entry = table[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del table[key]
+
+    @contextmanager
+    def flight(self, key: str, poll_interval: float = 0.5):
+        """Serialize identical requests across threads and processes.
+
+        Yields the cached text if another caller produced it while we waited,
+        otherwise None, in which case the caller should compute and `put` it.
+        """
+        lock = self._acquire_ref(self._thread_locks, key, threading.Lock)
+        try:
+            with lock:
+                while not self._try_lease(key):
+                    text = self._lookup(key)
+                    if text is not None:
+                        self.coalesced += 1
+                        yield text
+                        return
+                    time.sleep(poll_interval)
+                try:
+                    yield self._coalesced_lookup(key)
+                finally:
+                    self._release_lease(key)
+        finally:
+            self._release_ref(self._thread_locks, key)
+
+    @asynccontextmanager
+    async def aflight(self, key: str, poll_interval: float = 0.5):
+        """Async counterpart of `flight` for tasks sharing an event loop."""
+        lock = self._acquire_ref(self._async_locks, key, asyncio.Lock)
+        try:
+            async with lock:
+                # The lease and lookup statements may wait on other workers, so they run in threads
+                while not await asyncio.to_thread(self._try_lease, key):
+                    text = await asyncio.to_thread(self._lookup, key)
+                    if text is not None:
+                        self.coalesced += 1
+                        yield text
+                        return
+                    await asyncio.sleep(poll_interval)
+                try:
+                    yield await asyncio.to_thread(self._coalesced_lookup, key)
+                finally:
+                    await asyncio.to_thread(self._release_lease, key)
+        finally:
+            self._release_ref(self._async_locks, key)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or prune an LLM response cache.")
+    parser.add_argument("command", choices=["stats", "evict", "clear"])
+    parser.add_argument("--path", "-p", type=str, required=True, help="The SQLite cache file.")
+    parser.add_argument("--max_entries", type=int, default=None)
+    parser.add_argument("--max_age_days", type=float, default=None)
+    parser.add_argument("--max_bytes", type=int, default=None)
+    args = parser.parse_args()
+
+    cache = ResponseCache(
+        args.path,
+        max_entries=args.max_entries,
+        max_age=args.max_age_days * 86400 if args.max_age_days else None,
+        max_bytes=args.max_bytes,
+    )
+    if args.command == "clear":
+        cache._conn().execute("DELETE FROM responses")
+    elif args.command == "evict":
+        print(f"Evicted {cache.evict()} entries")
+    print(json.dumps(cache.stats(), indent=2))
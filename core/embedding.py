@@ -1,37 +1,227 @@
-from typing import Any, List, Optional
+import asyncio
+import time
+import weakref
+from typing import Any, List, Optional, Tuple
 
 import litellm
+from llama_index.core.bridge.pydantic import PrivateAttr
 from llama_index.core.embeddings import BaseEmbedding
+from loguru import logger
+
+from core.base_agent import rate_limit_wait
+from core.embedding_cache import EmbeddingCache
+from core.exceptions import FixtureNotFoundError
+from core.mock import MockBackend
+from core.ratelimit import RateLimiter
+
+
+# Inputs per request accepted by the providers' embedding APIs
+_PROVIDER_BATCH_SIZES = {
+    "openai": 2048,
+    "azure": 2048,
+    "mistral": 512,
+    "vertex_ai": 250,
+    "voyage": 128,
+    "gemini": 100,
+    "cohere": 96,
+}
+DEFAULT_BATCH_SIZE = 96
+
+
+def provider_batch_size(model: str) -> int:
+    """Return the most inputs one embedding request of `model`'s provider accepts."""
+    try:
+        provider = litellm.get_llm_provider(model)[1]
+    except Exception:
+        return DEFAULT_BATCH_SIZE
+    return _PROVIDER_BATCH_SIZES.get(provider, DEFAULT_BATCH_SIZE)
 
 
 class LiteLLMEmbedding(BaseEmbedding):
     """LlamaIndex-compatible embedding class using litellm.embedding().
 
     Allows any LiteLLM-supported embedding provider (OpenAI, Gemini, Cohere, etc.)
-    to be used for RAG with a unified interface.
+    to be used for RAG with a unified interface. Texts are sent in batches of
+    up to `embed_batch_size` inputs (the provider's maximum by default) and
+    `max_batch_tokens` tokens; the async methods run up to `max_concurrency`
+    batches at once on litellm.aembedding(). Rate limits are handled like in
+    `LLMClient`: requests wait for the limiter's budget, and 429s back off.
+    With a `cache`, texts embedded before by this model are read from the
+    store and only the others are sent.
     """
 
     model_name: str = "openai/text-embedding-3-small"
     api_key: Optional[str] = None
+    # Offline record/replay stand-in for litellm.embedding
+    backend: Optional[MockBackend] = None
+    limiter: Optional[RateLimiter] = None
+    cache: Optional[EmbeddingCache] = None
+    max_retries: int = 20
+    max_rate_limit_retries: int = 10
+    # Token bound of one request; OpenAI accepts at most 300k tokens per request
+    max_batch_tokens: int = 100_000
+    max_concurrency: int = 4
+
+    _semaphores: Any = PrivateAttr(default_factory=weakref.WeakKeyDictionary)
 
-    def __init__(self, model_name: str = "openai/text-embedding-3-small", api_key: Optional[str] = None, **kwargs: Any) -> None:
-        super().__init__(model_name=model_name, api_key=api_key, **kwargs)
+    def __init__(
+        self,
+        model_name: str = "openai/text-embedding-3-small",
+        api_key: Optional[str] = None,
+        backend: Optional[MockBackend] = None,
+        limiter: Optional[RateLimiter] = None,
+        cache: Optional[EmbeddingCache] = None,
+        embed_batch_size: Optional[int] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(
+            model_name=model_name,
+            api_key=api_key,
+            backend=backend,
+            limiter=limiter,
+            cache=cache,
+            embed_batch_size=embed_batch_size or provider_batch_size(model_name),
+            **kwargs,
+        )
 
     class Config:
         arbitrary_types_allowed = True
 
-    def _get_text_embedding(self, text: str) -> List[float]:
+    def _batches(self, texts: List[str]) -> List[Tuple[int, int, int]]:
+        """Split texts into (start, end, tokens) batches within the size and token bounds."""
+        batches, start, tokens = [], 0, 0
+        for i, text in enumerate(texts):
+            n_tokens = litellm.token_counter(model=self.model_name, text=text)
+            if i > start and (i - start >= self.embed_batch_size or tokens + n_tokens > self.max_batch_tokens):
+                batches.append((start, i, tokens))
+                start, tokens = i, 0
+            tokens += n_tokens
+        if texts:
+            batches.append((start, len(texts), tokens))
+        return batches
+
+    def _request_kwargs(self) -> dict:
         kwargs = {}
         if self.api_key:
             kwargs["api_key"] = self.api_key
-        response = litellm.embedding(model=self.model_name, input=[text], **kwargs)
-        return response.data[0]["embedding"]
+        return kwargs
+
+    def _settle(self, estimate: int, response: Any) -> None:
+        usage = getattr(response, "usage", None)
+        if self.limiter is not None and usage is not None:
+            self.limiter.settle(estimate, getattr(usage, "total_tokens", 0) or 0)
+
+    def _embed(self, texts: List[str], tokens: int) -> List[List[float]]:
+        embedding = self.backend.embedding if self.backend is not None else litellm.embedding
+        for attempt in range(self.max_retries):
+            for rl_attempt in range(self.max_rate_limit_retries):
+                if self.limiter is not None:
+                    self.limiter.acquire(tokens)
+                try:
+                    response = embedding(model=self.model_name, input=texts, **self._request_kwargs())
+                    self._settle(tokens, response)
+                    return [item["embedding"] for item in response.data]
+                except (litellm.RateLimitError, litellm.ServiceUnavailableError) as e:
+                    time.sleep(rate_limit_wait(e, rl_attempt, self.max_rate_limit_retries, self.limiter))
+                except Exception as e:
+                    # Sending the same request again cannot help
+                    if isinstance(e, (FixtureNotFoundError, litellm.ContextWindowExceededError)):
+                        raise
+                    if attempt == self.max_retries - 1:
+                        raise
+                    logger.warning(f"Embedding call attempt {attempt + 1} failed: {e}")
+                    break
+        raise RuntimeError("Exhausted retries without success or exception")
+
+    async def _aembed(self, texts: List[str], tokens: int) -> List[List[float]]:
+        embedding = self.backend.aembedding if self.backend is not None else litellm.aembedding
+        for attempt in range(self.max_retries):
+            for rl_attempt in range(self.max_rate_limit_retries):
+                if self.limiter is not None:
+                    await self.limiter.aacquire(tokens)
+                try:
+                    response = await embedding(model=self.model_name, input=texts, **self._request_kwargs())
+                    await asyncio.to_thread(self._settle, tokens, response)
+                    return [item["embedding"] for item in response.data]
+                except (litellm.RateLimitError, litellm.ServiceUnavailableError) as e:
+                    wait = await asyncio.to_thread(
+                        rate_limit_wait, e, rl_attempt, self.max_rate_limit_retries, self.limiter
+                    )
+                    await asyncio.sleep(wait)
+                except Exception as e:
+                    if isinstance(e, (FixtureNotFoundError, litellm.ContextWindowExceededError)):
+                        raise
+                    if attempt == self.max_retries - 1:
+                        raise
+                    logger.warning(f"Embedding call attempt {attempt + 1} failed: {e}")
+                    break
+        raise RuntimeError("Exhausted retries without success or exception")
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Semaphores belong to one event loop; batches of concurrent callers share it
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return self._embed_all(texts)
+        embeddings = self.cache.get_many(self.model_name, texts)
+        missing = self._missing(texts, embeddings)
+        if missing:
+            self._fill(texts, embeddings, missing, self._embed_all(missing))
+        return embeddings
+
+    def _embed_all(self, texts: List[str]) -> List[List[float]]:
+        embeddings = []
+        for start, end, tokens in self._batches(texts):
+            embeddings.extend(self._embed(texts[start:end], tokens))
+        return embeddings
+
+    @staticmethod
+    def _missing(texts: List[str], embeddings: List[Optional[List[float]]]) -> List[str]:
+        """Distinct texts without a cached vector."""
+        return list(dict.fromkeys(text for text, vector in zip(texts, embeddings) if vector is None))
+
+    def _fill(
+        self, texts: List[str], embeddings: List[Optional[List[float]]], missing: List[str], vectors: List[List[float]]
+    ) -> None:
+        self.cache.put_many(self.model_name, missing, vectors)
+        computed = dict(zip(missing, vectors))
+        for i, text in enumerate(texts):
+            if embeddings[i] is None:
+                embeddings[i] = computed[text]
 
     def _get_query_embedding(self, query: str) -> List[float]:
         return self._get_text_embedding(query)
 
-    async def _aget_query_embedding(self, query: str) -> List[float]:
-        return self._get_query_embedding(query)
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return await self._aembed_all(texts)
+        embeddings = await asyncio.to_thread(self.cache.get_many, self.model_name, texts)
+        missing = self._missing(texts, embeddings)
+        if missing:
+            vectors = await self._aembed_all(missing)
+            await asyncio.to_thread(self._fill, texts, embeddings, missing, vectors)
+        return embeddings
+
+    async def _aembed_all(self, texts: List[str]) -> List[List[float]]:
+        semaphore = self._semaphore()
+
+        async def embed(start: int, end: int, tokens: int) -> List[List[float]]:
+            async with semaphore:
+                return await self._aembed(texts[start:end], tokens)
+
+        results = await asyncio.gather(*(embed(*batch) for batch in self._batches(texts)))
+        return [vector for batch in results for vector in batch]
 
     async def _aget_text_embedding(self, text: str) -> List[float]:
-        return self._get_text_embedding(text)
+        return (await self._aget_text_embeddings([text]))[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._aget_text_embedding(query)
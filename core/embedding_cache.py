@@ -0,0 +1,287 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+
+_SLUG = re.compile(r"[^\w.-]+")
+# Bound on the number of SQL variables of one statement
+_CHUNK = 500
+
+
+class EmbeddingCache:
+    """Persistent embedding store keyed by (embedding model, hash of the text).
+
+    Vectors of each model are rows of one append-only float32 or float16
+    matrix file, read through a memory map; a SQLite index in WAL mode maps
+    every key to its row, so worker processes can share a directory. Rows are
+    reserved under a write transaction and written before their keys are
+    committed, so a reader never sees a key whose vector is missing. `prune`
+    drops entries unused for a while and compacts the matrices into new files.
+    """
+
+    def __init__(self, path: str, dtype: str = "float32") -> None:
+        """
+        Args:
+            path: Directory of the index and the matrix files.
+            dtype: Storage type of new matrices, "float32" or "float16" (half the size).
+        """
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported embedding cache dtype '{dtype}', expected float32 or float16")
+        self.path = path
+        self.dtype = dtype
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # file name -> memory map of its rows
+        self._maps: Dict[str, np.memmap] = {}
+
+        os.makedirs(path, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS matrices ("
+            "model TEXT PRIMARY KEY, dim INTEGER, dtype TEXT, file TEXT, rows INTEGER)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, model TEXT, row INTEGER, used REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS vectors_model_used ON vectors(model, used)")
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional["EmbeddingCache"]:
+        """Build the cache from a model config, or return None if `embedding_cache_path` is unset."""
+        if not config.get("embedding_cache_path"):
+            return None
+        return cls(config["embedding_cache_path"], dtype=config.get("embedding_cache_dtype", "float32"))
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.path, "index.sqlite"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _matrix(self, file: str, dtype: str, dim: int, rows: int) -> np.memmap:
+        """Map at least `rows` rows of a matrix file, remapping once the file has grown."""
+        with self._lock:
+            mapped = self._maps.get(file)
+            if mapped is None or mapped.shape[0] < rows:
+                file_path = os.path.join(self.path, file)
+                row_bytes = dim * np.dtype(dtype).itemsize
+                shape = (os.path.getsize(file_path) // row_bytes, dim)
+                mapped = np.memmap(file_path, dtype=dtype, mode="r", shape=shape)
+                self._maps[file] = mapped
+            return mapped
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Return the stored vector of every text, or None for texts not in the cache."""
+        keys = [self.key(model, text) for text in texts]
+        conn = self._conn()
+        rows: Dict[str, int] = {}
+        # One read snapshot, so a concurrent compaction cannot mix old rows with a new file
+        conn.execute("BEGIN")
+        try:
+            matrix = conn.execute("SELECT dim, dtype, file FROM matrices WHERE model = ?", (model,)).fetchone()
+            if matrix is not None:
+                unique = list(dict.fromkeys(keys))
+                for i in range(0, len(unique), _CHUNK):
+                    chunk = unique[i : i + _CHUNK]
+                    rows.update(
+                        conn.execute(
+                            f"SELECT key, row FROM vectors WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                        ).fetchall()
+                    )
+        finally:
+            conn.execute("COMMIT")
+
+        vectors: List[Optional[List[float]]] = [None] * len(keys)
+        if rows:
+            dim, dtype, file = matrix
+            try:
+                mapped = self._matrix(file, dtype, dim, max(rows.values()) + 1)
+            except FileNotFoundError:
+                # Compacted away by another process since the snapshot
+                rows = {}
+        if rows:
+            for i, key in enumerate(keys):
+                row = rows.get(key)
+                if row is not None:
+                    vectors[i] = mapped[row].astype(np.float32).tolist()
+            found = list(rows)
+            now = time.time()
+            for i in range(0, len(found), _CHUNK):
+                chunk = found[i : i + _CHUNK]
+                conn.execute(f"UPDATE vectors SET used = ? WHERE key IN ({','.join('?' * len(chunk))})", [now, *chunk])
+
+        hits = sum(vector is not None for vector in vectors)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return vectors
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> int:
+        """Store the vectors of texts that are not cached yet. Returns the number of new entries."""
+        pending = {self.key(model, text): vector for text, vector in zip(texts, vectors)}
+        if not pending:
+            return 0
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            keys = list(pending)
+            for i in range(0, len(keys), _CHUNK):
+                chunk = keys[i : i + _CHUNK]
+                for (key,) in conn.execute(
+                    f"SELECT key FROM vectors WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall():
+                    del pending[key]
+            if not pending:
+                conn.execute("COMMIT")
+                return 0
+
+            matrix = conn.execute("SELECT dim, dtype, file, rows FROM matrices WHERE model = ?", (model,)).fetchone()
+            dim = len(next(iter(pending.values())))
+            if matrix is None:
+                matrix = (dim, self.dtype, self._new_file(model, self.dtype), 0)
+                conn.execute(
+                    "INSERT INTO matrices (model, dim, dtype, file, rows) VALUES (?, ?, ?, ?, ?)", (model, *matrix)
+                )
+            elif matrix[0] != dim:
+                logger.warning(f"Embedding cache: {model} vectors have {dim} dimensions, the store has {matrix[0]}")
+                conn.execute("ROLLBACK")
+                return 0
+
+            _, dtype, file, start = matrix
+            data = np.asarray(list(pending.values()), dtype=dtype)
+            file_path = os.path.join(self.path, file)
+            # Rows past `start` may hold bytes of a writer that crashed before committing
+            with open(file_path, "r+b" if os.path.exists(file_path) else "w+b") as f:
+                f.seek(start * dim * data.itemsize)
+                f.write(data.tobytes())
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO vectors (key, model, row, used) VALUES (?, ?, ?, ?)",
+                [(key, model, start + i, now) for i, key in enumerate(pending)],
+            )
+            conn.execute("UPDATE matrices SET rows = ? WHERE model = ?", (start + len(pending), model))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(pending)
+
+    @staticmethod
+    def _new_file(model: str, dtype: str) -> str:
+        return f"{_SLUG.sub('_', model)}-{uuid.uuid4().hex[:8]}.{dtype}"
+
+    def prune(self, max_age: Optional[float] = None, model: Optional[str] = None) -> int:
+        """Drop entries unused for `max_age` seconds, or all entries of `model`, and compact the matrices.
+
+        Returns the number of removed entries.
+        """
+        conn = self._conn()
+        removed = 0
+        if model is not None:
+            removed += conn.execute("DELETE FROM vectors WHERE model = ?", (model,)).rowcount
+            files = [row[0] for row in conn.execute("SELECT file FROM matrices WHERE model = ?", (model,))]
+            conn.execute("DELETE FROM matrices WHERE model = ?", (model,))
+            for file in files:
+                self._remove(file)
+        if max_age is not None:
+            removed += conn.execute("DELETE FROM vectors WHERE used < ?", (time.time() - max_age,)).rowcount
+        for (name,) in conn.execute("SELECT model FROM matrices").fetchall():
+            self._compact(name)
+        if removed:
+            logger.debug(f"Embedding cache pruned {removed} entries")
+        return removed
+
+    def _compact(self, model: str) -> None:
+        """Rewrite a model's live rows into a new file if the old one has unreferenced rows."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            dim, dtype, file, rows = conn.execute(
+                "SELECT dim, dtype, file, rows FROM matrices WHERE model = ?", (model,)
+            ).fetchone()
+            live = conn.execute("SELECT key, row FROM vectors WHERE model = ? ORDER BY row", (model,)).fetchall()
+            if len(live) == rows:
+                conn.execute("COMMIT")
+                return
+            new_file = self._new_file(model, dtype)
+            if live:
+                old = self._matrix(file, dtype, dim, rows)
+                old[np.fromiter((row for _, row in live), dtype=np.int64, count=len(live))].tofile(
+                    os.path.join(self.path, new_file)
+                )
+            else:
+                open(os.path.join(self.path, new_file), "wb").close()
+            conn.executemany("UPDATE vectors SET row = ? WHERE key = ?", [(i, key) for i, (key, _) in enumerate(live)])
+            conn.execute("UPDATE matrices SET file = ?, rows = ? WHERE model = ?", (new_file, len(live), model))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        # Readers that still map the old file keep their mapping; new lookups use the new file
+        self._remove(file)
+
+    def _remove(self, file: str) -> None:
+        with self._lock:
+            self._maps.pop(file, None)
+        try:
+            os.remove(os.path.join(self.path, file))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        """Return hit/miss counters of this process and the size of every model's matrix."""
+        conn = self._conn()
+        models = {}
+        for model, dim, dtype, file, rows in conn.execute("SELECT model, dim, dtype, file, rows FROM matrices"):
+            entries = conn.execute("SELECT COUNT(*) FROM vectors WHERE model = ?", (model,)).fetchone()[0]
+            file_path = os.path.join(self.path, file)
+            models[model] = {
+                "entries": entries,
+                "unreferenced_rows": rows - entries,
+                "dim": dim,
+                "dtype": dtype,
+                "bytes": os.path.getsize(file_path) if os.path.exists(file_path) else 0,
+            }
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "models": models,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or prune an embedding cache.")
+    parser.add_argument("command", choices=["stats", "prune", "clear"])
+    parser.add_argument("--path", "-p", type=str, required=True, help="The cache directory.")
+    parser.add_argument("--max_age_days", type=float, default=None, help="Drop entries unused for this long.")
+    parser.add_argument("--model", type=str, default=None, help="Drop every entry of this embedding model.")
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(args.path)
+    if args.command == "clear":
+        for (model,) in cache._conn().execute("SELECT model FROM matrices").fetchall():
+            cache.prune(model=model)
+    elif args.command == "prune":
+        print(f"Pruned {cache.prune(args.max_age_days * 86400 if args.max_age_days else None, args.model)} entries")
+    print(json.dumps(cache.stats(), indent=2))
@@ -9,3 +9,8 @@ class ResponseParsingError(Exception):
 class FunctionCallError(Exception):
     """Raised when a function call fails."""
     pass
+
+
+class FixtureNotFoundError(Exception):
+    """Raised when the mock backend has no recorded response for a request."""
+    pass
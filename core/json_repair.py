@@ -0,0 +1,282 @@
+import ast
+import json
+import re
+from typing import Any, Callable, Collection, List, Optional, Sequence, Tuple
+
+import dirtyjson
+
+
+# Fenced markdown blocks, optionally tagged as json
+_FENCE = re.compile(r"```(?:json|JSON)?[ \t]*\n?(.*?)(?:```|$)", re.DOTALL)
+# A string literal (double or single quoted) or anything else up to the next quote
+_STRING_OR_CODE = re.compile(r'"(?:[^"\\]|\\.)*"?|\'(?:[^\'\\]|\\.)*\'?|[^"\']+', re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_LINE_COMMENT = re.compile(r"(?m)//[^\n]*$")
+_PY_LITERALS = re.compile(r"\b(True|False|None)\b")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+_PY_TO_JSON = {"True": "true", "False": "false", "None": "null"}
+# What a truncated object may end with that cannot be completed: a dangling key, colon or comma
+_DANGLING_TAIL = re.compile(r'(?:,\s*"(?:[^"\\]|\\.)*"\s*:?\s*|,\s*|:\s*)$')
+
+
+class RepairResult:
+    """A value recovered from model output and the repairs that were needed."""
+
+    __slots__ = ("value", "repairs", "block")
+
+    def __init__(self, value: Any, repairs: List[str], block: int) -> None:
+        self.value = value
+        # Names of the repair steps applied, empty if the text was valid JSON
+        self.repairs = repairs
+        # Index of the candidate block the value came from
+        self.block = block
+
+    def __repr__(self) -> str:
+        return f"RepairResult(repairs={self.repairs}, block={self.block})"
+
+
+def candidates(text: str) -> List[str]:
+    """Return the JSON candidates of a response: every fenced block, else the text from the first brace."""
+    blocks = [block.strip() for block in _FENCE.findall(text) if block.strip()]
+    if blocks:
+        return blocks
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    return [text[start:].strip() if start >= 0 else text.strip()]
+
+
+def _map_code(text: str, func: Callable[[str], str]) -> str:
+    """Apply `func` to the parts of `text` outside string literals."""
+    return "".join(
+        part if part[0] in "\"'" else func(part) for part in _STRING_OR_CODE.findall(text)
+    )
+
+
+def _fix_syntax(text: str) -> str:
+    text = text.translate(_SMART_QUOTES)
+    text = _map_code(text, lambda code: _LINE_COMMENT.sub("", code))
+    text = _map_code(text, lambda code: _PY_LITERALS.sub(lambda m: _PY_TO_JSON[m.group(1)], code))
+    return _map_code(text, lambda code: _TRAILING_COMMA.sub(r"\1", code))
+
+
+def _single_to_double_quotes(text: str) -> str:
+    parts = []
+    for part in _STRING_OR_CODE.findall(text):
+        if part[0] == "'":
+            body = part[1:-1] if len(part) > 1 and part[-1] == "'" else part[1:]
+            body = body.replace("\\'", "'").replace('"', '\\"')
+            part = f'"{body}"'
+        parts.append(part)
+    return "".join(parts)
+
+
+def _balance(text: str) -> str:
+    """Close an unterminated string and unbalanced brackets, dropping a dangling last member."""
+    stack, in_string, escaped = [], False, False
+    last_complete = 0
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                last_complete = i + 1
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if stack and stack[-1] == char:
+                stack.pop()
+            last_complete = i + 1
+            if not stack:
+                # Text after the first complete top-level value is ignored
+                return text[:last_complete]
+        elif not char.isspace():
+            last_complete = i + 1
+
+    if in_string:
+        text += '"'
+    text = _DANGLING_TAIL.sub("", text.rstrip())
+    return text + "".join(reversed(stack))
+
+
+def _python_literal(text: str) -> Any:
+    value = ast.literal_eval(text)
+    # Tuples, sets and non-string keys are not JSON; the round trip normalizes them
+    return json.loads(json.dumps(value, default=list))
+
+
+def _dirtyjson(text: str) -> Any:
+    # dirtyjson returns AttributedDict; convert to plain containers
+    return json.loads(json.dumps(dirtyjson.loads(text)))
+
+
+# A repair layer: its name, the transform of the candidate and the loader of the result
+_Layer = Tuple[str, Callable[[str], str], Callable[[str], Any]]
+
+# Repair layers, cheapest first. Each takes the candidate and returns (text to load, loader).
+_LAYERS: Sequence[_Layer] = (
+    ("json", lambda t: t, json.loads),
+    ("python_literal", lambda t: t, _python_literal),
+    ("syntax", _fix_syntax, json.loads),
+    ("single_quotes", lambda t: _fix_syntax(_single_to_double_quotes(t)), json.loads),
+    ("balance", lambda t: _balance(_fix_syntax(_single_to_double_quotes(t))), json.loads),
+    ("dirtyjson", lambda t: t, _dirtyjson),
+)
+
+
+def repair_candidate(text: str, layers: Sequence[_Layer] = _LAYERS) -> Tuple[Any, List[str]]:
+    """Load one candidate, trying the repair layers in order.
+
+    Raises:
+        ValueError: If no layer produced a value.
+    """
+    for name, transform, load in layers:
+        try:
+            value = load(transform(text))
+        except Exception:
+            continue
+        return value, ([] if name == "json" else [name])
+    raise ValueError("No repair layer could load the text")
+
+
+def load_literal(text: str) -> Any:
+    """Load a list or object literal that spans all of `text`.
+
+    Raises:
+        ValueError: If the text is not a complete JSON or Python literal.
+    """
+    # Balancing and dirtyjson may load a prefix of the text and drop the rest
+    value, _ = repair_candidate(text.strip(), _LAYERS[:4])
+    return value
+
+
+def _expand_nested(value: Any, keys: Collection[str]) -> Tuple[Any, bool]:
+    """Load the string values of `keys` that hold a list or object literal.
+
+    Models often copy the `str([...])` format hints literally and return the
+    list as a (Python-quoted) string. Only keys whose hint is such a literal
+    are expanded, so prose that happens to start with a bracket is kept.
+    """
+    if not isinstance(value, dict):
+        return value, False
+    expanded = False
+    for key in keys:
+        item = value.get(key)
+        if isinstance(item, str) and item.strip()[:1] in ("[", "{"):
+            try:
+                loaded = load_literal(item)
+            except ValueError:
+                continue
+            if isinstance(loaded, (list, dict)):
+                value[key] = loaded
+                expanded = True
+    return value, expanded
+
+
+def repair_json(
+    text: str, accept: Optional[Callable[[Any], bool]] = None, nested_keys: Collection[str] = ()
+) -> RepairResult:
+    """Recover a JSON value from a model response.
+
+    Candidates (fenced blocks, or the text from the first brace) are tried in
+    order. The first value accepted by `accept` wins; if none is accepted, the
+    first value that loaded at all is returned. String values of
+    `nested_keys` that are a complete list or object literal are loaded too,
+    also in a candidate that is valid JSON; other values are kept as written.
+
+    Raises:
+        ValueError: If no candidate could be loaded.
+    """
+    fallback = None
+    for block, candidate in enumerate(candidates(text)):
+        try:
+            value, repairs = repair_candidate(candidate)
+        except ValueError:
+            continue
+        value, expanded = _expand_nested(value, nested_keys)
+        if expanded:
+            repairs = repairs + ["nested_literal"]
+        if block > 0:
+            repairs = ["later_block"] + repairs
+        result = RepairResult(value, repairs, block)
+        if accept is None or accept(value):
+            return result
+        if fallback is None:
+            fallback = result
+    if fallback is not None:
+        return fallback
+    raise ValueError("No JSON value found in the response")
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import time
+    from collections import Counter
+
+    parser = argparse.ArgumentParser(description="Benchmark the JSON repair layers on recorded model responses.")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument(
+        "--corpus",
+        "-c",
+        type=str,
+        required=True,
+        help="A mock fixture store (JSONL with 'text' fields) or a directory of .txt responses.",
+    )
+    parser.add_argument("--repeat", "-r", type=int, default=5, help="Timing repetitions per response.")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.corpus):
+        texts = []
+        for name in sorted(os.listdir(args.corpus)):
+            if name.endswith(".txt"):
+                with open(os.path.join(args.corpus, name)) as f:
+                    texts.append(f.read())
+    else:
+        with open(args.corpus) as f:
+            texts = [json.loads(line)["text"] for line in f if line.strip() and '"text"' in line]
+
+    def legacy(text):
+        match = re.search(r"```(?:json)?\s*\n?(.*?)```", text, re.DOTALL)
+        raw = match.group(1).strip() if match else text.strip()
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            return _dirtyjson(raw)
+
+    def measure(func):
+        started = time.perf_counter()
+        for text in texts:
+            for _ in range(args.repeat):
+                try:
+                    func(text)
+                except Exception:
+                    pass
+        return time.perf_counter() - started
+
+    fired, legacy_ok, repaired_ok = Counter(), 0, 0
+    for text in texts:
+        try:
+            legacy_ok += isinstance(legacy(text), dict)
+        except Exception:
+            pass
+        try:
+            result = repair_json(text, accept=lambda v: isinstance(v, dict))
+        except ValueError:
+            fired["unrecoverable"] += 1
+            continue
+        repaired_ok += isinstance(result.value, dict)
+        fired.update(result.repairs or ["none"])
+
+    n = max(len(texts), 1)
+    legacy_time = measure(legacy) / (n * args.repeat)
+    repair_time = measure(lambda t: repair_json(t).value) / (n * args.repeat)
+    print(f"Responses: {len(texts)}")
+    print(f"Parsed to a dict  legacy: {legacy_ok} ({legacy_ok / n:.1%})  repair: {repaired_ok} ({repaired_ok / n:.1%})")
+    print(f"Mean time per response  legacy: {legacy_time * 1e6:.1f}us  repair: {repair_time * 1e6:.1f}us")
+    print("Repairs fired:")
+    for name, count in fired.most_common():
+        print(f"  {name}: {count}")
@@ -1,27 +1,88 @@
-from typing import List, Union
+from typing import Dict, Iterable, List, Optional, Union
+
+from loguru import logger
+
 from core.message import Msg
 
 
 class Memory:
-    """Simple conversation memory with the same interface as AgentScope's memory."""
+    """Conversation memory with the same interface as AgentScope's memory.
+
+    If a model is given, every message is tokenized once when it is added and
+    the memory keeps a running token total, so `fit` can bring it under a
+    token budget by compacting and then evicting the oldest messages. The
+    newest message and pinned messages (e.g. the system prompt) are never
+    touched. The OpenAI-format dicts are kept alongside the messages, so
+    building a prompt costs nothing per stored message.
+    """
 
-    def __init__(self) -> None:
+    # Messages longer than this are cut down to an excerpt before anything is evicted
+    compact_tokens = 256
+    # Rough characters per token, used to size the excerpt of a compacted message
+    chars_per_token = 4
+
+    def __init__(self, model: Optional[str] = None) -> None:
+        """
+        Args:
+            model: Model whose tokenizer counts the messages, or None to skip counting.
+        """
+        self.model = model
         self._messages: List[Msg] = []
+        self._dicts: List[dict] = []
+        self._tokens: List[int] = []
+        # Sequence id of each message, so marks stay valid when older messages are evicted
+        self._ids: List[int] = []
+        self._next_id = 0
+        self._pins: Dict[str, int] = {}
+        self._total_tokens = 0
+
+    def add(self, msg_or_list: Union[Msg, List[Msg]], pin: Optional[str] = None) -> None:
+        """Add one or more messages to memory.
 
-    def add(self, msg_or_list: Union[Msg, List[Msg]]) -> None:
-        """Add one or more messages to memory."""
-        if isinstance(msg_or_list, list):
-            self._messages.extend(msg_or_list)
-        else:
-            self._messages.append(msg_or_list)
+        Args:
+            msg_or_list: Message(s) to add.
+            pin: Keep the (last) added message out of compaction and eviction
+                under this name; a later message pinned with the same name
+                releases the previous one.
+        """
+        msgs = msg_or_list if isinstance(msg_or_list, list) else [msg_or_list]
+        for msg in msgs:
+            n_tokens = self.count_tokens([msg])
+            self._messages.append(msg)
+            self._dicts.append(msg.to_dict())
+            self._tokens.append(n_tokens)
+            self._ids.append(self._next_id)
+            self._next_id += 1
+            self._total_tokens += n_tokens
+        if pin is not None and msgs:
+            self._pins[pin] = self._next_id - 1
+
+    def count_tokens(self, msgs: Iterable[Msg]) -> int:
+        """Count the prompt tokens of messages with the memory's model (0 without a model)."""
+        if self.model is None:
+            return 0
+        return sum(msg.token_count(self.model) for msg in msgs)
+
+    def total_tokens(self) -> int:
+        """Return the running token count of all stored messages."""
+        return self._total_tokens
 
     def get_memory(self) -> List[Msg]:
         """Return all stored messages."""
         return list(self._messages)
 
+    def to_dicts(self) -> List[dict]:
+        """Return the stored messages in OpenAI format (shared dicts, do not modify)."""
+        return list(self._dicts)
+
     def clear(self) -> None:
         """Remove all messages."""
         self._messages.clear()
+        self._dicts.clear()
+        self._tokens.clear()
+        self._ids.clear()
+        self._pins.clear()
+        self._total_tokens = 0
 
     def size(self) -> int:
         """Return the number of stored messages."""
@@ -32,6 +93,66 @@ class Memory:
         if isinstance(indices, int):
             indices = [indices]
         # Delete in reverse order to preserve index validity
-        for idx in sorted(indices, reverse=True):
+        for idx in sorted(set(indices), reverse=True):
             if 0 <= idx < len(self._messages):
+                self._total_tokens -= self._tokens[idx]
                 del self._messages[idx]
+                del self._dicts[idx]
+                del self._tokens[idx]
+                del self._ids[idx]
+
+    def mark(self) -> int:
+        """Return a mark that `delete_since` can roll back to."""
+        return self._next_id
+
+    def delete_since(self, mark: int) -> None:
+        """Delete the messages added after `mark` that are still stored."""
+        self.delete([idx for idx, msg_id in enumerate(self._ids) if msg_id >= mark])
+
+    def fit(self, max_tokens: int) -> bool:
+        """Bring the memory under `max_tokens` and return whether it fits.
+
+        The oldest unpinned messages are first compacted to a short excerpt,
+        then evicted, until the budget is met.
+        """
+        if self._total_tokens <= max_tokens:
+            return True
+
+        pinned = set(self._pins.values())
+        # Never touch the newest message: it is the input the model has to answer
+        candidates = [idx for idx in range(len(self._messages) - 1) if self._ids[idx] not in pinned]
+
+        for idx in candidates:
+            if self._total_tokens <= max_tokens:
+                break
+            if self._tokens[idx] > self.compact_tokens:
+                self._compact(idx)
+
+        evict = []
+        total = self._total_tokens
+        for idx in candidates:
+            if total <= max_tokens:
+                break
+            total -= self._tokens[idx]
+            evict.append(idx)
+        self.delete(evict)
+
+        logger.debug(f"Memory fitted to {self._total_tokens}/{max_tokens} tokens, evicted {len(evict)} messages")
+        return self._total_tokens <= max_tokens
+
+    def _compact(self, idx: int) -> None:
+        msg = self._messages[idx]
+        content = msg.content if isinstance(msg.content, str) else str(msg.content)
+        excerpt = content[: self.compact_tokens * self.chars_per_token]
+        compacted = Msg(
+            msg.name,
+            f"{excerpt}\n[... {self._tokens[idx]} tokens of earlier output omitted to fit the context window]",
+            msg.role,
+        )
+        n_tokens = self.count_tokens([compacted])
+        if n_tokens >= self._tokens[idx]:
+            return
+        self._total_tokens += n_tokens - self._tokens[idx]
+        self._messages[idx] = compacted
+        self._dicts[idx] = compacted.to_dict()
+        self._tokens[idx] = n_tokens
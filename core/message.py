@@ -1,19 +1,61 @@
+import copy
 from dataclasses import dataclass, field
-from typing import Any, Optional
+from typing import Any, List, Optional
+
+import litellm
 
 
-@dataclass
 class Msg:
-    """A simple message object replacing AgentScope's Msg."""
+    """An immutable message object replacing AgentScope's Msg.
+
+    List and dict contents are deep-copied on construction, so the serialized
+    form and the token counts can be computed once and reused for every
+    prompt the message appears in.
+    """
+
+    __slots__ = ("name", "content", "role", "_dict", "_tokens")
+
+    def __init__(self, name: str, content: Any, role: str = "user") -> None:
+        if isinstance(content, (list, dict)):
+            content = copy.deepcopy(content)
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "content", content)
+        object.__setattr__(self, "role", role)
+        object.__setattr__(self, "_dict", None)
+        object.__setattr__(self, "_tokens", {})
+
+    def __setattr__(self, key: str, value: Any) -> None:
+        raise AttributeError(f"Msg is immutable, cannot set '{key}'")
 
-    name: str
-    content: Any
-    role: str = "user"
+    def __delattr__(self, key: str) -> None:
+        raise AttributeError(f"Msg is immutable, cannot delete '{key}'")
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Msg):
+            return NotImplemented
+        return (self.name, self.role, self.content) == (other.name, other.role, other.content)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Msg(name={self.name!r}, content={self.content!r}, role={self.role!r})"
 
     def to_dict(self) -> dict:
-        """Convert to OpenAI message format."""
-        content = self.content if isinstance(self.content, str) else str(self.content)
-        return {"role": self.role, "content": content}
+        """Convert to OpenAI message format.
+
+        The dict is built once and shared; callers must copy it before changing it.
+        """
+        if self._dict is None:
+            content = self.content if isinstance(self.content, str) else str(self.content)
+            object.__setattr__(self, "_dict", {"role": self.role, "content": content})
+        return self._dict
+
+    def token_count(self, model: str) -> int:
+        """Return the prompt tokens of this message for `model`, counted once per model."""
+        n_tokens = self._tokens.get(model)
+        if n_tokens is None:
+            n_tokens = self._tokens[model] = litellm.token_counter(model=model, messages=[self.to_dict()])
+        return n_tokens
 
     def __str__(self) -> str:
         return f"{self.name}: {self.content}"
@@ -25,3 +67,15 @@ class ModelResponse:
 
     text: str
     parsed: Optional[dict] = None
+    cached: bool = False
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Input tokens served from the provider's prompt-prefix cache
+    cached_tokens: int = 0
+    # Estimated USD cost of the request
+    cost: float = 0.0
+    # Streaming only: seconds until the first token and until the JSON block closed
+    ttft: Optional[float] = None
+    time_to_parse: Optional[float] = None
+    # Native tool calls as {"id", "name", "arguments"} dicts, if the model made any
+    tool_calls: Optional[List[dict]] = None
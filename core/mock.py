@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import litellm
+from loguru import logger
+
+from core.cache import ResponseCache
+from core.exceptions import FixtureNotFoundError
+
+
+# Request options that only change how a response is delivered, not its content
+_TRANSPORT_KWARGS = {"stream", "stream_options"}
+
+
+class MockBackend:
+    """Offline stand-in for litellm completion and embedding calls.
+
+    In `record` mode every request goes to the real provider and the response
+    is appended to a JSONL fixture store. In `replay` mode responses are served
+    from the store only, with optional synthetic latency and injected 429
+    errors, so the agent loops can be load-tested without network access.
+    Replayed completions are rebuilt with litellm's `mock_response`, which
+    also covers streaming and native tool calls. Embeddings missing from the store are replaced by
+    deterministic pseudo-random vectors derived from the text hash.
+    """
+
+    def __init__(
+        self,
+        store: str,
+        mode: str = "replay",
+        latency: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        embedding_dim: int = 1536,
+        seed: int = 0,
+    ) -> None:
+        """
+        Args:
+            store: JSONL fixture file.
+            mode: "record" to capture real traffic, "replay" to serve fixtures.
+            latency: Synthetic seconds added to every replayed request.
+            rate_limit_rate: Share of replayed completions failing with a 429 (0-1).
+            embedding_dim: Dimension of vectors made up for unrecorded texts.
+            seed: Seed of the 429 injection and the made-up vectors.
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown mock mode '{mode}', expected 'record' or 'replay'")
+        self.store = store
+        self.mode = mode
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.embedding_dim = embedding_dim
+        self.seed = seed
+
+        self.hits = 0
+        self.misses = 0
+        self.injected_rate_limits = 0
+
+        self._lock = threading.Lock()
+        self._attempts: Dict[str, int] = {}
+        self._completions: Dict[str, str] = {}
+        self._tool_calls: Dict[str, List[dict]] = {}
+        self._embeddings: Dict[str, List[float]] = {}
+        self._load()
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional["MockBackend"]:
+        """Build the backend from a model config, or return None unless `backend: mock`."""
+        if config.get("backend", "litellm") != "mock":
+            return None
+        return cls(
+            config.get("mock_store", "./dataset/mock/fixtures.jsonl"),
+            mode=config.get("mock_mode", "replay"),
+            latency=config.get("mock_latency", 0.0),
+            rate_limit_rate=config.get("mock_rate_limit_rate", 0.0),
+            embedding_dim=config.get("mock_embedding_dim", 1536),
+            seed=config.get("mock_seed", 0),
+        )
+
+    def _load(self) -> None:
+        if not os.path.exists(self.store):
+            if self.mode == "replay":
+                logger.warning(f"Mock fixture store {self.store} does not exist, nothing to replay")
+            return
+        with open(self.store) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["kind"] == "completion":
+                    self._completions[entry["key"]] = entry["text"]
+                    if entry.get("tool_calls"):
+                        self._tool_calls[entry["key"]] = entry["tool_calls"]
+                else:
+                    self._embeddings[entry["key"]] = entry["embedding"]
+        logger.info(
+            f"Loaded {len(self._completions)} completions and {len(self._embeddings)} embeddings from {self.store}"
+        )
+
+    def _append(self, entry: dict) -> None:
+        with self._lock:
+            if os.path.dirname(self.store):
+                os.makedirs(os.path.dirname(self.store), exist_ok=True)
+            with open(self.store, "a") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def completion_key(model: str, messages: List[dict], **kwargs: Any) -> str:
+        """Fixture key of a completion request; streaming does not change it."""
+        options = {k: v for k, v in kwargs.items() if k not in _TRANSPORT_KWARGS}
+        return ResponseCache.key(model, messages, **options)
+
+    @staticmethod
+    def embedding_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    # ------------------------------------------------------------------
+    # Completions
+    # ------------------------------------------------------------------
+    def completion(self, model: str, messages: List[dict], **kwargs: Any) -> Any:
+        """Drop-in replacement of `litellm.completion`."""
+        key = self.completion_key(model, messages, **kwargs)
+        if self.mode == "record":
+            return self._replay(key, model, messages, self._record(key, model, messages, **kwargs), **kwargs)
+        text = self._lookup(key, model)
+        time.sleep(self.latency)
+        self._maybe_rate_limit(key, model)
+        return self._replay(key, model, messages, text, **kwargs)
+
+    async def acompletion(self, model: str, messages: List[dict], **kwargs: Any) -> Any:
+        """Drop-in replacement of `litellm.acompletion`."""
+        key = self.completion_key(model, messages, **kwargs)
+        if self.mode == "record":
+            text = await asyncio.to_thread(self._record, key, model, messages, **kwargs)
+            return await self._areplay(key, model, messages, text, **kwargs)
+        text = self._lookup(key, model)
+        await asyncio.sleep(self.latency)
+        self._maybe_rate_limit(key, model)
+        return await self._areplay(key, model, messages, text, **kwargs)
+
+    def _record(self, key: str, model: str, messages: List[dict], **kwargs: Any) -> str:
+        # The full text is needed for the fixture, so the real request is never streamed
+        options = {k: v for k, v in kwargs.items() if k not in _TRANSPORT_KWARGS}
+        response = litellm.completion(model=model, messages=messages, **options)
+        message = response.choices[0].message
+        text = message.content or ""
+        entry = {"kind": "completion", "key": key, "model": model, "text": text}
+        if message.tool_calls:
+            entry["tool_calls"] = self._tool_calls[key] = [tool_call.model_dump() for tool_call in message.tool_calls]
+        self._completions[key] = text
+        self._append(entry)
+        return text
+
+    def _lookup(self, key: str, model: str) -> str:
+        text = self._completions.get(key)
+        if text is None:
+            self.misses += 1
+            raise FixtureNotFoundError(f"No recorded completion of {model} for request {key[:12]}")
+        self.hits += 1
+        return text
+
+    def _maybe_rate_limit(self, key: str, model: str) -> None:
+        """Fail deterministically: the n-th attempt of a request always behaves the same."""
+        if not self.rate_limit_rate:
+            return
+        with self._lock:
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+        digest = hashlib.sha256(f"{self.seed}\0{key}\0{attempt}".encode("utf-8")).digest()
+        if int.from_bytes(digest[:8], "big") / 2 ** 64 < self.rate_limit_rate:
+            self.injected_rate_limits += 1
+            raise litellm.RateLimitError("Injected rate limit (mock backend)", llm_provider="mock", model=model)
+
+    def _replay_kwargs(self, key: str, kwargs: dict) -> dict:
+        # Provider credentials, schemas and tools mean nothing to litellm's mock path
+        options = {k: v for k, v in kwargs.items() if k in _TRANSPORT_KWARGS or k in ("temperature", "max_tokens")}
+        if key in self._tool_calls:
+            options["mock_tool_calls"] = self._tool_calls[key]
+        return options
+
+    def _replay(self, key: str, model: str, messages: List[dict], text: str, **kwargs: Any) -> Any:
+        return litellm.completion(
+            model=model, messages=messages, mock_response=text, **self._replay_kwargs(key, kwargs)
+        )
+
+    async def _areplay(self, key: str, model: str, messages: List[dict], text: str, **kwargs: Any) -> Any:
+        return await litellm.acompletion(
+            model=model, messages=messages, mock_response=text, **self._replay_kwargs(key, kwargs)
+        )
+
+    # ------------------------------------------------------------------
+    # Embeddings
+    # ------------------------------------------------------------------
+    def embedding(self, model: str, input: List[str], **kwargs: Any) -> litellm.EmbeddingResponse:
+        """Drop-in replacement of `litellm.embedding`."""
+        keys = [self.embedding_key(model, text) for text in input]
+        if self.mode == "record":
+            response = litellm.embedding(model=model, input=input, **kwargs)
+            for key, item in zip(keys, response.data):
+                self._embeddings[key] = item["embedding"]
+                self._append({"kind": "embedding", "key": key, "model": model, "embedding": item["embedding"]})
+            return response
+
+        time.sleep(self.latency)
+        vectors = []
+        for key in keys:
+            vector = self._embeddings.get(key)
+            if vector is None:
+                self.misses += 1
+                vector = self._fake_embedding(key)
+            else:
+                self.hits += 1
+            vectors.append(vector)
+        return litellm.EmbeddingResponse(
+            model=model,
+            data=[{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+        )
+
+    async def aembedding(self, model: str, input: List[str], **kwargs: Any) -> litellm.EmbeddingResponse:
+        """Drop-in replacement of `litellm.aembedding`."""
+        return await asyncio.to_thread(self.embedding, model, input, **kwargs)
+
+    def _fake_embedding(self, key: str) -> List[float]:
+        """A unit vector fully determined by the text hash and the seed."""
+        values, counter = [], 0
+        while len(values) < self.embedding_dim:
+            digest = hashlib.sha256(f"{self.seed}\0{key}\0{counter}".encode("utf-8")).digest()
+            values.extend(b / 127.5 - 1.0 for b in digest)
+            counter += 1
+        values = values[: self.embedding_dim]
+        norm = sum(v * v for v in values) ** 0.5 or 1.0
+        return [v / norm for v in values]
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "injected_rate_limits": self.injected_rate_limits,
+            "completions": len(self._completions),
+            "embeddings": len(self._embeddings),
+        }
@@ -1,10 +1,18 @@
 import json
 import re
+from collections import Counter
 from typing import Any, Dict, List, Optional
 
-import dirtyjson
+from loguru import logger
 
 from core.exceptions import ResponseParsingError
+from core.json_repair import load_literal, repair_json
+
+
+# A brace that opens a line, the start of a bare JSON object
+_LINE_BRACE = re.compile(r"(?m)^[ \t]*\{")
+# The language tag of a fenced block
+_FENCE_TAG = re.compile(r"^[\w-]*[ \t]*\n")
 
 
 class MarkdownJsonDictParser:
@@ -14,9 +22,38 @@ class MarkdownJsonDictParser:
         self,
         content_hint: Optional[Dict[str, Any]] = None,
         required_keys: Optional[List[str]] = None,
+        schema: Optional[Dict[str, Any]] = None,
+        name: str = "response",
     ) -> None:
+        """
+        Args:
+            content_hint: Example values shown to the model for each key.
+            required_keys: Keys that must be present in the parsed dict.
+            schema: JSON schemas of the keys. If given, the parser can be
+                enforced natively by the provider through `response_format`;
+                keys without an entry are described as strings.
+            name: Name of the response schema sent to the provider.
+        """
         self.content_hint = content_hint or {}
         self.required_keys = required_keys or []
+        self.schema = schema
+        self.name = name
+        # Keys whose hint is a list or object (e.g. a `str([...])` hint), loaded when returned as a string
+        self.nested_keys = [key for key, hint in self.content_hint.items() if self._is_container_hint(hint)]
+        # Repair steps needed by the last parsed response, and how often each fired
+        self.last_repairs: List[str] = []
+        self.repair_counts: Counter = Counter()
+
+    @staticmethod
+    def _is_container_hint(hint: Any) -> bool:
+        if isinstance(hint, (list, dict)):
+            return True
+        if not isinstance(hint, str):
+            return False
+        try:
+            return isinstance(load_literal(hint), (list, dict))
+        except ValueError:
+            return False
 
     @property
     def format_instruction(self) -> str:
@@ -29,27 +66,42 @@ class MarkdownJsonDictParser:
             "```"
         )
 
+    @property
+    def json_schema(self) -> Optional[dict]:
+        """JSON schema of the expected object, or None if the parser has no schema."""
+        if self.schema is None:
+            return None
+        properties = {}
+        for key, hint in self.content_hint.items():
+            properties[key] = self.schema.get(key, {"type": "string", "description": str(hint)})
+        return {"type": "object", "properties": properties, "required": list(self.required_keys)}
+
+    @property
+    def response_format(self) -> Optional[dict]:
+        """The `response_format` argument for providers with native structured output."""
+        schema = self.json_schema
+        if schema is None:
+            return None
+        return {"type": "json_schema", "json_schema": {"name": self.name, "schema": schema}}
+
     def parse(self, text: str) -> dict:
         """Extract and parse JSON from a markdown code block.
 
-        Falls back to dirtyjson for malformed JSON.
+        Malformed JSON is repaired locally (see `core.json_repair`) before the
+        response is rejected, so the model is only asked again when nothing
+        usable can be recovered.
         """
-        # Try to extract from markdown code block
-        match = re.search(r"```(?:json)?\s*\n?(.*?)```", text, re.DOTALL)
-        raw = match.group(1).strip() if match else text.strip()
-
         try:
-            result = json.loads(raw)
-        except json.JSONDecodeError:
-            try:
-                result = dirtyjson.loads(raw)
-                # dirtyjson returns AttributedDict; convert to plain dict
-                result = json.loads(json.dumps(result))
-            except Exception:
-                raise ResponseParsingError(
-                    f"Failed to parse JSON from response:\n{raw}",
-                    raw_response=text,
-                )
+            result = repair_json(text, accept=self._accept, nested_keys=self.nested_keys)
+        except ValueError:
+            raise ResponseParsingError(
+                f"Failed to parse JSON from response:\n{text}",
+                raw_response=text,
+            )
+        result, self.last_repairs = result.value, result.repairs
+        if self.last_repairs:
+            self.repair_counts.update(self.last_repairs)
+            logger.debug(f"Repaired JSON response with {self.last_repairs}")
 
         if not isinstance(result, dict):
             raise ResponseParsingError(
@@ -66,3 +118,101 @@ class MarkdownJsonDictParser:
             )
 
         return result
+
+    def _accept(self, value: Any) -> bool:
+        """Prefer a block that is a dict with all required keys when the response has several."""
+        return isinstance(value, dict) and all(k in value for k in self.required_keys)
+
+
+class JsonBlockDetector:
+    """Incrementally detects when the first JSON block of a streamed response is complete.
+
+    The block is either a fenced markdown code block (closed by the second
+    ```` ``` ````) or, while no fence has been seen, a bare top-level object
+    whose ``{`` opens a line (closed when its braces balance). A closed block
+    that does not load as a JSON object is skipped and scanning goes on, so
+    braces or code blocks in the prose never cut the stream short. Each
+    character is scanned once, plus the unfinished last line between chunks.
+    """
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.closed = False
+        self._pos = 0
+        self._mode = None
+        self._start = 0
+        self._fenced = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> bool:
+        """Append a streamed chunk; return True once the first block has closed."""
+        if self.closed:
+            return True
+        self.text += chunk
+        text = self.text
+
+        while self._pos < len(text) and not self.closed:
+            if self._mode is None:
+                fence = text.find("`", self._pos)
+                brace = -1
+                if not self._fenced:
+                    match = _LINE_BRACE.search(text, self._pos)
+                    brace = match.end() - 1 if match else -1
+                if brace != -1 and (fence == -1 or brace < fence):
+                    self._mode, self._start, self._depth, self._pos = "object", brace, 1, brace + 1
+                elif fence != -1:
+                    if len(text) - fence < 3:
+                        # Wait for more text to tell a fence from a single backtick
+                        self._pos = fence
+                        break
+                    if text.startswith("```", fence):
+                        self._mode, self._fenced = "fence", True
+                        self._start = self._pos = fence + 3
+                    else:
+                        self._pos = fence + 1
+                else:
+                    # Rescan the unfinished last line, a brace may still open it
+                    self._pos = max(self._pos, text.rfind("\n") + 1)
+                    break
+            elif self._mode == "fence":
+                end = text.find("```", self._pos)
+                if end == -1:
+                    # Keep the last two characters in case the closing fence is split
+                    self._pos = max(self._pos, len(text) - 2)
+                    break
+                self._close(_FENCE_TAG.sub("", text[self._start : end], count=1), end + 3)
+            else:
+                self._scan_object(text)
+        return self.closed
+
+    def _close(self, block: str, end: int) -> None:
+        """Stop at a block that loads as a JSON object, else keep scanning after it."""
+        try:
+            self.closed = isinstance(load_literal(block), dict)
+        except ValueError:
+            pass
+        if not self.closed:
+            self._mode, self._pos = None, end
+
+    def _scan_object(self, text: str) -> None:
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._close(text[self._start : i + 1], i + 1)
+                    return
+        self._pos = len(text)
@@ -0,0 +1,200 @@
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from loguru import logger
+
+from core.exceptions import ResponseParsingError
+
+
+# Attribute names models use instead of the canonical ones
+_TYPE_ALIASES = {
+    "gender": "sex",
+    "location": "city_country",
+    "city": "city_country",
+    "current_city_country": "city_country",
+    "birthplace": "birth_city_country",
+    "place_of_birth": "birth_city_country",
+    "birth_city": "birth_city_country",
+    "income": "income_level",
+    "relationship": "relationship_status",
+    "marital_status": "relationship_status",
+    "education_level": "education",
+    "job": "occupation",
+}
+_TYPE_SEPARATORS = re.compile(r"[\s\-/]+")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_CATEGORIES = re.compile(r"categorical value from range \[([^\]]*)\]")
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_COMMA_SPACING = re.compile(r"\s*,\s*")
+MAX_CONFIDENCE = 5.0
+
+
+@lru_cache(maxsize=None)
+def _category_options() -> Dict[str, Dict[str, str]]:
+    """Map each categorical attribute to {normalized value: canonical value}, parsed from `attr_docs`."""
+    from util.prompt_loader import attr_docs
+
+    options = {}
+    for attr, doc in attr_docs.items():
+        match = _CATEGORIES.search(doc)
+        if match is None:
+            continue
+        lookup = {}
+        for value in (v.strip() for v in match.group(1).split(",")):
+            # "In College/HS Diploma" also matches "HS Diploma"
+            for alias in [value] + value.split("/"):
+                lookup.setdefault(_key(alias), value)
+        options[attr] = lookup
+    return options
+
+
+@lru_cache(maxsize=None)
+def _known_attributes() -> frozenset:
+    from util.prompt_loader import attr_docs
+
+    return frozenset(attr_docs)
+
+
+def _key(value: str) -> str:
+    return _NON_ALNUM.sub("", value.casefold())
+
+
+def normalize_type(value: Any) -> str:
+    attr = _TYPE_SEPARATORS.sub("_", str(value).strip().lower())
+    return _TYPE_ALIASES.get(attr, attr)
+
+
+def normalize_confidence(value: Any) -> float:
+    """Read a 0-5 confidence score from a number or text such as "4", "4/5" or "confidence: 3"."""
+    if isinstance(value, bool):
+        value = float(value)
+    if not isinstance(value, (int, float)):
+        match = _NUMBER.search(str(value))
+        value = float(match.group()) if match else 0.0
+    return min(max(float(value), 0.0), MAX_CONFIDENCE)
+
+
+def normalize_guess(attr: str, value: Any) -> str:
+    """Map a guess onto the canonical form of its attribute."""
+    guess = " ".join(str(value).split())
+    options = _category_options().get(attr)
+    if options is not None:
+        return options.get(_key(guess), guess)
+    if attr == "age":
+        numbers = _NUMBER.findall(guess)
+        return str(int(float(numbers[0]))) if len(numbers) == 1 else guess
+    if attr in ("city_country", "birth_city_country"):
+        return _COMMA_SPACING.sub(", ", guess)
+    return guess
+
+
+class PIIRecord:
+    """One inferred personal attribute, validated and normalized once when it is parsed.
+
+    Records are immutable, so messages and lists can share them without copies.
+    The repr is compact JSON, which is also how records appear in prompts.
+    """
+
+    __slots__ = ("type", "confidence", "evidence", "guess")
+
+    def __init__(self, type: str, confidence: float, evidence: str = "", guess: Sequence[str] = ()) -> None:
+        object.__setattr__(self, "type", type)
+        object.__setattr__(self, "confidence", confidence)
+        object.__setattr__(self, "evidence", evidence)
+        object.__setattr__(self, "guess", tuple(guess))
+
+    def __setattr__(self, key: str, value: Any) -> None:
+        raise AttributeError(f"PIIRecord is immutable, cannot set '{key}'")
+
+    def __copy__(self) -> "PIIRecord":
+        return self
+
+    def __deepcopy__(self, memo: dict) -> "PIIRecord":
+        return self
+
+    def __reduce__(self):
+        return (PIIRecord, (self.type, self.confidence, self.evidence, self.guess))
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, PIIRecord):
+            return NotImplemented
+        return self.to_tuple() == other.to_tuple()
+
+    def __hash__(self) -> int:
+        return hash(self.to_tuple())
+
+    def to_tuple(self) -> tuple:
+        return (self.type, self.confidence, self.evidence, self.guess)
+
+    def to_dict(self) -> dict:
+        """Return the record in the JSON layout of the prompts and the `pii/*.json` files."""
+        confidence = int(self.confidence) if self.confidence.is_integer() else self.confidence
+        return {"type": self.type, "confidence": confidence, "evidence": self.evidence, "guess": list(self.guess)}
+
+    def __repr__(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    @classmethod
+    def from_dict(cls, entry: Any, attributes: Optional[Iterable[str]] = None) -> "PIIRecord":
+        """Validate and normalize one raw result.
+
+        Args:
+            entry: A result dict as returned by the model.
+            attributes: Allowed attribute types; defaults to every attribute in `attr_docs`.
+
+        Raises:
+            ValueError: If the entry is not a dict, has an unknown type or no guess.
+        """
+        if isinstance(entry, PIIRecord):
+            return entry
+        if not isinstance(entry, dict):
+            raise ValueError(f"expected a dict, got {type(entry).__name__}")
+        attr = normalize_type(entry.get("type", ""))
+        allowed = _known_attributes() if attributes is None else attributes
+        if attr not in allowed:
+            raise ValueError(f"unknown attribute type '{entry.get('type')}'")
+
+        guesses = entry.get("guess", [])
+        if not isinstance(guesses, (list, tuple)):
+            guesses = [guesses]
+        guess = [normalize_guess(attr, g) for g in guesses if g is not None and str(g).strip()]
+        if not guess:
+            raise ValueError(f"no guess for '{attr}'")
+
+        return cls(
+            attr,
+            normalize_confidence(entry.get("confidence", 0)),
+            str(entry.get("evidence", "")).strip(),
+            guess,
+        )
+
+
+def parse_pii_results(results: Any, attributes: Optional[Sequence[str]] = None, raw_response: str = "") -> List[PIIRecord]:
+    """Turn the `results` field of a response into records, dropping invalid entries.
+
+    Raises:
+        ResponseParsingError: If `results` is not a list, or none of its entries is valid.
+    """
+    if not isinstance(results, list):
+        raise ResponseParsingError(
+            f"The results should be a list of dict, not {type(results)}.",
+            raw_response=raw_response,
+        )
+    allowed = None if attributes is None else frozenset(attributes)
+    records, errors = [], []
+    for entry in results:
+        try:
+            records.append(PIIRecord.from_dict(entry, allowed))
+        except ValueError as e:
+            errors.append(str(e))
+    if errors:
+        logger.debug(f"Dropped {len(errors)} invalid PII results: {errors}")
+        if not records:
+            raise ResponseParsingError(
+                f"No valid attribute in the results: {'; '.join(errors)}. "
+                f"The type should be one of {sorted(allowed or _known_attributes())}.",
+                raw_response=raw_response,
+            )
+    return records
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+
+DEFAULT_RATE_LIMIT_PATH = "./dataset/cache/ratelimit.sqlite"
+
+
+class RateLimiter:
+    """Token-bucket limiter for requests-per-minute and tokens-per-minute budgets.
+
+    Requests are admitted before they are sent instead of backing off after a
+    429. The bucket state lives in a SQLite file so every thread and every
+    local worker process using the same `path` and `name` draws from one
+    budget; with `path=None` the state is kept in this process only.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        path: Optional[str] = DEFAULT_RATE_LIMIT_PATH,
+    ) -> None:
+        """
+        Args:
+            name: Bucket name, usually the model identifier.
+            rpm: Requests per minute, or None for no request budget.
+            tpm: Tokens (prompt + completion) per minute, or None for no token budget.
+            path: SQLite file shared by worker processes, or None for a process-local bucket.
+        """
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.path = path
+        self.waited = 0.0
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._state = None
+
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = self._conn()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT PRIMARY KEY, requests REAL, tokens REAL, updated REAL, blocked_until REAL)"
+            )
+
+    @classmethod
+    def from_config(cls, config: dict, prefix: str = "") -> Optional["RateLimiter"]:
+        """Build the limiter from a model config, or return None if neither `rpm` nor `tpm` is set.
+
+        With `prefix="embedding_"` the budget of the embedding model is read
+        from `embedding_rpm`/`embedding_tpm` and named after `embedding_model`.
+        """
+        rpm, tpm = config.get(f"{prefix}rpm"), config.get(f"{prefix}tpm")
+        if not rpm and not tpm:
+            return None
+        return cls(
+            config[f"{prefix}model"],
+            rpm=rpm,
+            tpm=tpm,
+            path=config.get("rate_limit_path", DEFAULT_RATE_LIMIT_PATH),
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _update(self, func) -> float:
+        """Run `func(state, now) -> (state, result)` atomically on the shared bucket."""
+        with self._lock:
+            now = time.time()
+            if self.path is None:
+                self._state, result = func(self._state or self._full(now), now)
+                return result
+
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT requests, tokens, updated, blocked_until FROM buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                state, result = func(list(row) if row else self._full(now), now)
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, requests, tokens, updated, blocked_until) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (self.name, *state),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def _full(self, now: float) -> list:
+        return [self.rpm or 0.0, self.tpm or 0.0, now, 0.0]
+
+    def _refill(self, state: list, now: float) -> list:
+        requests, tokens, updated, blocked_until = state
+        elapsed = max(0.0, now - updated)
+        if self.rpm:
+            requests = min(self.rpm, requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            tokens = min(self.tpm, tokens + elapsed * self.tpm / 60)
+        return [requests, tokens, now, blocked_until]
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Try to take one request and `tokens` tokens from the bucket.
+
+        Returns 0 if the request was admitted, otherwise the number of seconds
+        to wait before trying again (nothing is taken in that case).
+        """
+
+        def take(state, now):
+            state = self._refill(state, now)
+            wait = max(0.0, state[3] - now)
+            if wait == 0 and self.rpm and state[0] < 1:
+                wait = (1 - state[0]) * 60 / self.rpm
+            if wait == 0 and self.tpm:
+                # A request larger than the whole budget waits for a full bucket
+                needed = min(tokens, self.tpm)
+                if state[1] < needed:
+                    wait = (needed - state[1]) * 60 / self.tpm
+            if wait == 0:
+                state[0] -= 1
+                state[1] -= tokens
+            return state, wait
+
+        return self._update(take)
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block until the request is admitted."""
+        while True:
+            wait = self.reserve(tokens)
+            if wait == 0:
+                return
+            self.waited += wait
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        """Async counterpart of `acquire`.
+
+        The bucket transaction may wait on other workers' locks, so it runs in
+        a thread instead of stalling the event loop.
+        """
+        while True:
+            wait = await asyncio.to_thread(self.reserve, tokens)
+            if wait == 0:
+                return
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Correct the token bucket once the real usage of an admitted request is known."""
+        if not self.tpm or actual == estimated:
+            return
+
+        def correct(state, now):
+            state = self._refill(state, now)
+            state[1] -= actual - estimated
+            return state, 0.0
+
+        self._update(correct)
+
+    def penalize(self, seconds: float) -> None:
+        """Pause every user of the bucket, e.g. after the provider still answered 429."""
+
+        def block(state, now):
+            state = self._refill(state, now)
+            state[3] = max(state[3], now + seconds)
+            return state, 0.0
+
+        logger.warning(f"Rate limit bucket '{self.name}' paused for {seconds:.1f}s")
+        self._update(block)
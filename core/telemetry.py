@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+
+@dataclass
+class CallRecord:
+    """Structured measurement of one LLMClient call."""
+
+    agent: str
+    method: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    latency: float = 0.0
+    rate_limit_retries: int = 0
+    parse_failures: int = 0
+    cost: float = 0.0
+    # True if the response came from the local response cache
+    cache_hit: bool = False
+    # True if the provider was asked to enforce the response JSON schema
+    structured_output: bool = False
+    # True if tool schemas were sent for native function calling
+    native_tools: bool = False
+    # Exception class name if the call finally failed
+    error: Optional[str] = None
+    user: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+
+class TelemetrySink:
+    """Receives a `CallRecord` for every LLM call. Override `emit` in subclass."""
+
+    def emit(self, record: CallRecord) -> None:
+        raise NotImplementedError
+
+
+class JsonlSink(TelemetrySink):
+    """Appends records as JSON lines to a file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def emit(self, record: CallRecord) -> None:
+        line = json.dumps(asdict(record), ensure_ascii=False)
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class MemorySink(TelemetrySink):
+    """Keeps records in memory and rolls them up per agent and method."""
+
+    def __init__(self) -> None:
+        self.records: List[CallRecord] = []
+        self._lock = threading.Lock()
+
+    def emit(self, record: CallRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    def rollup(self) -> dict:
+        """Aggregate the records into totals overall, per agent and per agent/method."""
+        groups = defaultdict(list)
+        for record in self.records:
+            groups["total"].append(record)
+            groups[record.agent].append(record)
+            groups[f"{record.agent}.{record.method}"].append(record)
+        return {name: self._aggregate(records) for name, records in groups.items()}
+
+    @staticmethod
+    def _aggregate(records: List[CallRecord]) -> dict:
+        calls = len(records)
+        parse_failures = sum(r.parse_failures for r in records)
+        return {
+            "calls": calls,
+            "prompt_tokens": sum(r.prompt_tokens for r in records),
+            "completion_tokens": sum(r.completion_tokens for r in records),
+            "cached_tokens": sum(r.cached_tokens for r in records),
+            "cost": round(sum(r.cost for r in records), 6),
+            "latency": round(sum(r.latency for r in records), 3),
+            "rate_limit_retries": sum(r.rate_limit_retries for r in records),
+            "parse_failures": parse_failures,
+            # Share of model responses that could not be parsed and had to be asked again
+            "parse_retry_rate": round(parse_failures / calls, 4) if calls else 0.0,
+            "cache_hits": sum(r.cache_hit for r in records),
+            "structured_calls": sum(r.structured_output for r in records),
+            "native_tool_calls": sum(r.native_tools for r in records),
+            "errors": sum(r.error is not None for r in records),
+        }
+
+    def write_rollup(self, path: str) -> None:
+        """Write the roll-up as JSON, e.g. to `dataset/{model}/telemetry/{user}.json`."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.rollup(), f, indent=2)
+
+
+class FanoutSink(TelemetrySink):
+    """Forwards records to several sinks, optionally stamping them with a user."""
+
+    def __init__(self, sinks: List[TelemetrySink], user: Optional[str] = None) -> None:
+        self.sinks = [sink for sink in sinks if sink is not None]
+        self.user = user
+
+    def emit(self, record: CallRecord) -> None:
+        if self.user is not None:
+            record.user = self.user
+        for sink in self.sinks:
+            sink.emit(record)
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from loguru import logger
+
+from core.toolkit import ServiceExecStatus, ServiceResponse
+
+
+# Bound arguments that do not change a tool's result and must not leak into keys
+_IGNORED_KWARGS = {"api_key"}
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_argument(value: Any) -> Any:
+    """Normalize a tool argument so near-identical calls share a cache entry.
+
+    Text is stripped, whitespace-collapsed and case-folded; URLs keep their
+    path case but drop the fragment and a trailing slash.
+    """
+    if isinstance(value, str):
+        text = _WHITESPACE.sub(" ", value.strip())
+        if text.startswith(("http://", "https://")):
+            parts = urlsplit(text)
+            return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), parts.query, ""))
+        return text.casefold()
+    if isinstance(value, (list, tuple)):
+        return [normalize_argument(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize_argument(v) for k, v in sorted(value.items())}
+    return value
+
+
+def state_fingerprint(bound_kwargs: Dict[str, Any]) -> Optional[str]:
+    """Content hash of a tool's bound arguments, or None if they cannot be serialized.
+
+    Tools bound to live objects (e.g. a vector index) are only cached in
+    memory under a per-registration token, since such state cannot be
+    recognized again in another process.
+    """
+    state = {k: v for k, v in bound_kwargs.items() if k not in _IGNORED_KWARGS}
+    try:
+        payload = json.dumps(state, sort_keys=True, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ToolCache:
+    """Memoizes successful tool results, declared per tool by `ServiceToolkit.add`.
+
+    Each tool has its own in-memory LRU with a size bound and an optional TTL.
+    If a path is given, results of tools whose bound state is serializable are
+    also stored in a SQLite file, so web searches and page digests are reused
+    across users, runs and worker processes. Error results are never cached.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None, evict_every: int = 100) -> None:
+        """
+        Args:
+            path: SQLite file of the on-disk layer, or None to cache in memory only.
+            max_entries: Keep at most this many entries on disk (least recently stored go first).
+            evict_every: Run disk eviction after this many insertions.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+
+        self.hits: Dict[str, int] = defaultdict(int)
+        self.disk_hits: Dict[str, int] = defaultdict(int)
+        self.misses: Dict[str, int] = defaultdict(int)
+
+        self._lock = threading.Lock()
+        self._memory: Dict[str, OrderedDict] = {}
+        self._local = threading.local()
+        self._puts = 0
+
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = self._conn()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tool_results ("
+                "key TEXT PRIMARY KEY, tool TEXT, status INTEGER, content TEXT, created REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tool_results_created ON tool_results(created)")
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional["ToolCache"]:
+        """Build the cache from a model config; `tool_cache: false` disables it."""
+        if not config.get("tool_cache", True):
+            return None
+        return cls(config.get("tool_cache_path"), max_entries=config.get("tool_cache_max_entries"))
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def new_token() -> str:
+        """A memory-only state token for tools bound to live objects."""
+        return f"live:{uuid.uuid4().hex}"
+
+    @staticmethod
+    def key(tool: str, state: str, arguments: Dict[str, Any]) -> str:
+        """Return the address of a call from the tool, its bound state and its normalized arguments."""
+        payload = json.dumps(
+            {"tool": tool, "state": state, "arguments": normalize_argument(arguments)},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, tool: str, key: str, ttl: Optional[float] = None, persistent: bool = False) -> Optional[ServiceResponse]:
+        """Return a cached result younger than `ttl`, counting a hit or a miss."""
+        now = time.time()
+        with self._lock:
+            entries = self._memory.get(tool)
+            entry = entries.get(key) if entries is not None else None
+            if entry is not None:
+                if ttl is None or now - entry[0] <= ttl:
+                    entries.move_to_end(key)
+                    self.hits[tool] += 1
+                    return entry[1]
+                del entries[key]
+
+        if persistent and self.path is not None:
+            row = self._conn().execute(
+                "SELECT status, content, created FROM tool_results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and (ttl is None or now - row[2] <= ttl):
+                response = ServiceResponse(ServiceExecStatus(row[0]), json.loads(row[1]), tool)
+                self._remember(tool, key, row[2], response, None)
+                with self._lock:
+                    self.disk_hits[tool] += 1
+                return response
+
+        with self._lock:
+            self.misses[tool] += 1
+        return None
+
+    def put(
+        self,
+        tool: str,
+        key: str,
+        response: ServiceResponse,
+        max_size: Optional[int] = None,
+        persistent: bool = False,
+    ) -> None:
+        """Store a successful result in memory and, for persistent tools, on disk."""
+        if response.status != ServiceExecStatus.SUCCESS:
+            return
+        now = time.time()
+        self._remember(tool, key, now, response, max_size)
+        if not persistent or self.path is None:
+            return
+        try:
+            content = json.dumps(response.content, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return
+        self._conn().execute(
+            "INSERT OR REPLACE INTO tool_results (key, tool, status, content, created) VALUES (?, ?, ?, ?, ?)",
+            (key, tool, int(response.status), content, now),
+        )
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def _remember(self, tool: str, key: str, created: float, response: ServiceResponse, max_size: Optional[int]) -> None:
+        with self._lock:
+            entries = self._memory.setdefault(tool, OrderedDict())
+            entries[key] = (created, response)
+            entries.move_to_end(key)
+            while max_size is not None and len(entries) > max_size:
+                entries.popitem(last=False)
+
+    def evict(self, max_age: Optional[float] = None) -> int:
+        """Apply the disk entry bound, and an age bound if given. Returns the number of removed entries."""
+        if self.path is None:
+            return 0
+        conn = self._conn()
+        removed = 0
+        if max_age is not None:
+            removed += conn.execute("DELETE FROM tool_results WHERE created < ?", (time.time() - max_age,)).rowcount
+        if self.max_entries is not None:
+            removed += conn.execute(
+                "DELETE FROM tool_results WHERE key IN ("
+                "SELECT key FROM tool_results ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        if removed:
+            logger.debug(f"Tool cache evicted {removed} entries")
+        return removed
+
+    def stats(self) -> dict:
+        """Return per-tool hit/miss counters of this process and the size of the store."""
+        with self._lock:
+            tools = {}
+            for tool in sorted(set(self.hits) | set(self.disk_hits) | set(self.misses)):
+                hits = self.hits[tool] + self.disk_hits[tool]
+                lookups = hits + self.misses[tool]
+                tools[tool] = {
+                    "hits": self.hits[tool],
+                    "disk_hits": self.disk_hits[tool],
+                    "misses": self.misses[tool],
+                    "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                    "entries": len(self._memory.get(tool, ())),
+                }
+        stats = {"tools": tools}
+        if self.path is not None:
+            rows = self._conn().execute("SELECT tool, COUNT(*) FROM tool_results GROUP BY tool").fetchall()
+            stats["disk_entries"] = dict(rows)
+        return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or prune an on-disk tool result cache.")
+    parser.add_argument("command", choices=["stats", "evict", "clear"])
+    parser.add_argument("--path", "-p", type=str, required=True, help="The SQLite cache file.")
+    parser.add_argument("--max_entries", type=int, default=None)
+    parser.add_argument("--max_age_days", type=float, default=None)
+    args = parser.parse_args()
+
+    cache = ToolCache(args.path, max_entries=args.max_entries)
+    if args.command == "clear":
+        cache._conn().execute("DELETE FROM tool_results")
+    elif args.command == "evict":
+        print(f"Evicted {cache.evict(args.max_age_days * 86400 if args.max_age_days else None)} entries")
+    print(json.dumps(cache.stats(), indent=2))
@@ -1,8 +1,40 @@
+import asyncio
 import inspect
 import json
-from dataclasses import dataclass
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, replace
 from enum import IntEnum
-from typing import Any, Callable, Dict, List, Optional
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from core.tool_cache import ToolCache
+
+
+# JSON schema types of annotated (or defaulted) tool parameters
+_JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean", list: "array", dict: "object"}
+
+
+def _json_schema_type(annotation: Any) -> Optional[dict]:
+    """Return the JSON schema type of a parameter annotation, or None if it has no plain equivalent."""
+    origin = typing.get_origin(annotation) or annotation
+    if origin is typing.Union:
+        # Optional[X] is described as X
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return _json_schema_type(args[0]) if len(args) == 1 else None
+    if origin not in _JSON_TYPES:
+        return None
+    schema = {"type": _JSON_TYPES[origin]}
+    if origin is list:
+        args = typing.get_args(annotation)
+        item = _json_schema_type(args[0]) if args else None
+        schema["items"] = item or {}
+    return schema
 
 
 class ServiceExecStatus(IntEnum):
@@ -15,6 +47,8 @@ class ServiceResponse:
     """Response from a service function."""
     status: ServiceExecStatus
     content: Any
+    # Name of the tool that produced the response, set by the toolkit
+    name: str = ""
 
     def __str__(self) -> str:
         return f"[STATUS]: {self.status.name}\n[RESULT]: {self.content}"
@@ -23,14 +57,54 @@ class ServiceResponse:
 class ServiceToolkit:
     """Registry for tool functions with the same interface as AgentScope's ServiceToolkit."""
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        max_workers: int = 8,
+        default_timeout: Optional[float] = None,
+        cache: Optional["ToolCache"] = None,
+    ) -> None:
+        """
+        Args:
+            max_workers: Size of the thread pool running independent tool calls.
+            default_timeout: Seconds after which a call of a tool without its own timeout is given up.
+            cache: Result cache of the tools registered with `cache=True`; may be shared by toolkits.
+        """
         self._tools: Dict[str, dict] = {}
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self.cache = cache
+        self._pool: Optional[ThreadPoolExecutor] = None
 
-    def add(self, func: Callable, **bound_kwargs: Any) -> None:
+    def add(
+        self,
+        func: Callable,
+        serial: bool = False,
+        timeout: Optional[float] = None,
+        cache: bool = False,
+        cache_ttl: Optional[float] = None,
+        cache_size: int = 256,
+        cache_state: Tuple[str, ...] = (),
+        **bound_kwargs: Any,
+    ) -> None:
         """Register a tool function with pre-bound keyword arguments.
 
         Only parameters NOT in bound_kwargs will be exposed to the LLM.
+
+        Args:
+            func: The tool function, sync or async.
+            serial: The tool mutates shared (bound) state, so its calls never
+                run concurrently and keep the order in which they were made.
+            timeout: Seconds after which a call is reported as failed.
+            cache: Memoize successful results in the toolkit's cache, keyed by
+                the normalized arguments and the bound state. Only for tools
+                whose result depends on nothing else.
+            cache_ttl: Seconds a cached result stays valid, None for the whole run.
+            cache_size: Results of this tool kept in memory.
+            cache_state: Bound arguments that change between calls (e.g. a
+                `visited` list); their current values are part of every key.
         """
+        if cache and serial:
+            raise ValueError(f"'{func.__name__}' mutates its bound state and cannot be cached")
         sig = inspect.signature(func)
         doc = inspect.getdoc(func) or ""
 
@@ -43,7 +117,7 @@ class ServiceToolkit:
             # Try to extract param description from docstring
             # Look for "name (`type`): description" or "name: description"
             for pattern in [
-                rf"{name}\s*\(`[^`]*`\)[^:]*:\s*(.+?)(?:\n\s*\w|\Z)",
+                rf"{name}\s*\(`[^`]*`[^)]*\)[^:]*:\s*(.+?)(?:\n\s*\w|\Z)",
                 rf"{name}\s*:\s*(.+?)(?:\n\s*\w|\Z)",
             ]:
                 match = inspect.re.search(pattern, doc, inspect.re.DOTALL) if hasattr(inspect, 're') else None
@@ -54,11 +128,15 @@ class ServiceToolkit:
                     desc = match.group(1).strip()
                     break
 
+            annotation = param.annotation
+            if annotation is inspect.Parameter.empty and param.default is not inspect.Parameter.empty:
+                annotation = type(param.default)
             exposed_params.append({
                 "name": name,
                 "description": desc,
                 "default": None if param.default is inspect.Parameter.empty else param.default,
                 "required": param.default is inspect.Parameter.empty,
+                "schema": _json_schema_type(annotation),
             })
 
         # Extract the first line of the docstring as description
@@ -69,6 +147,23 @@ class ServiceToolkit:
             "bound_kwargs": bound_kwargs,
             "params": exposed_params,
             "description": func_desc,
+            "serial": serial,
+            "timeout": timeout,
+            "cache": self._cache_policy(cache_ttl, cache_size, cache_state, bound_kwargs) if cache else None,
+        }
+
+    @staticmethod
+    def _cache_policy(ttl: Optional[float], size: int, volatile: Tuple[str, ...], bound_kwargs: dict) -> dict:
+        from core.tool_cache import ToolCache, state_fingerprint
+
+        state = state_fingerprint({k: v for k, v in bound_kwargs.items() if k not in volatile})
+        return {
+            "ttl": ttl,
+            "size": size,
+            "volatile": volatile,
+            # Results bound to live objects are only valid for this registration
+            "state": state if state is not None else ToolCache.new_token(),
+            "persistent": state is not None,
         }
 
     @property
@@ -86,6 +181,31 @@ class ServiceToolkit:
             lines.append("")
         return "\n".join(lines)
 
+    @property
+    def json_schemas(self) -> List[dict]:
+        """OpenAI-style function schemas of the registered tools, for native tool calling."""
+        schemas = []
+        for name, info in self._tools.items():
+            properties = {}
+            for p in info["params"]:
+                prop = {"description": p["description"], **(p["schema"] or {})}
+                if not p["required"] and p["default"] is not None:
+                    prop["default"] = p["default"]
+                properties[p["name"]] = prop
+            schemas.append({
+                "type": "function",
+                "function": {
+                    "name": name,
+                    "description": info["description"],
+                    "parameters": {
+                        "type": "object",
+                        "properties": properties,
+                        "required": [p["name"] for p in info["params"] if p["required"]],
+                    },
+                },
+            })
+        return schemas
+
     @property
     def tools_calling_format(self) -> str:
         """Format hint string for tool calls."""
@@ -95,15 +215,8 @@ class ServiceToolkit:
             f"where function_name is one of {tool_names}"
         )
 
-    def parse_and_call_func(self, func_call: Any) -> str:
-        """Parse a function call specification and execute it.
-
-        Args:
-            func_call: A list/dict with 'name' and 'arguments' keys.
-
-        Returns:
-            Formatted string with [STATUS] and [RESULT].
-        """
+    def _normalize_calls(self, func_call: Any) -> Any:
+        """Turn a call specification into a list of calls, or an error response."""
         # Normalize to list
         if isinstance(func_call, dict):
             func_call = [func_call]
@@ -113,37 +226,183 @@ class ServiceToolkit:
                 if isinstance(func_call, dict):
                     func_call = [func_call]
             except json.JSONDecodeError:
-                return f"[STATUS]: {ServiceExecStatus.ERROR.name}\n[RESULT]: Failed to parse function call: {func_call}"
-
-        results = []
-        for call in func_call:
-            name = call.get("name", "")
-            args = call.get("arguments", {})
-
-            if name not in self._tools:
-                results.append(
-                    f"[STATUS]: {ServiceExecStatus.ERROR.name}\n"
-                    f"[RESULT]: Unknown function '{name}'"
-                )
-                continue
+                return ServiceResponse(ServiceExecStatus.ERROR, f"Failed to parse function call: {func_call}")
+        return func_call
+
+    def _plan(self, calls: List[dict]) -> List[List[int]]:
+        """Group call indices into tasks: one per parallel call, one ordered group for all serial calls."""
+        tasks, serial = [], []
+        for idx, call in enumerate(calls):
+            tool = self._tools.get(call.get("name", ""))
+            if tool is not None and tool["serial"]:
+                serial.append(idx)
+            else:
+                tasks.append([idx])
+        if serial:
+            tasks.insert(0, serial)
+        return tasks
 
-            tool = self._tools[name]
-            # Merge bound kwargs with call args
-            merged = {**tool["bound_kwargs"], **args}
+    def _prepare(self, call: dict) -> Any:
+        """Return (tool, merged kwargs) of a call, or an error response for unknown tools."""
+        name = call.get("name", "")
+        if name not in self._tools:
+            return ServiceResponse(ServiceExecStatus.ERROR, f"Unknown function '{name}'", name)
+        tool = self._tools[name]
+        # Merge bound kwargs with call args
+        return tool, {**tool["bound_kwargs"], **call.get("arguments", {})}
 
+    @staticmethod
+    def _wrap(response: Any, name: str) -> ServiceResponse:
+        if isinstance(response, ServiceResponse):
+            return replace(response, name=name)
+        return ServiceResponse(ServiceExecStatus.SUCCESS, response, name)
+
+    def _cache_lookup(self, tool: dict, call: dict) -> Tuple[Optional[str], Optional[ServiceResponse]]:
+        """Return the cache key of a call (None if not cached) and its cached result."""
+        policy = tool["cache"]
+        if policy is None or self.cache is None:
+            return None, None
+        # Defaults are part of the key, so omitting an argument matches passing its default
+        arguments = {p["name"]: p["default"] for p in tool["params"] if not p["required"]}
+        arguments.update({name: tool["bound_kwargs"][name] for name in policy["volatile"]})
+        arguments.update(call.get("arguments", {}))
+        key = self.cache.key(call["name"], policy["state"], arguments)
+        return key, self.cache.get(call["name"], key, policy["ttl"], policy["persistent"])
+
+    def _cache_store(self, tool: dict, name: str, key: Optional[str], response: ServiceResponse) -> None:
+        if key is not None:
+            policy = tool["cache"]
+            self.cache.put(name, key, response, policy["size"], policy["persistent"])
+
+    def _call_one(self, call: dict) -> ServiceResponse:
+        prepared = self._prepare(call)
+        if isinstance(prepared, ServiceResponse):
+            return prepared
+        tool, kwargs = prepared
+        key, cached = self._cache_lookup(tool, call)
+        if cached is not None:
+            return cached
+        try:
+            response = tool["func"](**kwargs)
+            if inspect.isawaitable(response):
+                response = asyncio.run(response)
+            response = self._wrap(response, call["name"])
+        except Exception as e:
+            return ServiceResponse(ServiceExecStatus.ERROR, str(e), call["name"])
+        self._cache_store(tool, call["name"], key, response)
+        return response
+
+    def _timeout(self, calls: List[dict], task: List[int]) -> Optional[float]:
+        timeouts = []
+        for idx in task:
+            tool = self._tools.get(calls[idx].get("name", ""))
+            timeout = tool["timeout"] if tool is not None else None
+            if timeout is None:
+                timeout = self.default_timeout
+            if timeout is None:
+                return None
+            timeouts.append(timeout)
+        return sum(timeouts) if timeouts else None
+
+    def _timeout_error(self, calls: List[dict], task: List[int], timeout: float) -> List[ServiceResponse]:
+        names = [calls[idx].get("name", "") for idx in task]
+        logger.warning(f"Tool call(s) {names} timed out after {timeout}s")
+        return [ServiceResponse(ServiceExecStatus.ERROR, f"'{name}' timed out after {timeout}s", name) for name in names]
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tool")
+        return self._pool
+
+    def parse_and_call_func(self, func_call: Any) -> List[ServiceResponse]:
+        """Parse a function call specification and execute it.
+
+        Independent calls run concurrently on a bounded thread pool; calls of
+        tools registered with `serial=True` run one after another in their
+        original order. Results keep the order of the calls.
+
+        Args:
+            func_call: A list/dict with 'name' and 'arguments' keys.
+
+        Returns:
+            One response per call, in call order, each tagged with the tool name.
+            A specification that cannot be parsed gives a single ERROR response.
+        """
+        calls = self._normalize_calls(func_call)
+        if isinstance(calls, ServiceResponse):
+            return [calls]
+
+        tasks = self._plan(calls)
+        results: List[Optional[ServiceResponse]] = [None] * len(calls)
+        if len(tasks) == 1 and self._timeout(calls, tasks[0]) is None:
+            # Nothing to overlap: run in the calling thread
+            for idx in tasks[0]:
+                results[idx] = self._call_one(calls[idx])
+            return results
+
+        pool = self._executor()
+        started = time.monotonic()
+        futures = [
+            (task, pool.submit(lambda task=task: [self._call_one(calls[idx]) for idx in task])) for task in tasks
+        ]
+        for task, future in futures:
+            timeout = self._timeout(calls, task)
             try:
-                response = tool["func"](**merged)
-                if isinstance(response, ServiceResponse):
-                    results.append(str(response))
+                remaining = None if timeout is None else max(0.0, started + timeout - time.monotonic())
+                outputs = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                # The worker cannot be interrupted; its result is discarded when it finishes
+                outputs = self._timeout_error(calls, task, timeout)
+            for idx, output in zip(task, outputs):
+                results[idx] = output
+
+        return results
+
+    async def aparse_and_call_func(self, func_call: Any) -> List[ServiceResponse]:
+        """Async counterpart of `parse_and_call_func`.
+
+        Coroutine tools run as tasks on the event loop and blocking tools on
+        the toolkit's thread pool, with the same ordering, serialization and timeouts.
+        """
+        calls = self._normalize_calls(func_call)
+        if isinstance(calls, ServiceResponse):
+            return [calls]
+
+        async def run(idx: int) -> ServiceResponse:
+            prepared = self._prepare(calls[idx])
+            if isinstance(prepared, ServiceResponse):
+                return prepared
+            tool, kwargs = prepared
+            name = calls[idx]["name"]
+            key, cached = self._cache_lookup(tool, calls[idx])
+            if cached is not None:
+                return cached
+            try:
+                if inspect.iscoroutinefunction(tool["func"]):
+                    response = self._wrap(await tool["func"](**kwargs), name)
                 else:
-                    results.append(
-                        f"[STATUS]: {ServiceExecStatus.SUCCESS.name}\n"
-                        f"[RESULT]: {response}"
-                    )
+                    loop = asyncio.get_running_loop()
+                    response = await loop.run_in_executor(self._executor(), partial(tool["func"], **kwargs))
+                    response = self._wrap(response, name)
             except Exception as e:
-                results.append(
-                    f"[STATUS]: {ServiceExecStatus.ERROR.name}\n"
-                    f"[RESULT]: {e}"
-                )
+                return ServiceResponse(ServiceExecStatus.ERROR, str(e), name)
+            self._cache_store(tool, name, key, response)
+            return response
+
+        async def run_task(task: List[int]) -> List[ServiceResponse]:
+            timeout = self._timeout(calls, task)
+            try:
+                return await asyncio.wait_for(self._run_in_order(run, task), timeout)
+            except asyncio.TimeoutError:
+                return self._timeout_error(calls, task, timeout)
+
+        tasks = self._plan(calls)
+        results: List[Optional[ServiceResponse]] = [None] * len(calls)
+        for task, outputs in zip(tasks, await asyncio.gather(*(run_task(task) for task in tasks))):
+            for idx, output in zip(task, outputs):
+                results[idx] = output
+        return results
 
-        return "\n\n".join(results)
+    @staticmethod
+    async def _run_in_order(run: Callable, task: List[int]) -> List[ServiceResponse]:
+        return [await run(idx) for idx in task]
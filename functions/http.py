@@ -0,0 +1,219 @@
+"""Pooled HTTP client and streaming HTML-to-text extraction for the web tools."""
+
+import codecs
+import os
+import re
+import threading
+import time
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36"
+)
+# Stop downloading a page after this many bytes, the text budget is usually filled far earlier
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+DEFAULT_MAX_CHARS = 8000
+TRUNCATED = "\n...[truncated]"
+
+_CHUNK_SIZE = 64 * 1024
+_CHARSET = re.compile(r"charset=([\w.:-]+)", re.IGNORECASE)
+
+
+class _BudgetReached(Exception):
+    pass
+
+
+class HTMLTextExtractor(HTMLParser):
+    """Incremental HTML-to-text extraction that stops once `max_chars` are collected.
+
+    Text nodes are stripped and joined with newlines, skipping scripts, styles
+    and page chrome (navigation, header, footer), like
+    `BeautifulSoup.get_text(separator="\\n", strip=True)` after removing them.
+    """
+
+    SKIP_TAGS = frozenset({"script", "style", "nav", "footer", "header", "noscript", "template", "svg"})
+
+    def __init__(self, max_chars: Optional[int] = DEFAULT_MAX_CHARS) -> None:
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.done = False
+        self._lines: List[str] = []
+        self._size = 0
+        self._skip = 0
+        self._pending: List[str] = []
+
+    def feed(self, data: str) -> None:
+        if self.done:
+            return
+        try:
+            super().feed(data)
+        except _BudgetReached:
+            self.done = True
+
+    def close(self) -> None:
+        if not self.done:
+            try:
+                super().close()
+                self._flush()
+            except _BudgetReached:
+                self.done = True
+
+    def handle_starttag(self, tag: str, attrs) -> None:
+        self._flush()
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+
+    def handle_endtag(self, tag: str) -> None:
+        self._flush()
+        if tag in self.SKIP_TAGS and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data: str) -> None:
+        if not self._skip:
+            # A text node may arrive in pieces when it spans two fed chunks
+            self._pending.append(data)
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        text = "".join(self._pending).strip()
+        self._pending.clear()
+        if not text:
+            return
+        self._lines.append(text)
+        self._size += len(text) + 1
+        if self.max_chars is not None and self._size > self.max_chars:
+            raise _BudgetReached
+
+    def text(self) -> str:
+        return "\n".join(self._lines)
+
+
+class HttpClient:
+    """A shared `requests.Session` with keep-alive connection pools.
+
+    One client serves every tool thread; urllib3's pools are thread-safe, and
+    the session is rebuilt in a forked worker so sockets are never shared
+    between processes.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 32,
+        timeout: float = 30,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        retries: int = 2,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Args:
+            pool_size: Connections kept alive per host.
+            timeout: Connect/read timeout of one request, and the deadline of a streamed page, in seconds.
+            max_bytes: Default download cap of `fetch_text`.
+            retries: Retries of failed connections and 502/503/504 responses, with backoff.
+            headers: Default headers; the user agent of a desktop browser if None.
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.retries = retries
+        self.headers = headers if headers is not None else {"User-Agent": USER_AGENT}
+        self._lock = threading.Lock()
+        self._session: Optional[requests.Session] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._new_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        retry = Retry(total=self.retries, backoff_factor=0.5, status_forcelist=(502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """A GET on a pooled connection, e.g. for JSON APIs; raises for HTTP errors."""
+        kwargs.setdefault("timeout", self.timeout)
+        resp = self.session.get(url, **kwargs)
+        resp.raise_for_status()
+        return resp
+
+    def fetch_text(
+        self, url: str, max_chars: Optional[int] = DEFAULT_MAX_CHARS, max_bytes: Optional[int] = None
+    ) -> Tuple[str, bool]:
+        """Stream a page and extract its text, stopping at the character budget or the byte cap.
+
+        Returns:
+            The text, at most `max_chars` long, and whether the page was cut short.
+
+        Raises:
+            requests.RequestException: If the request fails or returns an HTTP error.
+            TimeoutError: If the page takes longer than `timeout` seconds to stream.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        deadline = time.monotonic() + self.timeout
+        extractor = HTMLTextExtractor(max_chars)
+        received, capped = 0, False
+        with self.session.get(url, stream=True, timeout=self.timeout) as resp:
+            resp.raise_for_status()
+            decoder = codecs.getincrementaldecoder(_encoding(resp))(errors="replace")
+            for chunk in resp.iter_content(_CHUNK_SIZE):
+                if max_bytes is not None and received + len(chunk) > max_bytes:
+                    chunk, capped = chunk[: max_bytes - received], True
+                received += len(chunk)
+                extractor.feed(decoder.decode(chunk))
+                if extractor.done or capped:
+                    break
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Reading {url} took longer than {self.timeout}s")
+            else:
+                extractor.feed(decoder.decode(b"", final=True))
+        extractor.close()
+
+        text = extractor.text()
+        truncated = extractor.done or capped
+        if max_chars is not None and len(text) > max_chars:
+            text = text[:max_chars]
+        return text, truncated
+
+
+def _encoding(resp: requests.Response) -> str:
+    # requests falls back to ISO-8859-1 for text/* without a charset, most pages are UTF-8
+    match = _CHARSET.search(resp.headers.get("content-type", ""))
+    encoding = match.group(1) if match else "utf-8"
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        encoding = "utf-8"
+    return encoding
+
+
+_client: Optional[HttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """The process-wide client of the web tools."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient()
+    return _client
@@ -1,10 +1,48 @@
 import sys
 import io
+from typing import Iterable, List, Optional, Tuple
+
+import litellm
 
 from core.toolkit import ServiceResponse, ServiceExecStatus
 
 
-def get_new_history(synthpai_history: list, visited: list, n: int = 5) -> ServiceResponse:
+def count_history_tokens(synthpai_history: list, model: str) -> List[int]:
+    """Count the tokens of every history once with the tokenizer of `model`, for the paging budget."""
+    return [litellm.token_counter(model=model, text=history) for history in synthpai_history]
+
+
+def _page(
+    synthpai_history: list,
+    indices: Iterable[int],
+    max_tokens: Optional[int],
+    history_tokens: Optional[List[int]],
+) -> Tuple[List[int], int]:
+    """Take whole histories in order while they fit the budget; the first one is always taken."""
+    page, used = [], 0
+    for idx in indices:
+        n_tokens = history_tokens[idx] if history_tokens is not None else len(synthpai_history[idx]) // 4
+        if page and max_tokens is not None and used + n_tokens > max_tokens:
+            break
+        page.append(idx)
+        used += n_tokens
+    return page, used
+
+
+def _render_page(synthpai_history: list, page: List[int], used: int, footer: str) -> str:
+    parts = [synthpai_history[idx] + "\n" for idx in page]
+    numbers = ", ".join(str(idx + 1) for idx in page)
+    parts.append(f"[Histories {numbers} of {len(synthpai_history)} (~{used} tokens). {footer}]")
+    return "".join(parts)
+
+
+def get_new_history(
+    synthpai_history: list,
+    visited: list,
+    n: int = 5,
+    max_tokens: Optional[int] = None,
+    history_tokens: Optional[List[int]] = None,
+) -> ServiceResponse:
     """
     Retrieve the next user's synthetic history from the given list of histories in reverse chronological order.
     This is the default function for user history retrieval when no specific requirements are given.
@@ -14,78 +52,125 @@ def get_new_history(synthpai_history: list, visited: list, n: int = 5) -> Servic
         visited (`list`):
             The list of visited history indices.
         n (`int`, defaults to `5`):
-            The number of histories to retrieve.
+            The number of histories to retrieve when there is no token budget.
+        max_tokens (`int`, defaults to `None`):
+            Token budget of the returned histories; as many whole histories as fit are returned, regardless of `n`.
+        history_tokens (`list`):
+            Token count of every history, from `count_history_tokens`.
     Returns:
         `ServiceResponse`: A dictionary with two variables: `status` and
         `content`. The `status` variable is from the ServiceExecStatus enum,
         and `content` is a string of user synthetic histories or error information,
         which depends on the `status` variable.
     """
-    if len(visited) == len(synthpai_history):
+    seen = set(visited)
+    unvisited = [idx for idx in range(len(synthpai_history)) if idx not in seen]
+    if not unvisited:
         return ServiceResponse(
             ServiceExecStatus.SUCCESS, "All histories have been visited. No new history to retrieve."
         )
 
-    cursor = visited[-1] + 1 if visited else 0
     # Retrieve the user synthetic history
-    output = ""
-    for i in range(cursor, min(cursor + n, len(synthpai_history))):
-        output += synthpai_history[i] + "\n"
+    # Without a budget a single call would return every unvisited history
+    candidates = unvisited if max_tokens else unvisited[:n]
+    page, used = _page(synthpai_history, candidates, max_tokens or None, history_tokens)
 
     # Update the visited list
-    visited.extend(range(cursor, min(cursor + n, len(synthpai_history))))
+    visited.extend(page)
 
-    return ServiceResponse(ServiceExecStatus.SUCCESS, output)
+    remaining = len(unvisited) - len(page)
+    footer = f"{remaining} histories not retrieved yet." if remaining else "All histories have been retrieved."
+    return ServiceResponse(ServiceExecStatus.SUCCESS, _render_page(synthpai_history, page, used, footer))
 
 
 def get_related_history(
-    synthpai_history: list, query: str, knowledge, top_k=5
+    synthpai_history: list,
+    query: List[str],
+    retriever,
+    visited: Optional[list] = None,
+    top_k: int = 5,
+    exclude_visited: bool = False,
+    tags: Optional[List[str]] = None,
 ) -> ServiceResponse:
     """
-    Retrieve the semantic related user synthetic history based on the given query.
+    Retrieve the semantic related user synthetic history based on the given queries.
     Args:
-        query (`str`):
-            The query to retrieve the related user synthetic history.
-        knowledge:
-            The knowledge object (LlamaIndex VectorStoreIndex) for semantic search.
+        query (`List[str]`):
+            One or more queries, e.g. one per attribute to look for; all are searched at once.
+        retriever:
+            The retriever over the user's history (`HistoryRetriever`, `BM25Retriever` or `HybridRetriever`).
+        visited (`list`):
+            The list of visited history indices.
         top_k (`int`, defaults to `5`):
             The number of related histories to retrieve.
+        exclude_visited (`bool`, defaults to `False`):
+            Whether to skip the histories that have already been retrieved.
+        tags (`List[str]`, defaults to `None`):
+            Only search the comments tagged with any of these personal attributes, e.g. ["location", "occupation"].
     Returns:
         `ServiceResponse`: A dictionary with two variables: `status` and
         `content`. The `status` variable is from the ServiceExecStatus enum,
-        and `content` is a string of related user synthetic histories or error information,
+        and `content` is a list of related user synthetic histories or error information,
         which depends on the `status` variable.
     """
-    # Retrieve the related user synthetic history using direct LlamaIndex API
+    # Retrieve the related user synthetic history with the configured backend
     try:
-        output = []
-        retriever = knowledge.as_retriever(similarity_top_k=top_k)
-        nodes = retriever.retrieve(query)
-        for node in nodes:
-            filename = node.metadata["file_name"]
-            idx = int(filename.strip(".txt").split("_")[-1])
-            output.append(synthpai_history[idx - 1])
+        queries = [query] if isinstance(query, str) else list(query)
+        exclude = visited if exclude_visited and visited is not None else ()
+        indices = retriever.retrieve(queries, top_k=top_k, exclude=exclude, tags=tags)
+        output = [synthpai_history[idx] for idx in indices]
+        if tags and not indices:
+            # An empty result would hide the comments the tagger labeled differently
+            indices = retriever.retrieve(queries, top_k=top_k, exclude=exclude)
+            output = [f"No comments are tagged with {', '.join(tags)}; these are the best matches of all comments."]
+            output += [synthpai_history[idx] for idx in indices]
         return ServiceResponse(ServiceExecStatus.SUCCESS, output)
     except Exception as e:
         return ServiceResponse(ServiceExecStatus.ERROR, str(e))
 
 
-def get_all_history(synthpai_history: list) -> ServiceResponse:
+def get_all_history(
+    synthpai_history: list,
+    visited: Optional[list] = None,
+    cursor: int = 0,
+    max_tokens: Optional[int] = None,
+    history_tokens: Optional[List[int]] = None,
+) -> ServiceResponse:
     """
-    Retrieve ALL history from the given list of histories in reverse chronological order.
+    Retrieve ALL history from the given list of histories in reverse chronological order, page by page.
     This is only used when the user wants to retrieve all histories.
     Args:
         synthpai_history (`list`):
             The list of user synthetic histories.
+        visited (`list`):
+            The list of visited history indices.
+        cursor (`int`, defaults to `0`):
+            Index of the first history to return; use the cursor given at the end of the previous page to continue.
+        max_tokens (`int`, defaults to `None`):
+            Token budget of one page; as many whole histories as fit are returned.
+        history_tokens (`list`):
+            Token count of every history, from `count_history_tokens`.
     Returns:
         `ServiceResponse`: A dictionary with two variables: `status` and
         `content`. The `status` variable is from the ServiceExecStatus enum,
         and `content` is a string of user synthetic histories or error information,
         which depends on the `status` variable.
     """
+    if not 0 <= cursor < len(synthpai_history):
+        return ServiceResponse(
+            ServiceExecStatus.ERROR, f"The cursor should be between 0 and {len(synthpai_history) - 1}, got {cursor}."
+        )
+
     # Retrieve the user synthetic history
-    output = ""
-    for i in range(len(synthpai_history)):
-        output += synthpai_history[i] + "\n"
+    page, used = _page(synthpai_history, range(cursor, len(synthpai_history)), max_tokens, history_tokens)
+
+    if visited is not None:
+        seen = set(visited)
+        visited.extend(idx for idx in page if idx not in seen)
 
-    return ServiceResponse(ServiceExecStatus.SUCCESS, output)
+    next_cursor = page[-1] + 1
+    if next_cursor < len(synthpai_history):
+        footer = f"Call get_all_history with cursor={next_cursor} to continue."
+    else:
+        footer = "This is the last page."
+    return ServiceResponse(ServiceExecStatus.SUCCESS, _render_page(synthpai_history, page, used, footer))
@@ -0,0 +1,626 @@
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from llama_index.core import Document
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
+from loguru import logger
+
+from core.pii import normalize_type
+
+
+DEFAULT_VECTOR_INDEX_ROOT = "./dataset/vdb/shared"
+_SLUG = re.compile(r"[^\w.-]+")
+# Vector file of indices that have never been compacted
+_VECTOR_FILE = "vectors.f32"
+_NO_TAGS = "no personal attributes found"
+# Node metadata that is only used for filtering and must not leak into the embedded text
+_FILTER_KEYS = ["file_name", "history_idx", "tags"]
+_WORDS = re.compile(r"[a-z]+")
+# Words of the tagger's free-form labels (e.g. "Current live location") naming each target attribute
+_ATTRIBUTE_KEYWORDS = {
+    "city_country": frozenset({"location", "city", "country", "live", "living", "residence"}),
+    "age": frozenset({"age", "birthday"}),
+    "sex": frozenset({"gender", "sex"}),
+    "occupation": frozenset({"occupation", "job", "work", "company", "profession", "career", "employer"}),
+    "education": frozenset({"education", "school", "degree", "university", "college"}),
+    "income_level": frozenset({"income", "salary", "wage"}),
+    "relationship_status": frozenset({"relationship", "marital", "married", "divorced", "spouse"}),
+}
+_PLACE_WORDS = frozenset({"place", "city", "country", "location", "town"})
+_DATE_WORDS = frozenset({"date", "year", "day"})
+# Commas outside parentheses, e.g. not those of "Education background (school, degree, etc)"
+_LABEL_SEPARATOR = re.compile(r",(?![^()]*\))")
+
+
+def history_index(file_name: str) -> int:
+    """Return the 0-based history index of a `history_{n}.txt` (or tag) file, n being 1-based."""
+    return int(os.path.basename(file_name).strip(".txt").split("_")[-1]) - 1
+
+
+def attribute_tags(label: str) -> Set[str]:
+    """The tags of one attribute label: its normalized form plus the target attributes it names.
+
+    The tagger writes labels such as "Current live location" or "Income range
+    (USD)", the profiler filters by target attributes such as `city_country`;
+    both sides are mapped with this function, so either form matches the other.
+    """
+    tag = normalize_type(label)
+    words = set(_WORDS.findall(tag))
+    tags = {tag}
+    birthplace = "birthplace" in words or ("birth" in words and not words.isdisjoint(_PLACE_WORDS))
+    if birthplace:
+        tags.add("birth_city_country")
+    elif "birth" in words and not words.isdisjoint(_DATE_WORDS):
+        tags.add("age")
+    for attr, keywords in _ATTRIBUTE_KEYWORDS.items():
+        # "Place of birth" is not where the user lives
+        if not words.isdisjoint(keywords) and not (birthplace and attr == "city_country"):
+            tags.add(attr)
+    return tags
+
+
+def expand_tags(labels: Iterable[str]) -> Set[str]:
+    """The tags of several labels, e.g. the stored tags of a comment or the tags of a filter."""
+    return set().union(*(attribute_tags(label) for label in labels))
+
+
+def parse_tags(text: str) -> List[str]:
+    """Turn the comma-separated attribute names written by the tagger into normalized tags."""
+    if _NO_TAGS in text.lower():
+        return []
+    return sorted(expand_tags(tag for tag in _LABEL_SEPARATOR.split(text) if tag.strip()))
+
+
+def history_documents(target_user: str) -> List[Document]:
+    """One document per comment of `dataset/synthpai/{user}`, tagged with the tagger output if present."""
+    text_dir = f"./dataset/synthpai/{target_user}"
+    tag_dir = f"./dataset/tag/{target_user}"
+    documents = []
+    for name in sorted(os.listdir(text_dir), key=history_index):
+        with open(os.path.join(text_dir, name)) as f:
+            text = f.read()
+        tags = []
+        if os.path.exists(os.path.join(tag_dir, name)):
+            with open(os.path.join(tag_dir, name)) as f:
+                tags = parse_tags(f.read())
+        documents.append(
+            Document(
+                text=text,
+                metadata={"file_name": name, "history_idx": history_index(name), "tags": tags},
+                excluded_embed_metadata_keys=_FILTER_KEYS,
+                excluded_llm_metadata_keys=_FILTER_KEYS,
+            )
+        )
+    return documents
+
+
+class SharedHistoryIndex:
+    """One vector index over the comments of all users, keyed by user and history index.
+
+    The L2-normalized vectors of every user are rows of one append-only
+    float32 file, read through a memory map, and a SQLite index in WAL mode
+    records the rows of each user with the history index and tags of every
+    row. A worker opens the index once (`shared_history_index`) and serves
+    all its users from it; a user that is missing, or whose histories or tags
+    changed, is embedded and appended. Rows are written before the
+    transaction that registers them commits, so readers in other workers
+    never see a user whose vectors are incomplete. The rows a re-indexed
+    user leaves behind are dropped by `compact`, which runs on its own once
+    they make up more than half of the file.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path: Directory of the index, one per embedding model and chunk size (see `directory`).
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # file name -> memory map of its rows
+        self._maps: Dict[str, np.memmap] = {}
+
+        os.makedirs(path, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS users (user TEXT PRIMARY KEY, start INTEGER, count INTEGER, fingerprint TEXT)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, user TEXT, history_idx INTEGER, tags TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS rows_user ON rows(user)")
+
+    @staticmethod
+    def directory(root: str, model: str, chunk_size: Optional[int] = None) -> str:
+        """The index directory of an embedding model and chunk size under `root`."""
+        name = _SLUG.sub("_", model) + (f"-chunk{chunk_size}" if chunk_size else "")
+        return os.path.join(root, name)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.path, "index.sqlite"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _matrix(self, file: str, rows: int, dim: int) -> np.memmap:
+        """Map at least `rows` rows of a vector file, remapping once it has grown."""
+        with self._lock:
+            mapped = self._maps.get(file)
+            if mapped is None or mapped.shape[0] < rows:
+                file_path = os.path.join(self.path, file)
+                shape = (os.path.getsize(file_path) // (dim * 4), dim)
+                mapped = self._maps[file] = np.memmap(file_path, dtype=np.float32, mode="r", shape=shape)
+            return mapped
+
+    def fingerprint(self, target_user: str) -> Optional[str]:
+        row = self._conn().execute("SELECT fingerprint FROM users WHERE user = ?", (target_user,)).fetchone()
+        return row[0] if row is not None else None
+
+    def ensure_user(self, target_user: str, embed_model, chunk_size: Optional[int] = None) -> None:
+        """Embed and append a user's comments unless the index already holds their current version."""
+        fingerprint = _corpus_fingerprint(target_user)
+        if self.fingerprint(target_user) == fingerprint:
+            return
+        if self.fingerprint(target_user) is not None:
+            logger.info(f"Re-indexing {target_user}: the histories or tags changed")
+
+        nodes = history_documents(target_user)
+        if chunk_size:
+            splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=min(20, chunk_size // 4))
+            nodes = splitter.get_nodes_from_documents(nodes)
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        vectors = np.asarray(embed_model.get_text_embedding_batch(texts), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        self._append(target_user, fingerprint, vectors, nodes)
+
+    def _append(self, target_user: str, fingerprint: str, vectors: np.ndarray, nodes: list) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have indexed the same user meanwhile
+            if self.fingerprint(target_user) == fingerprint:
+                conn.execute("COMMIT")
+                return
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+            dim = meta.setdefault("dim", vectors.shape[1])
+            if dim != vectors.shape[1]:
+                raise ValueError(f"{self.path} holds {dim}-dimensional vectors, got {vectors.shape[1]}")
+            start = meta.get("rows", 0)
+
+            file_path = os.path.join(self.path, meta.get("file", _VECTOR_FILE))
+            with open(file_path, "r+b" if os.path.exists(file_path) else "w+b") as f:
+                f.seek(start * dim * 4)
+                f.write(vectors.tobytes())
+            conn.executemany(
+                "INSERT INTO rows (row, user, history_idx, tags) VALUES (?, ?, ?, ?)",
+                [
+                    (start + i, target_user, node.metadata["history_idx"], json.dumps(node.metadata["tags"]))
+                    for i, node in enumerate(nodes)
+                ],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO users (user, start, count, fingerprint) VALUES (?, ?, ?, ?)",
+                (target_user, start, len(nodes), fingerprint),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [("dim", dim), ("rows", start + len(nodes))]
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        stats = self.stats()
+        if stats["stale_rows"] > stats["rows"]:
+            self.compact()
+
+    def compact(self) -> int:
+        """Rewrite the rows of the current users into a new vector file, dropping those of re-indexed users.
+
+        Returns the number of dropped rows.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+            total, file = meta.get("rows", 0), meta.get("file", _VECTOR_FILE)
+            users = conn.execute("SELECT user, start, count FROM users ORDER BY start").fetchall()
+            live = sum(count for _, _, count in users)
+            if live == total:
+                conn.execute("COMMIT")
+                return 0
+
+            new_file = f"vectors-{uuid.uuid4().hex[:8]}.f32"
+            old = self._matrix(file, total, meta["dim"]) if live else None
+            rows, starts, new_start = [], {}, 0
+            with open(os.path.join(self.path, new_file), "wb") as f:
+                for user, start, count in users:
+                    if count:
+                        f.write(np.ascontiguousarray(old[start : start + count]).tobytes())
+                    rows.extend(
+                        (new_start + i, user, history_idx, tags)
+                        for i, (history_idx, tags) in enumerate(
+                            conn.execute(
+                                "SELECT history_idx, tags FROM rows WHERE row >= ? AND row < ? ORDER BY row",
+                                (start, start + count),
+                            )
+                        )
+                    )
+                    starts[user] = new_start
+                    new_start += count
+            conn.execute("DELETE FROM rows")
+            conn.executemany("INSERT INTO rows (row, user, history_idx, tags) VALUES (?, ?, ?, ?)", rows)
+            conn.executemany("UPDATE users SET start = ? WHERE user = ?", [(s, user) for user, s in starts.items()])
+            conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [("rows", live), ("file", new_file)]
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        # Readers that still map the old file keep their mapping; new reads use the new file
+        with self._lock:
+            self._maps.pop(file, None)
+        try:
+            os.remove(os.path.join(self.path, file))
+        except FileNotFoundError:
+            pass
+        logger.debug(f"Compacted {self.path}: dropped {total - live} stale rows")
+        return total - live
+
+    def segment(self, target_user: str) -> Tuple[np.ndarray, np.ndarray, List[List[str]]]:
+        """Return the vectors, history indices and tags of a user's rows."""
+        conn = self._conn()
+        # One read snapshot, so a concurrent compaction cannot mix old rows with a new file
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute("SELECT start, count FROM users WHERE user = ?", (target_user,)).fetchone()
+            if row is None:
+                raise KeyError(f"{target_user} is not in the index at {self.path}")
+            start, count = row
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+            rows = conn.execute(
+                "SELECT history_idx, tags FROM rows WHERE row >= ? AND row < ? ORDER BY row", (start, start + count)
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        if count == 0:
+            return np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.int64), []
+        try:
+            matrix = self._matrix(meta.get("file", _VECTOR_FILE), start + count, meta["dim"])
+        except FileNotFoundError:
+            # Compacted away by another worker since the snapshot
+            return self.segment(target_user)
+        vectors = np.array(matrix[start : start + count])
+        return vectors, np.array([idx for idx, _ in rows], dtype=np.int64), [json.loads(tags) for _, tags in rows]
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        users, live = conn.execute("SELECT COUNT(*), COALESCE(SUM(count), 0) FROM users").fetchone()
+        return {
+            "path": self.path,
+            "users": users,
+            "rows": live,
+            # Rows of users that were re-indexed since, until the next compaction
+            "stale_rows": meta.get("rows", 0) - live,
+            "dim": meta.get("dim"),
+            "file": meta.get("file", _VECTOR_FILE),
+        }
+
+
+@lru_cache(maxsize=None)
+def shared_history_index(path: str) -> SharedHistoryIndex:
+    """The index at `path`, opened once per worker process."""
+    return SharedHistoryIndex(path)
+
+
+class HistoryRetriever:
+    """Semantic search over one user's rows of the shared index, built once per profiling session.
+
+    A batch of queries is embedded with a single embedding request and scored
+    against all of the user's vectors at once. Candidates can be restricted
+    to comments with any of the given attribute tags, and the hits (comments
+    or chunks of them) are merged into history indices ranked by their best
+    score, optionally leaving out comments the profiler has already seen.
+    """
+
+    def __init__(self, index: SharedHistoryIndex, target_user: str, embed_model, top_k: int = 5) -> None:
+        """
+        Args:
+            index: The shared index, holding the user's rows.
+            target_user: The SynthPAI user.
+            embed_model: Embedding model the index was built with.
+            top_k: Default number of histories returned per call.
+        """
+        self.top_k = top_k
+        self._embed_model = embed_model
+        self._vectors, self._history_idx, tags = index.segment(target_user)
+        # Stored tags are expanded again, so indices built before a keyword was added still match it
+        self._tags = [frozenset(expand_tags(row_tags)) for row_tags in tags]
+
+    def retrieve(
+        self,
+        queries: Sequence[str],
+        top_k: Optional[int] = None,
+        exclude: Iterable[int] = (),
+        tags: Optional[Sequence[str]] = None,
+    ) -> List[int]:
+        """Return the indices of the histories most related to any of the queries.
+
+        Args:
+            queries: One or more queries, embedded in one batch.
+            top_k: Number of indices to return (defaults to the retriever's).
+            exclude: History indices to leave out, e.g. those already visited.
+            tags: Only consider comments tagged with any of these attributes.
+
+        Returns:
+            Distinct history indices, best match first.
+        """
+        top_k = top_k or self.top_k
+        queries = [q for q in dict.fromkeys(q.strip() for q in queries) if q]
+        if not queries or not len(self._vectors):
+            return []
+
+        embeddings = np.asarray(self._embed_model.get_text_embedding_batch(queries), dtype=np.float32)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        # Cosine similarity of every row to its best-matching query
+        scores = (embeddings @ self._vectors.T).max(axis=0)
+
+        keep = ~np.isin(self._history_idx, list(set(exclude)))
+        if tags:
+            wanted = expand_tags(tags)
+            keep &= np.fromiter((not row_tags.isdisjoint(wanted) for row_tags in self._tags), bool, len(self._tags))
+        best: Dict[int, float] = {}
+        for idx, score in zip(self._history_idx[keep].tolist(), scores[keep].tolist()):
+            if score > best.get(idx, float("-inf")):
+                best[idx] = score
+        return sorted(best, key=best.get, reverse=True)[:top_k]
+
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i if in is it its my of on or so that the this to was we "
+    "were what when where which who with you your me our they them their he she his her".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def _corpus_fingerprint(target_user: str) -> str:
+    """Hash of the names, sizes and modification times of a user's history and tag files."""
+    digest = hashlib.sha256()
+    for directory in (f"./dataset/synthpai/{target_user}", f"./dataset/tag/{target_user}"):
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            stat = os.stat(os.path.join(directory, name))
+            digest.update(f"{directory}/{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class BM25Index:
+    """Inverted index of one user's comments with Okapi BM25 weights.
+
+    The postings hold raw term frequencies and are persisted as JSON; the
+    per-posting BM25 weights are computed once when the index is loaded, so a
+    query only sums precomputed weights of its terms.
+    """
+
+    def __init__(
+        self,
+        postings: Dict[str, List[List[int]]],
+        doc_lens: List[int],
+        tags: List[List[str]],
+        fingerprint: str = "",
+        k1: float = 1.5,
+        b: float = 0.75,
+    ) -> None:
+        self.postings = postings
+        self.doc_lens = doc_lens
+        self.tags = [expand_tags(t) for t in tags]
+        self.fingerprint = fingerprint
+        self.k1 = k1
+        self.b = b
+
+        n_docs = len(doc_lens)
+        avg_len = sum(doc_lens) / n_docs if n_docs else 0.0
+        self._weights: Dict[str, List[tuple]] = {}
+        for term, entries in postings.items():
+            idf = math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            self._weights[term] = [
+                (doc, idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_lens[doc] / (avg_len or 1.0))))
+                for doc, tf in entries
+            ]
+
+    @classmethod
+    def build(cls, texts: Sequence[str], tags: Sequence[List[str]], fingerprint: str = "") -> "BM25Index":
+        postings: Dict[str, List[List[int]]] = {}
+        doc_lens = []
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append([doc, tf])
+        return cls(postings, doc_lens, [list(t) for t in tags], fingerprint)
+
+    def save(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = {
+            "fingerprint": self.fingerprint,
+            "k1": self.k1,
+            "b": self.b,
+            "doc_lens": self.doc_lens,
+            "tags": [sorted(t) for t in self.tags],
+            "postings": self.postings,
+        }
+        with open(path, "w") as f:
+            json.dump(payload, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path) as f:
+            payload = json.load(f)
+        return cls(
+            payload["postings"],
+            payload["doc_lens"],
+            payload["tags"],
+            payload["fingerprint"],
+            payload["k1"],
+            payload["b"],
+        )
+
+    def score(self, query: str) -> Dict[int, float]:
+        """Return the BM25 score of every document sharing a term with the query."""
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            for doc, weight in self._weights.get(term, ()):
+                scores[doc] = scores.get(doc, 0.0) + weight
+        return scores
+
+
+def load_bm25_index(target_user: str) -> BM25Index:
+    """Load the BM25 index of a user's comments, rebuilding it when the histories or tags changed.
+
+    The index is persisted in `dataset/bm25/{user}.json`, next to the vector indices.
+    """
+    path = f"./dataset/bm25/{target_user}.json"
+    fingerprint = _corpus_fingerprint(target_user)
+    if os.path.exists(path):
+        index = BM25Index.load(path)
+        if index.fingerprint == fingerprint:
+            return index
+    documents = history_documents(target_user)
+    index = BM25Index.build(
+        [doc.text for doc in documents], [doc.metadata["tags"] for doc in documents], fingerprint
+    )
+    index.save(path)
+    return index
+
+
+class BM25Retriever:
+    """Lexical counterpart of `HistoryRetriever`: same interface, no embedding calls."""
+
+    def __init__(self, index: BM25Index, top_k: int = 5) -> None:
+        self.index = index
+        self.top_k = top_k
+
+    def retrieve(
+        self,
+        queries: Sequence[str],
+        top_k: Optional[int] = None,
+        exclude: Iterable[int] = (),
+        tags: Optional[Sequence[str]] = None,
+    ) -> List[int]:
+        """Return the indices of the histories scoring best for any of the queries, best first."""
+        top_k = top_k or self.top_k
+        exclude = set(exclude)
+        wanted = expand_tags(tags) if tags else None
+        scores: Dict[int, float] = {}
+        for query in queries:
+            for doc, score in self.index.score(query).items():
+                if doc in exclude or (wanted is not None and not wanted & self.index.tags[doc]):
+                    continue
+                if score > scores.get(doc, 0.0):
+                    scores[doc] = score
+        return heapq.nlargest(top_k, scores, key=scores.get)
+
+
+class HybridRetriever:
+    """Fuses the rankings of a lexical and a dense retriever with reciprocal rank fusion."""
+
+    # Damping constant of reciprocal rank fusion
+    rrf_k = 60
+
+    def __init__(self, dense: HistoryRetriever, lexical: BM25Retriever, top_k: int = 5) -> None:
+        self.dense = dense
+        self.lexical = lexical
+        self.top_k = top_k
+
+    def retrieve(
+        self,
+        queries: Sequence[str],
+        top_k: Optional[int] = None,
+        exclude: Iterable[int] = (),
+        tags: Optional[Sequence[str]] = None,
+    ) -> List[int]:
+        top_k = top_k or self.top_k
+        exclude = list(exclude)
+        # Both rankings go deeper than top_k so that documents found by only one still compete
+        depth = top_k * 3
+        fused: Dict[int, float] = {}
+        for ranking in (
+            self.lexical.retrieve(queries, depth, exclude, tags),
+            self.dense.retrieve(queries, depth, exclude, tags),
+        ):
+            for rank, doc in enumerate(ranking):
+                fused[doc] = fused.get(doc, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        return sorted(fused, key=fused.get, reverse=True)[:top_k]
+
+
+RETRIEVAL_BACKENDS = ("vector", "bm25", "hybrid")
+
+
+def load_history_retriever(
+    target_user: str,
+    backend: str = "vector",
+    embed_model=None,
+    chunk_size: Optional[int] = None,
+    top_k: int = 5,
+    index_root: str = DEFAULT_VECTOR_INDEX_ROOT,
+):
+    """Build the `get_related_history` retriever of a user for the configured backend.
+
+    Args:
+        target_user: The SynthPAI user.
+        backend: "vector" (embedding index), "bm25" (local lexical index, no
+            embedding calls) or "hybrid" (both, fused by rank).
+        embed_model: Embedding model of the vector index; unused for "bm25".
+        chunk_size: Chunk size of the vector index.
+        top_k: Default number of histories returned per call.
+        index_root: Directory of the shared vector indices.
+    """
+    if backend not in RETRIEVAL_BACKENDS:
+        raise ValueError(f"Unknown retrieval backend '{backend}', expected one of {RETRIEVAL_BACKENDS}")
+    if backend == "bm25":
+        return BM25Retriever(load_bm25_index(target_user), top_k)
+    index = shared_history_index(SharedHistoryIndex.directory(index_root, embed_model.model_name, chunk_size))
+    index.ensure_user(target_user, embed_model, chunk_size)
+    dense = HistoryRetriever(index, target_user, embed_model, top_k)
+    if backend == "vector":
+        return dense
+    return HybridRetriever(dense, BM25Retriever(load_bm25_index(target_user), top_k), top_k)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect the shared vector indices of the comment histories.")
+    parser.add_argument("command", choices=["stats", "compact"])
+    parser.add_argument("--path", "-p", type=str, default=DEFAULT_VECTOR_INDEX_ROOT, help="The index root directory.")
+    args = parser.parse_args()
+
+    for name in sorted(os.listdir(args.path)):
+        if os.path.exists(os.path.join(args.path, name, "index.sqlite")):
+            index = SharedHistoryIndex(os.path.join(args.path, name))
+            if args.command == "compact":
+                print(f"Dropped {index.compact()} stale rows of {name}")
+            print(json.dumps(index.stats(), indent=2))
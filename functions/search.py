@@ -0,0 +1,252 @@
+"""Search backends of the retriever's web search tool: Bing, Google or a local full-text index."""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from loguru import logger
+
+from functions.http import HTMLTextExtractor, get_client
+
+
+# Every backend returns results of this shape
+SearchResult = Dict[str, str]
+
+DEFAULT_INDEX_PATH = "./dataset/search/index.db"
+_WORD = re.compile(r"\w+")
+_TITLE = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+
+
+class SearchBackend:
+    """A web search engine: `search` returns a list of {title, url, snippet} dicts, best first."""
+
+    name = ""
+
+    def search(self, query: str, num_results: int = 10) -> List[SearchResult]:
+        raise NotImplementedError
+
+
+class BingSearch(SearchBackend):
+    """The Bing Web Search API."""
+
+    name = "bing"
+    url = "https://api.bing.microsoft.com/v7.0/search"
+
+    def __init__(self, api_key: str) -> None:
+        self.api_key = api_key
+
+    def search(self, query: str, num_results: int = 10) -> List[SearchResult]:
+        headers = {"Ocp-Apim-Subscription-Key": self.api_key}
+        params = {"q": query, "count": num_results, "textDecorations": True, "textFormat": "HTML"}
+        data = get_client().get(self.url, headers=headers, params=params).json()
+        return [
+            {"title": item.get("name", ""), "url": item.get("url", ""), "snippet": item.get("snippet", "")}
+            for item in data.get("webPages", {}).get("value", [])
+        ]
+
+
+class GoogleSearch(SearchBackend):
+    """The Google Custom Search JSON API, which returns at most 10 results per request."""
+
+    name = "google"
+    url = "https://www.googleapis.com/customsearch/v1"
+
+    def __init__(self, api_key: str, cse_id: str) -> None:
+        self.api_key = api_key
+        self.cse_id = cse_id
+
+    def search(self, query: str, num_results: int = 10) -> List[SearchResult]:
+        params = {"key": self.api_key, "cx": self.cse_id, "q": query, "num": min(num_results, 10)}
+        data = get_client().get(self.url, params=params).json()
+        return [
+            {"title": item.get("title", ""), "url": item.get("link", ""), "snippet": item.get("snippet", "")}
+            for item in data.get("items", [])
+        ]
+
+
+class LocalSearch(SearchBackend):
+    """An SQLite FTS5 index over a mirrored document corpus, for offline and reproducible runs.
+
+    Documents live in a plain table keyed by URL and an external-content FTS5
+    table kept in sync by triggers. Queries match any of their words and are
+    ranked by BM25, with the title weighted above the body; snippets mark the
+    matches with <b> like Bing's HTML text decorations.
+    """
+
+    name = "local"
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH) -> None:
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(
+                    f"No search index at {self.path}; "
+                    f"build one with `python -m functions.search index -p {self.path} -c <corpus>`"
+                )
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def create(path: str) -> "LocalSearch":
+        """Create an empty index at `path`, or open the existing one."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path)
+        conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, url TEXT UNIQUE, title TEXT, body TEXT);
+            CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(
+                title, body, content='documents', content_rowid='id', tokenize='porter unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+                INSERT INTO pages(rowid, title, body) VALUES (new.id, new.title, new.body);
+            END;
+            CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+                INSERT INTO pages(pages, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+            END;
+            CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE ON documents BEGIN
+                INSERT INTO pages(pages, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+                INSERT INTO pages(rowid, title, body) VALUES (new.id, new.title, new.body);
+            END;
+            """
+        )
+        conn.close()
+        return LocalSearch(path)
+
+    def add_documents(self, documents: Iterable[SearchResult], batch_size: int = 1000) -> int:
+        """Insert or update {url, title, text} documents in batches. Returns the number of documents."""
+        conn = self._conn()
+        rows, count = [], 0
+        statement = (
+            "INSERT INTO documents (url, title, body) VALUES (?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET title = excluded.title, body = excluded.body"
+        )
+        for doc in documents:
+            rows.append((doc["url"], doc.get("title", ""), doc.get("text", "")))
+            if len(rows) >= batch_size:
+                with conn:
+                    conn.executemany(statement, rows)
+                count += len(rows)
+                rows = []
+        if rows:
+            with conn:
+                conn.executemany(statement, rows)
+            count += len(rows)
+        with conn:
+            conn.execute("INSERT INTO pages(pages) VALUES ('optimize')")
+        return count
+
+    def search(self, query: str, num_results: int = 10) -> List[SearchResult]:
+        words = _WORD.findall(query)
+        if not words:
+            return []
+        # Quoted words keep FTS5 operators and punctuation in queries from being parsed as syntax
+        match = " OR ".join('"' + word + '"' for word in words)
+        # Snippets are only built for the top rows, after ranking on the index alone
+        rows = self._conn().execute(
+            "SELECT d.title, d.url, snippet(pages, 1, '<b>', '</b>', '...', 32) FROM ("
+            "SELECT rowid, bm25(pages, 10.0, 1.0) AS score FROM pages WHERE pages MATCH ?1 "
+            "ORDER BY score LIMIT ?2) top "
+            "JOIN pages ON pages.rowid = top.rowid AND pages MATCH ?1 JOIN documents d ON d.id = top.rowid "
+            "ORDER BY top.score",
+            (match, num_results),
+        ).fetchall()
+        return [{"title": title, "url": url, "snippet": snippet} for title, url, snippet in rows]
+
+    def document(self, url: str) -> Optional[str]:
+        """Return the stored text of a page, or None if it is not in the index."""
+        row = self._conn().execute("SELECT body FROM documents WHERE url = ?", (url,)).fetchone()
+        if row is None and url.endswith("/"):
+            row = self._conn().execute("SELECT body FROM documents WHERE url = ?", (url.rstrip("/"),)).fetchone()
+        return row[0] if row is not None else None
+
+    def stats(self) -> dict:
+        return {"path": self.path, "documents": self._conn().execute("SELECT COUNT(*) FROM documents").fetchone()[0]}
+
+
+@lru_cache(maxsize=None)
+def local_index(path: str) -> LocalSearch:
+    """The shared `LocalSearch` of an index file."""
+    return LocalSearch(path)
+
+
+def iter_corpus(paths: Iterable[str]) -> Iterator[SearchResult]:
+    """Read documents for the local index.
+
+    A `.jsonl` file holds one {url, title, text} (or {url, title, html}) object
+    per line. A directory is read as a site mirror (e.g. made with `wget -m`):
+    every .html/.htm/.txt file below it becomes a document whose URL is
+    `https://` plus its path relative to the directory.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if not name.lower().endswith((".html", ".htm", ".txt")):
+                        continue
+                    file_path = os.path.join(root, name)
+                    with open(file_path, encoding="utf-8", errors="replace") as f:
+                        content = f.read()
+                    rel = os.path.relpath(file_path, path).replace(os.sep, "/")
+                    if name.lower().endswith(".txt"):
+                        yield {"url": "https://" + rel, "title": name, "text": content}
+                    else:
+                        yield _html_document("https://" + rel, content, name)
+        else:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    doc = json.loads(line)
+                    if "html" in doc and "text" not in doc:
+                        yield _html_document(doc["url"], doc["html"], doc.get("title"))
+                    else:
+                        yield {"url": doc["url"], "title": doc.get("title", ""), "text": doc.get("text", "")}
+
+
+def _html_document(url: str, html: str, title: Optional[str] = None) -> SearchResult:
+    match = _TITLE.search(html)
+    if match:
+        title = " ".join(match.group(1).split())
+    extractor = HTMLTextExtractor(max_chars=None)
+    extractor.feed(html)
+    extractor.close()
+    return {"url": url, "title": title or url, "text": extractor.text()}
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Build or query the local full-text search index.")
+    parser.add_argument("command", choices=["index", "stats", "query"])
+    parser.add_argument("--path", "-p", type=str, default=DEFAULT_INDEX_PATH, help="The SQLite index file.")
+    parser.add_argument("--corpus", "-c", type=str, nargs="+", help="JSONL files or mirror directories to index.")
+    parser.add_argument("--query", "-q", type=str, help="A query to run against the index.")
+    parser.add_argument("--num_results", "-n", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "index":
+        if not args.corpus:
+            parser.error("index needs --corpus")
+        started = time.perf_counter()
+        count = LocalSearch.create(args.path).add_documents(iter_corpus(args.corpus))
+        logger.info(f"Indexed {count} documents in {time.perf_counter() - started:.1f}s")
+    elif args.command == "query":
+        if not args.query:
+            parser.error("query needs --query")
+        started = time.perf_counter()
+        results = LocalSearch(args.path).search(args.query, args.num_results)
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        logger.info(f"{len(results)} results in {(time.perf_counter() - started) * 1000:.1f}ms")
+    print(json.dumps(LocalSearch(args.path).stats(), indent=2))
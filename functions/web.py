@@ -1,12 +1,15 @@
 """Web search and digest functions replacing AgentScope's built-in services."""
 
-import os
-from typing import Optional
+from core.toolkit import ServiceExecStatus, ServiceResponse
+from functions.http import DEFAULT_MAX_CHARS, TRUNCATED, get_client
+from functions.search import DEFAULT_INDEX_PATH, BingSearch, GoogleSearch, SearchBackend, local_index
 
-import requests
-from bs4 import BeautifulSoup
 
-from core.toolkit import ServiceExecStatus, ServiceResponse
+def _search(backend: SearchBackend, query: str, num_results: int) -> ServiceResponse:
+    try:
+        return ServiceResponse(ServiceExecStatus.SUCCESS, backend.search(query, num_results))
+    except Exception as e:
+        return ServiceResponse(ServiceExecStatus.ERROR, str(e))
 
 
 def bing_search(query: str, api_key: str, num_results: int = 10) -> ServiceResponse:
@@ -22,26 +25,7 @@ def bing_search(query: str, api_key: str, num_results: int = 10) -> ServiceRespo
     Returns:
         `ServiceResponse`: Search results with status and content.
     """
-    url = "https://api.bing.microsoft.com/v7.0/search"
-    headers = {"Ocp-Apim-Subscription-Key": api_key}
-    params = {"q": query, "count": num_results, "textDecorations": True, "textFormat": "HTML"}
-
-    try:
-        resp = requests.get(url, headers=headers, params=params, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
-
-        results = []
-        for item in data.get("webPages", {}).get("value", []):
-            results.append({
-                "title": item.get("name", ""),
-                "url": item.get("url", ""),
-                "snippet": item.get("snippet", ""),
-            })
-
-        return ServiceResponse(ServiceExecStatus.SUCCESS, results)
-    except Exception as e:
-        return ServiceResponse(ServiceExecStatus.ERROR, str(e))
+    return _search(BingSearch(api_key), query, num_results)
 
 
 def google_search(
@@ -64,25 +48,23 @@ def google_search(
     Returns:
         `ServiceResponse`: Search results with status and content.
     """
-    url = "https://www.googleapis.com/customsearch/v1"
-    params = {"key": api_key, "cx": cse_id, "q": query, "num": min(num_results, 10)}
+    return _search(GoogleSearch(api_key, cse_id), query, num_results)
 
-    try:
-        resp = requests.get(url, params=params, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
 
-        results = []
-        for item in data.get("items", []):
-            results.append({
-                "title": item.get("title", ""),
-                "url": item.get("link", ""),
-                "snippet": item.get("snippet", ""),
-            })
-
-        return ServiceResponse(ServiceExecStatus.SUCCESS, results)
-    except Exception as e:
-        return ServiceResponse(ServiceExecStatus.ERROR, str(e))
+def local_search(query: str, index_path: str = DEFAULT_INDEX_PATH, num_results: int = 10) -> ServiceResponse:
+    """
+    Search the web pages of a local full-text index.
+    Args:
+        query (`str`):
+            The search query string.
+        index_path (`str`):
+            The SQLite index built by `python -m functions.search index`.
+        num_results (`int`, defaults to `10`):
+            The number of results to return.
+    Returns:
+        `ServiceResponse`: Search results with status and content.
+    """
+    return _search(local_index(index_path), query, num_results)
 
 
 def digest_webpage(url: str) -> ServiceResponse:
@@ -95,28 +77,30 @@ def digest_webpage(url: str) -> ServiceResponse:
         `ServiceResponse`: The extracted text content with status.
     """
     try:
-        headers = {
-            "User-Agent": (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/120.0.0.0 Safari/537.36"
-            )
-        }
-        resp = requests.get(url, headers=headers, timeout=30)
-        resp.raise_for_status()
-
-        soup = BeautifulSoup(resp.text, "html.parser")
-
-        # Remove script and style elements
-        for tag in soup(["script", "style", "nav", "footer", "header"]):
-            tag.decompose()
-
-        text = soup.get_text(separator="\n", strip=True)
+        # Only the head of the page is downloaded and parsed, up to the text budget
+        text, truncated = get_client().fetch_text(url, max_chars=DEFAULT_MAX_CHARS)
+        return ServiceResponse(ServiceExecStatus.SUCCESS, text + TRUNCATED if truncated else text)
+    except Exception as e:
+        return ServiceResponse(ServiceExecStatus.ERROR, str(e))
 
-        # Truncate if too long
-        if len(text) > 8000:
-            text = text[:8000] + "\n...[truncated]"
 
-        return ServiceResponse(ServiceExecStatus.SUCCESS, text)
+def local_digest_webpage(url: str, index_path: str = DEFAULT_INDEX_PATH) -> ServiceResponse:
+    """
+    Read the text content of a webpage from a local full-text index.
+    Args:
+        url (`str`):
+            The URL of the webpage to digest, as returned by the search.
+        index_path (`str`):
+            The SQLite index built by `python -m functions.search index`.
+    Returns:
+        `ServiceResponse`: The extracted text content with status.
+    """
+    try:
+        text = local_index(index_path).document(url)
     except Exception as e:
         return ServiceResponse(ServiceExecStatus.ERROR, str(e))
+    if text is None:
+        return ServiceResponse(ServiceExecStatus.ERROR, f"{url} is not in the local search index.")
+    if len(text) > DEFAULT_MAX_CHARS:
+        text = text[:DEFAULT_MAX_CHARS] + TRUNCATED
+    return ServiceResponse(ServiceExecStatus.SUCCESS, text)
@@ -6,30 +6,106 @@ from agents.retriever import Retriever
 from agents.profiler import Profiler
 from agents.summarizer import Summarizer
 from agents.tagger import Tagger
+from core.cache import ResponseCache
+from core.mock import MockBackend
+from core.ratelimit import RateLimiter
+from core.telemetry import JsonlSink
 from core.toolkit import ServiceToolkit
 
-from functions.web import bing_search, digest_webpage
+from functions.search import DEFAULT_INDEX_PATH
+from functions.web import bing_search, digest_webpage, google_search, local_digest_webpage, local_search
 from config.web_api import GOOGLE_API_KEY, GOOGLE_ID, BING_API_KEY
-from functions.local import get_new_history, get_related_history, get_all_history
+from functions.local import count_history_tokens, get_new_history, get_related_history, get_all_history
 
 from util.prompt_loader import SYS_PROMPT
 
 
-def init_retriever(user_history, knowledge_base, visited_history, count_token, model_name="gpt-4o", api_key=None):
+WEB_CACHE_TTL = 7 * 86400
+
+
+def init_client_kwargs(config):
+    """
+    Build the LLM client options shared by all agents from a model config
+    """
+    kwargs = {}
+    if config.get("stream"):
+        kwargs["stream"] = True
+    if config.get("prompt_caching"):
+        kwargs["prompt_caching"] = True
+    if config.get("structured_output"):
+        kwargs["structured_output"] = True
+    if config.get("native_tools"):
+        kwargs["native_tools"] = True
+    if config.get("context_window"):
+        kwargs["context_window"] = config["context_window"]
+    cache = ResponseCache.from_config(config)
+    if cache is not None:
+        kwargs["cache"] = cache
+    limiter = RateLimiter.from_config(config)
+    if limiter is not None:
+        kwargs["limiter"] = limiter
+    backend = MockBackend.from_config(config)
+    if backend is not None:
+        kwargs["backend"] = backend
+    if config.get("telemetry_path"):
+        kwargs["telemetry"] = JsonlSink(config["telemetry_path"])
+    return kwargs
+
+
+def init_retriever(
+    user_history, history_retriever, visited_history, count_token, model_name="gpt-4o", api_key=None, tool_cache=None,
+    history_page_tokens=4000, search_backend="bing", search_index_path=None, **client_kwargs,
+):
     """
     Initialize the retriever agent
     """
     # Prepare the tools for the agent
-    service_toolkit = ServiceToolkit()
-    # service_toolkit.add(google_search, api_key=GOOGLE_API_KEY, cse_id=GOOGLE_ID, num_results=20)
-    service_toolkit.add(bing_search, api_key=BING_API_KEY, num_results=20)
-    service_toolkit.add(digest_webpage)
-    service_toolkit.add(get_all_history, synthpai_history=user_history)
-    service_toolkit.add(get_new_history, synthpai_history=user_history, visited=visited_history, n=5)
-    service_toolkit.add(get_related_history, synthpai_history=user_history, knowledge=knowledge_base, top_k=5)
+    service_toolkit = ServiceToolkit(cache=tool_cache)
+    if search_backend == "local":
+        # The offline index answers both searches and page reads from local disk
+        index_path = search_index_path or DEFAULT_INDEX_PATH
+        service_toolkit.add(local_search, index_path=index_path, num_results=20)
+        service_toolkit.add(local_digest_webpage, index_path=index_path)
+    elif search_backend in ("bing", "google"):
+        # Web results are shared across users (and runs, with a disk cache) for a week
+        if search_backend == "google":
+            service_toolkit.add(
+                google_search, timeout=60, cache=True, cache_ttl=WEB_CACHE_TTL,
+                api_key=GOOGLE_API_KEY, cse_id=GOOGLE_ID, num_results=20,
+            )
+        else:
+            service_toolkit.add(
+                bing_search, timeout=60, cache=True, cache_ttl=WEB_CACHE_TTL, api_key=BING_API_KEY, num_results=20
+            )
+        service_toolkit.add(digest_webpage, timeout=60, cache=True, cache_ttl=WEB_CACHE_TTL)
+    else:
+        raise ValueError(f"Unknown search backend '{search_backend}', expected bing, google or local")
+    if history_page_tokens is not None and history_page_tokens < 0:
+        raise ValueError(f"history_page_tokens should be positive, or 0/null for no budget, got {history_page_tokens}")
+    # Both history tools return as many whole comments as fit the page budget, counted once
+    # with the retriever's tokenizer, and mark them as visited, so their calls must not overlap
+    paging = dict(
+        synthpai_history=user_history,
+        visited=visited_history,
+        max_tokens=history_page_tokens or None,
+        history_tokens=count_history_tokens(user_history, model_name) if history_page_tokens else None,
+    )
+    service_toolkit.add(get_all_history, serial=True, **paging)
+    service_toolkit.add(get_new_history, serial=True, **paging)
+    # Bound to this user's retriever, so results are only reused within the run; the
+    # visited list is part of the key since it can filter the results
+    service_toolkit.add(
+        get_related_history,
+        cache=True,
+        cache_state=("visited",),
+        synthpai_history=user_history,
+        retriever=history_retriever,
+        visited=visited_history,
+        top_k=5,
+    )
 
     # Create agents
-    kwargs = {}
+    kwargs = dict(client_kwargs)
     if api_key:
         kwargs["api_key"] = api_key
     retriever = Retriever(
@@ -43,11 +119,11 @@ def init_retriever(user_history, knowledge_base, visited_history, count_token, m
     return retriever
 
 
-def init_profiler(target_attributes, count_token=False, model_name="gpt-4o", api_key=None):
+def init_profiler(target_attributes, count_token=False, model_name="gpt-4o", api_key=None, **client_kwargs):
     """
     Initialize the profiler agent
     """
-    kwargs = {}
+    kwargs = dict(client_kwargs)
     if api_key:
         kwargs["api_key"] = api_key
     # Create agents
@@ -62,11 +138,11 @@ def init_profiler(target_attributes, count_token=False, model_name="gpt-4o", api
     return profiler
 
 
-def init_tagger(model_name="gpt-4o", api_key=None):
+def init_tagger(model_name="gpt-4o", api_key=None, **client_kwargs):
     """Initialize the tagger agent."""
     from tagging import TAG_PROMPT
 
-    kwargs = {}
+    kwargs = dict(client_kwargs)
     if api_key:
         kwargs["api_key"] = api_key
     tagger = Tagger(
@@ -78,11 +154,11 @@ def init_tagger(model_name="gpt-4o", api_key=None):
     return tagger
 
 
-def init_summarizer(target_attributes, count_token, model_name="gpt-4o", api_key=None):
+def init_summarizer(target_attributes, count_token, model_name="gpt-4o", api_key=None, **client_kwargs):
     """
     Initialize the summarizer agent
     """
-    kwargs = {}
+    kwargs = dict(client_kwargs)
     if api_key:
         kwargs["api_key"] = api_key
     # Create agents
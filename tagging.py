@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 """Standalone tagging script: tags personal attributes in user comment history."""
 import argparse
+import asyncio
 import os
 
 import yaml
 
 from core.message import Msg
-from init_agents import init_tagger
+from init_agents import init_tagger, init_client_kwargs
 
 
 TAG_PROMPT = """
@@ -47,40 +48,77 @@ result: {the possible personal attributes names in text, separated by comma}
 """
 
 
-def run_tagging(target_user: str, model_name: str, api_key: str = None):
+def run_tagging(target_user: str, model_name: str, api_key: str = None, **client_kwargs):
     """Run tagging on all synthpai history files for a user."""
+    text_dir, target_dir = _tagging_dirs(target_user)
+
+    tagger = init_tagger(model_name=model_name, api_key=api_key, **client_kwargs)
+
+    for text_file in _untagged_files(text_dir, target_dir):
+        response = tagger.reply(_tagging_msg(text_dir, text_file))
+        _save_tags(target_dir, text_file, response.parsed["result"])
+
+
+async def arun_tagging(target_user: str, model_name: str, api_key: str = None, concurrency: int = 8, **client_kwargs):
+    """Async counterpart of `run_tagging` that tags up to `concurrency` files at once.
+
+    Each in-flight request uses its own `Tagger`, since agents keep per-call memory.
+    """
+    text_dir, target_dir = _tagging_dirs(target_user)
+
+    taggers = asyncio.Queue()
+    for _ in range(concurrency):
+        taggers.put_nowait(init_tagger(model_name=model_name, api_key=api_key, **client_kwargs))
+
+    async def tag_file(text_file):
+        tagger = await taggers.get()
+        try:
+            response = await tagger.areply(_tagging_msg(text_dir, text_file))
+        finally:
+            taggers.put_nowait(tagger)
+        _save_tags(target_dir, text_file, response.parsed["result"])
+
+    await asyncio.gather(*(tag_file(text_file) for text_file in _untagged_files(text_dir, target_dir)))
+
+
+def _tagging_dirs(target_user: str):
     text_dir = f"./dataset/synthpai/{target_user}"
     target_dir = f"./dataset/tag/{target_user}"
 
     if not os.path.exists(text_dir):
         raise FileNotFoundError(f"Source directory not found: {text_dir}")
+    return text_dir, target_dir
 
-    tagger = init_tagger(model_name=model_name, api_key=api_key)
-
-    dir_path = sorted(os.listdir(text_dir))
 
-    for text_file in dir_path:
+def _untagged_files(text_dir: str, target_dir: str) -> list:
+    files = []
+    for text_file in sorted(os.listdir(text_dir)):
         tag_path = os.path.join(target_dir, text_file)
         # Skip if tag file already exists
         if os.path.exists(tag_path):
             print(f"Tag file already exists, skipping: {tag_path}")
             continue
+        files.append(text_file)
+    return files
 
-        with open(os.path.join(text_dir, text_file), "r") as f:
-            content = f.read()
 
-        msg = Msg(
-            name="User",
-            role="user",
-            content=f"Please tag the personal attributes in the text:\n{content}",
-        )
-        response = tagger.reply(msg)
-        piis = response.parsed["result"]
+def _tagging_msg(text_dir: str, text_file: str) -> Msg:
+    with open(os.path.join(text_dir, text_file), "r") as f:
+        content = f.read()
+
+    return Msg(
+        name="User",
+        role="user",
+        content=f"Please tag the personal attributes in the text:\n{content}",
+    )
+
 
-        os.makedirs(target_dir, exist_ok=True)
-        with open(tag_path, "w") as f:
-            f.write(piis)
-        print(f"Tags saved to {tag_path}")
+def _save_tags(target_dir: str, text_file: str, piis: str) -> None:
+    tag_path = os.path.join(target_dir, text_file)
+    os.makedirs(target_dir, exist_ok=True)
+    with open(tag_path, "w") as f:
+        f.write(piis)
+    print(f"Tags saved to {tag_path}")
 
 
 if __name__ == "__main__":
@@ -97,4 +135,5 @@ if __name__ == "__main__":
         target_user=args.target_user,
         model_name=config["model"],
         api_key=config.get("api_key", None),
+        **init_client_kwargs(config),
     )
@@ -0,0 +1,116 @@
+"""Tests of the pooled HTTP client and the streaming text extraction against a local server."""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from core.toolkit import ServiceExecStatus, ServiceToolkit
+from functions.http import HTMLTextExtractor, HttpClient
+from functions.web import digest_webpage
+
+
+PARAGRAPH = "<p>" + "lorem ipsum dolor sit amet " * 4 + "</p>\n"
+BIG_PAGE = ("<html><head><script>var x = 1;</script></head><body>" + PARAGRAPH * 50_000 + "</body></html>").encode()
+SLOW_SECONDS = 0.5
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Bytes written per request path and the peak number of requests served at once
+    sent = {}
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            type(self).active += 1
+            type(self).peak = max(self.peak, self.active)
+        try:
+            if self.path.startswith("/slow"):
+                time.sleep(SLOW_SECONDS)
+                body = b"<html><body><p>slow page</p></body></html>"
+            else:
+                body = BIG_PAGE
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            written = 0
+            try:
+                for i in range(0, len(body), 64 * 1024):
+                    self.wfile.write(body[i : i + 64 * 1024])
+                    written += min(64 * 1024, len(body) - i)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            with self.lock:
+                self.sent[self.path] = written
+        finally:
+            with self.lock:
+                type(self).active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_byte_cap_stops_download(server):
+    assert len(BIG_PAGE) > 5 * 1024 * 1024
+    client = HttpClient()
+    text, truncated = client.fetch_text(f"{server}/big", max_chars=None, max_bytes=256 * 1024)
+
+    assert truncated
+    assert "lorem ipsum" in text
+    assert "var x" not in text
+    assert len(text) <= 256 * 1024
+    # The client hung up long before the multi-MB body was written
+    deadline = time.monotonic() + 5
+    while "/big" not in _Handler.sent and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert _Handler.sent.get("/big", 0) < len(BIG_PAGE)
+
+
+def test_extractor_stops_at_character_budget():
+    extractor = HTMLTextExtractor(max_chars=1000)
+    html = BIG_PAGE.decode()
+    for i in range(0, len(html), 4096):
+        extractor.feed(html[i : i + 4096])
+        if extractor.done:
+            break
+
+    assert extractor.done
+    # Parsing stopped within the first chunks, not at the end of the page
+    assert i < 16 * 4096
+    assert 1000 < len(extractor.text()) <= 1000 + len(PARAGRAPH)
+
+
+def test_fetch_text_keeps_character_budget(server):
+    text, truncated = HttpClient().fetch_text(f"{server}/big?budget", max_chars=500)
+
+    assert truncated
+    assert len(text) == 500
+
+
+def test_digest_calls_fetch_concurrently(server):
+    toolkit = ServiceToolkit(max_workers=4)
+    toolkit.add(digest_webpage)
+    calls = [{"name": "digest_webpage", "arguments": {"url": f"{server}/slow/{i}"}} for i in range(4)]
+
+    started = time.perf_counter()
+    responses = toolkit.parse_and_call_func(calls)
+    elapsed = time.perf_counter() - started
+
+    assert [r.status for r in responses] == [ServiceExecStatus.SUCCESS] * 4
+    assert all(r.content == "slow page" for r in responses)
+    assert _Handler.peak >= 2
+    assert elapsed < 4 * SLOW_SECONDS
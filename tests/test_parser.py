@@ -0,0 +1,177 @@
+"""Tests of the JSON repair layers, the response parser and the streamed JSON block detection."""
+
+import json
+
+import pytest
+
+from core.exceptions import ResponseParsingError
+from core.json_repair import load_literal, repair_json
+from core.parser import JsonBlockDetector, MarkdownJsonDictParser
+from core.pii import parse_pii_results
+
+
+# The hints of the profiler's reason step; `results` is shown as a Python-quoted list
+REASON_HINT = {
+    "think": "what do you think about the situation",
+    "results": str([{"type": "{attribute name}", "confidence": "{confidence score}", "evidence": "{clue for guessing}", "guess": "{inferred information}"}]),
+}
+THINK_HINT = {
+    "think": "what do you think about the situation",
+    "action": "what to do next (reason|retrieval|search|finish)",
+    "instruction": "the command for next action",
+}
+RESULT = {"type": "age", "confidence": 4, "evidence": "mentions turning 30", "guess": ["30"]}
+
+
+def _feed(text, chunk_size):
+    """Stream `text` into a detector; return how much was fed when it closed, or None."""
+    detector = JsonBlockDetector()
+    for i in range(0, len(text), chunk_size):
+        if detector.feed(text[i : i + chunk_size]):
+            return min(i + chunk_size, len(text))
+    return None
+
+
+@pytest.mark.parametrize(
+    "text, repair",
+    [
+        ('{"a": [1, 2], "b": "x"}', []),
+        ("{'a': [1, 2], 'b': 'x'}", ["python_literal"]),
+        ('{"a": [1, 2,], "b": "x", // note\n}', ["syntax"]),
+        ('{"a": [1, 2], "b": \'x\', "c": true}', ["single_quotes"]),
+        ('{"a": [1, 2], "b": "x", "c": "trunc', ["balance"]),
+        ('{a: [1, 2], b: "x"}', ["dirtyjson"]),
+    ],
+)
+def test_repair_layers(text, repair):
+    result = repair_json(f"```json\n{text}\n```")
+
+    assert result.repairs == repair
+    assert result.value["a"] == [1, 2]
+    assert result.value["b"] == "x"
+
+
+def test_balance_drops_dangling_member():
+    result = repair_json('{"a": 1, "b": [{"c": 2}], "d": ')
+
+    assert result.repairs == ["balance"]
+    assert result.value == {"a": 1, "b": [{"c": 2}]}
+
+
+def test_later_block_with_required_keys_wins():
+    text = 'Example:\n```json\n{"think": "x"}\n```\nAnswer:\n```json\n{"think": "y", "action": "finish", "instruction": ""}\n```'
+    parser = MarkdownJsonDictParser(THINK_HINT, required_keys=list(THINK_HINT))
+
+    assert parser.parse(text)["think"] == "y"
+    assert parser.last_repairs == ["later_block"]
+
+
+def test_unparsable_response_raises():
+    parser = MarkdownJsonDictParser(THINK_HINT, required_keys=list(THINK_HINT))
+
+    with pytest.raises(ResponseParsingError):
+        parser.parse("I cannot answer this.")
+
+
+def test_load_literal_rejects_partial_text():
+    assert load_literal("[{'a': 1}]") == [{"a": 1}]
+    with pytest.raises(ValueError):
+        load_literal("[{'a': 1}] and more")
+    with pytest.raises(ValueError):
+        load_literal('[{"a": 1')
+
+
+def test_only_list_hinted_keys_are_nested():
+    assert MarkdownJsonDictParser(REASON_HINT).nested_keys == ["results"]
+    assert MarkdownJsonDictParser(THINK_HINT).nested_keys == []
+
+
+@pytest.mark.parametrize(
+    "results",
+    [
+        # The hint copied as a Python literal inside valid JSON
+        repr([RESULT]),
+        # The same list JSON-encoded into a string
+        '[{"type": "age", "confidence": 4, "evidence": "mentions turning 30", "guess": ["30"]}]',
+    ],
+)
+def test_string_encoded_results_are_expanded_in_valid_json(results):
+    text = "```json\n" + json.dumps({"think": "the user is 30", "results": results}) + "\n```"
+    parser = MarkdownJsonDictParser(REASON_HINT, required_keys=["results"])
+
+    parsed = parser.parse(text)
+
+    assert parser.last_repairs == ["nested_literal"]
+    assert parsed["results"] == [RESULT]
+    records = parse_pii_results(parsed["results"], ["age"])
+    assert [(r.type, r.guess) for r in records] == [("age", ("30",))]
+
+
+def test_python_literal_results_are_expanded():
+    text = "```json\n{'think': 'x', 'results': \"[{'type': 'age', 'confidence': 4, 'evidence': 'e', 'guess': ['30']}]\"}\n```"
+    parser = MarkdownJsonDictParser(REASON_HINT, required_keys=["results"])
+
+    parsed = parser.parse(text)
+
+    assert parser.last_repairs == ["python_literal", "nested_literal"]
+    assert parsed["results"][0]["guess"] == ["30"]
+
+
+def test_incomplete_results_literal_is_kept():
+    text = '```json\n{"think": "x", "results": "[{\'type\': \'age\'"}\n```'
+    parser = MarkdownJsonDictParser(REASON_HINT, required_keys=["results"])
+
+    assert parser.parse(text)["results"] == "[{'type': 'age'"
+    assert parser.last_repairs == []
+
+
+def test_prose_values_are_kept():
+    think = "[Step 1] check the comments, then {summarize} them"
+    instruction = "['location', 'age'] are still unknown"
+    text = "```json\n" + f'{{"think": "{think}", "action": "retrieval", "instruction": "{instruction}"}}' + "\n```"
+    parser = MarkdownJsonDictParser(THINK_HINT, required_keys=list(THINK_HINT))
+
+    parsed = parser.parse(text)
+
+    assert parsed["think"] == think
+    assert parsed["instruction"] == instruction
+    assert parser.last_repairs == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1000])
+def test_detector_skips_prose_brace_before_fence(chunk_size):
+    text = 'I will use the {name} placeholder.\n```json\n{"a": 1}\n```\nMore text.'
+
+    assert _feed(text, chunk_size) >= text.index("```\n") + 3
+
+
+def test_detector_prose_brace_does_not_close():
+    detector = JsonBlockDetector()
+
+    assert not detector.feed("I will use the {name} placeholder.\n")
+    assert not detector.feed("Let me think about {this}.\n")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1000])
+def test_detector_skips_closed_block_that_is_not_json(chunk_size):
+    text = '```python\nprint(1)\n```\nThen:\n```json\n{"a": 1}\n```'
+
+    closed_at = _feed(text, chunk_size)
+
+    assert closed_at is not None
+    assert closed_at > text.index("```json")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1000])
+def test_detector_closes_bare_object(chunk_size):
+    text = 'Here:\n{"a": {"b": "}"}}\nafter'
+
+    closed_at = _feed(text, chunk_size)
+
+    assert closed_at is not None
+    assert closed_at >= text.index("\nafter")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_detector_ignores_bare_object_after_fence(chunk_size):
+    assert _feed('```python\nx\n```\n{"a": 1}', chunk_size) is None
@@ -17,6 +17,22 @@ attr_docs = {
 }
 
 
+# JSON schema of the inferred-attribute lists returned by the profiler and summarizer
+PII_RESULTS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "type": {"type": "string", "description": "attribute name"},
+            "confidence": {"type": "number", "description": "confidence score (1-5)"},
+            "evidence": {"type": "string", "description": "clue for guessing"},
+            "guess": {"type": "array", "items": {"type": "string"}, "description": "top 3 guesses"},
+        },
+        "required": ["type", "confidence", "evidence", "guess"],
+    },
+}
+
+
 def attr_converter(attr: list, type):
     attr_info = [attr_docs[a] for a in attr]
     if type == "string":